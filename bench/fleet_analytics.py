@@ -0,0 +1,178 @@
+"""
+    Daily fleet report of src/analytics.py (NumPy over whole arrays) against the same measures computed row by row in
+    plain Python with geo.haversine().
+
+    Generates one synthetic track of N fixes 15 s apart: drives at 5-30 m/s with a wandering heading, parks for
+    5-60 min with a few metres of jitter, sleeps for an hour now and then, and has the odd GPS glitch. The baseline
+    runs on the first --baseline-points fixes and both methods must agree on them.
+
+    Usage:
+        python bench/fleet_analytics.py [--points 10000000] [--baseline-points 500000]
+"""
+import argparse
+import math
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+import analytics
+import geo
+from trips import TRIP_GAP_SECONDS, TRIP_STATIONARY_SECONDS
+
+STEP_SECONDS = 15
+METRES_PER_DEGREE = math.radians(1) * geo.EARTH_RADIUS_M
+
+
+def make_track(count, seed):
+    rng = np.random.default_rng(seed)
+
+    # Skiftevis kørsel og parkering, målt i antal fix
+    phases = rng.integers(20, 240, size=count // 20 + 2)
+    driving = np.arange(len(phases)) % 2 == 0
+    phase = np.repeat(np.arange(len(phases)), phases)[:count]
+    moving = driving[phase]
+
+    speed = np.where(moving, rng.uniform(5, 30, count), 0.0)
+    heading = np.cumsum(rng.normal(0, 0.15, count))
+    north = speed * STEP_SECONDS * np.cos(heading)
+    east = speed * STEP_SECONDS * np.sin(heading)
+
+    lat = 55.7 + np.cumsum(north) / METRES_PER_DEGREE
+    lat = 56.5 - np.abs((lat - 56.5) % 4 - 2)
+    long = 10.0 + np.cumsum(east) / (METRES_PER_DEGREE * np.cos(np.radians(lat)))
+    long = 10.0 - np.abs((long - 10.0) % 6 - 3)
+    lat += rng.normal(0, 3, count) / METRES_PER_DEGREE * ~moving
+    long += rng.normal(0, 3, count) / METRES_PER_DEGREE * ~moving
+
+    glitches = rng.random(count) < 0.0005
+    lat[glitches] += 0.05
+
+    steps = np.full(count, STEP_SECONDS * 1_000_000, dtype=np.int64)
+    steps[rng.random(count) < 0.002] = 3600 * 1_000_000
+    stamps = np.datetime64("2025-01-01T00:00:00", "us") + np.cumsum(steps).astype("timedelta64[us]")
+    return lat, long, stamps
+
+
+def cell(lat, long, size_m):
+    step = math.degrees(size_m / geo.EARTH_RADIUS_M)
+    row = math.floor(lat / step)
+    return row, math.floor(long * math.cos(math.radians((row + 0.5) * step)) / step)
+
+
+def python_report(points):
+    """
+        The measures of analytics.daily_report() over (latitude, longitude, datetime) tuples, one fix at a time.
+    """
+    days = {}
+
+    def day_of(timestamp):
+        key = timestamp.date().isoformat()
+        if key not in days:
+            days[key] = {"date": key, "points": 0, "distance_m": 0.0, "moving_s": 0.0, "idle_s": 0.0, "max_speed_ms": 0.0,
+                         "moving_m": 0.0, "dwells": 0, "dwell_s": 0.0, "longest_dwell_s": 0.0, "cells": set()}
+        return days[key]
+
+    previous = None
+    run_start = run_cell = None
+    for point in points:
+        lat, long, timestamp = point
+        day = day_of(timestamp)
+        day["points"] += 1
+        day["cells"].add(cell(lat, long, analytics.ANALYTICS_COVERAGE_CELL_M))
+
+        dwell_cell = cell(lat, long, analytics.ANALYTICS_DWELL_CELL_M)
+        if dwell_cell != run_cell:
+            if run_start is not None:
+                end_dwell(day_of(run_start[2]), run_start, previous)
+            run_start, run_cell = point, dwell_cell
+
+        if previous is not None:
+            distance = geo.haversine(previous[0], previous[1], lat, long)
+            elapsed = (timestamp - previous[2]).total_seconds()
+            speed = distance / elapsed if elapsed > 0 else (math.inf if distance > 0 else 0.0)
+            if speed <= analytics.ANALYTICS_MAX_SPEED:
+                day["distance_m"] += distance
+                if 0 < elapsed <= TRIP_GAP_SECONDS:
+                    day["max_speed_ms"] = max(day["max_speed_ms"], speed)
+                    if speed > analytics.ANALYTICS_IDLE_SPEED:
+                        day["moving_s"] += elapsed
+                        day["moving_m"] += distance
+                    else:
+                        day["idle_s"] += elapsed
+        previous = point
+
+    if run_start is not None:
+        end_dwell(day_of(run_start[2]), run_start, previous)
+
+    for day in days.values():
+        day["avg_speed_ms"] = day.pop("moving_m") / day["moving_s"] if day["moving_s"] else 0.0
+        day["cells"] = len(day["cells"])
+        day["coverage_km2"] = day["cells"] * (analytics.ANALYTICS_COVERAGE_CELL_M / 1000) ** 2
+    return [days[key] for key in sorted(days)]
+
+
+def end_dwell(day, first, last):
+    duration = (last[2] - first[2]).total_seconds()
+    if duration >= TRIP_STATIONARY_SECONDS:
+        day["dwells"] += 1
+        day["dwell_s"] += duration
+        day["longest_dwell_s"] = max(day["longest_dwell_s"], duration)
+
+
+def compare(vectorized, baseline):
+    """
+        Largest relative difference between the two reports; grid cells on a border may land on either side
+        with float rounding, so cell counts are allowed a small difference.
+    """
+    if [day["date"] for day in vectorized] != [day["date"] for day in baseline]:
+        return math.inf
+    worst = 0.0
+    for a, b in zip(vectorized, baseline):
+        for key in a:
+            if key != "date":
+                worst = max(worst, abs(a[key] - b[key]) / max(abs(b[key]), 1.0))
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=10_000_000)
+    parser.add_argument("--baseline-points", type=int, default=500_000, help="fixes for the (slow) pure Python baseline")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    lat, long, stamps = make_track(args.points, args.seed)
+    print("[+] Generated %d fixes over %d days in %.1f s" % (args.points, (stamps[-1] - stamps[0]) / np.timedelta64(1, 'D'),
+                                                             time.perf_counter() - started))
+
+    started = time.perf_counter()
+    report = analytics.daily_report(lat, long, stamps)
+    vectorized = time.perf_counter() - started
+
+    sample = args.baseline_points
+    points = list(zip(lat[:sample].tolist(), long[:sample].tolist(), stamps[:sample].astype(datetime)))
+    started = time.perf_counter()
+    baseline = python_report(points)
+    python = time.perf_counter() - started
+
+    difference = compare(analytics.daily_report(lat[:sample], long[:sample], stamps[:sample]), baseline)
+
+    vectorized_rate = args.points / vectorized
+    python_rate = len(points) / python
+    print("numpy   %12.0f points/s   %8.2f s for %d points (%d days)" % (vectorized_rate, vectorized, args.points, len(report)))
+    print("python  %12.0f points/s   %8.2f s for %d points (%.0f s projected)" % (python_rate, python, len(points), args.points / python_rate))
+    print("speedup %11.0fx   largest relative difference: %.2g" % (vectorized_rate / python_rate, difference))
+
+    if difference > 1e-3:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
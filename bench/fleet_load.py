@@ -0,0 +1,287 @@
+"""
+    Fleet load test for the Flask handler in src/server.py.
+
+    Provisions N trackers through "tracker id request", then lets ingest threads send "received coords" payloads
+    built and signed exactly like HTTPServer.send_data in src/tracker_esp.py, while app-client threads poll "get coords"
+    with session tokens. Reports throughput and p50/p95/p99 latency per subject, plus the time spent in the database
+    per request, and saves the results as JSON so runs on different versions can be compared.
+
+    Usage:
+        python bench/fleet_load.py --trackers 200 --duration 30                    In-process against a fresh SQLite database
+        python bench/fleet_load.py --db mysql --trackers 200                       In-process against the local MySQL
+        python bench/fleet_load.py --url http://localhost:13371/ --trackers 200    Against a running server (no DB timing;
+                                                                                   start it with RATE_LIMITING=0)
+        python bench/fleet_load.py ... --compare bench/results/<previous>.json     Flag regressions against an earlier run
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+REGRESSION_FACTOR = 1.2
+
+
+def signature_headers(body, tracker_id, token_key):
+    """
+        Same signing as post_signed in src/tracker_esp.py: HMAC-SHA256 over the raw body, sent in headers.
+    """
+    signature = hmac.new(token_key.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return {'X-Tracker-Id': tracker_id, 'X-Signature': signature}
+
+
+class DBTimer:
+    """
+        Accumulates the time each thread spends in DatabaseConnection calls, so requests can report their DB share.
+    """
+    def __init__(self):
+        self.local = threading.local()
+
+    def install(self, connection_class):
+        for name in ("execute_query", "execute_many", "commit"):
+            original = getattr(connection_class, name)
+
+            def timed(*args, _original=original, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return _original(*args, **kwargs)
+                finally:
+                    self.local.elapsed = getattr(self.local, 'elapsed', 0.0) + time.perf_counter() - started
+
+            setattr(connection_class, name, timed)
+
+    def take(self):
+        elapsed = getattr(self.local, 'elapsed', 0.0)
+        self.local.elapsed = 0.0
+        return elapsed
+
+
+class InProcessClient:
+    def __init__(self, app, db_timer):
+        self.app = app
+        self.db_timer = db_timer
+        self.local = threading.local()
+
+    def post(self, packet, token_key=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+
+        body = json.dumps(packet).encode('utf-8')
+        headers = signature_headers(body, packet['tracker_id'], token_key) if token_key else {}
+        self.db_timer.take()
+        response = client.post('/', data=body, headers=headers, content_type='application/json')
+        return response.status_code, response.get_json(), self.db_timer.take()
+
+
+class HTTPClient:
+    def __init__(self, url):
+        import requests
+        self.url = url
+        self.session_factory = requests.Session
+        self.local = threading.local()
+
+    def post(self, packet, token_key=None):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = self.session_factory()
+
+        body = json.dumps(packet).encode('utf-8')
+        headers = signature_headers(body, packet['tracker_id'], token_key) if token_key else {}
+        headers['Content-Type'] = 'application/json'
+        response = session.post(self.url, data=body, headers=headers, verify=False)
+        return response.status_code, response.json(), None
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, subject, latency, db_time, ok):
+        with self.lock:
+            self.samples.setdefault(subject, []).append((latency, db_time, ok))
+
+    def summary(self, duration):
+        def percentile(values, p):
+            return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+        report = {}
+        for subject, samples in sorted(self.samples.items()):
+            latencies = sorted(sample[0] for sample in samples)
+            db_times = [sample[1] for sample in samples if sample[1] is not None]
+            report[subject] = {
+                "requests": len(samples),
+                "errors": sum(1 for sample in samples if not sample[2]),
+                "throughput_rps": len(samples) / duration,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "db_ms_mean": sum(db_times) / len(db_times) * 1000 if db_times else None,
+            }
+        return report
+
+
+def provision(client, count, workers):
+    """
+        Creates trackers through the public subject, the same way a freshly flashed device does.
+    """
+    def one(_):
+        status, body, _ = client.post({'data': 'tracker id request'})
+        if status != 200:
+            raise RuntimeError("tracker id request failed: %s %s" % (status, body))
+        return body['tracker_id'], body['token_key']
+
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(one, range(count)))
+
+
+def login_clients(client, trackers, password):
+    sessions = []
+    for tracker_id, token_key in trackers:
+        client.post({'data': 'update password request', 'tracker_id': tracker_id, 'tracker_password': password}, token_key)
+        status, body, _ = client.post({'data': 'login request', 'tracker_id': tracker_id, 'password': password})
+        if status != 200:
+            raise RuntimeError("login request failed: %s %s" % (status, body))
+        sessions.append((tracker_id, body['session_token']))
+    return sessions
+
+
+def run_load(client, trackers, sessions, args):
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+
+    def ingest_worker(seed):
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            tracker_id, token_key = rng.choice(trackers)
+            lat, long = 55.0 + rng.random(), 12.0 + rng.random()
+
+            if args.batch > 1:
+                now = int(time.time())
+                fixes = [{'coords_lat': f"{lat + i * 1e-4}", 'coords_long': f"{long}", 'timestamp': now - args.batch + i} for i in range(args.batch)]
+                packet = {'data': 'received coords batch', 'fixes': fixes, 'tracker_id': tracker_id}
+            else:
+                packet = {'data': 'received coords', 'coords_lat': f"{lat}", 'coords_long': f"{long}", 'tracker_id': tracker_id}
+
+            started = time.perf_counter()
+            status, _, db_time = client.post(packet, token_key)
+            recorder.record(packet['data'], time.perf_counter() - started, db_time, status in (200, 202))
+
+    def app_worker(seed):
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            tracker_id, session_token = rng.choice(sessions)
+            started = time.perf_counter()
+            status, _, db_time = client.post({'data': 'get coords', 'tracker_id': tracker_id, 'session_token': session_token})
+            recorder.record('get coords', time.perf_counter() - started, db_time, status in (200, 404))
+            if args.poll_interval:
+                time.sleep(args.poll_interval)
+
+    threads = [threading.Thread(target=ingest_worker, args=(i,)) for i in range(args.ingest_threads)]
+    threads += [threading.Thread(target=app_worker, args=(1000 + i,)) for i in range(args.client_threads if sessions else 0)]
+
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return recorder.summary(time.monotonic() - started)
+
+
+def compare(report, previous_path):
+    """
+        Prints the p95 and throughput change per subject; returns True if any subject regressed.
+    """
+    with open(previous_path) as file:
+        previous = json.load(file)["subjects"]
+
+    regressed = False
+    for subject, stats in report.items():
+        before = previous.get(subject)
+        if before is None:
+            continue
+
+        slower = stats["p95_ms"] > before["p95_ms"] * REGRESSION_FACTOR
+        fewer = stats["throughput_rps"] * REGRESSION_FACTOR < before["throughput_rps"]
+        regressed = regressed or slower or fewer
+        print("%s %-24s p95 %8.2f -> %8.2f ms   throughput %8.1f -> %8.1f req/s" % (
+            "[!]" if slower or fewer else "[+]", subject, before["p95_ms"], stats["p95_ms"],
+            before["throughput_rps"], stats["throughput_rps"]))
+    return regressed
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trackers", type=int, default=100)
+    parser.add_argument("--clients", type=int, default=10, help="trackers that also get a logged-in app client")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--ingest-threads", type=int, default=8)
+    parser.add_argument("--client-threads", type=int, default=4)
+    parser.add_argument("--poll-interval", type=float, default=0, help="seconds between polls per app-client thread")
+    parser.add_argument("--batch", type=int, default=1, help="fixes per upload; >1 uses received coords batch")
+    parser.add_argument("--db", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--url", help="benchmark a running server over HTTP instead of in-process")
+    parser.add_argument("--output", help="result file (default bench/results/fleet-<time>-<rev>.json)")
+    parser.add_argument("--compare", help="earlier result file to check for regressions")
+    args = parser.parse_args()
+
+    if args.url:
+        client = HTTPClient(args.url)
+    else:
+        # Hele flåden kommer fra én adresse
+        os.environ.setdefault("RATE_LIMITING", "0")
+        if args.db == "sqlite":
+            os.environ["DB_BACKEND"] = "sqlite"
+            os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="fleet-bench-"), "biltracker.db")
+
+        import server
+        db_timer = DBTimer()
+        db_timer.install(type(server.data_handler.db_connection))
+        client = InProcessClient(server.app, db_timer)
+
+    print("[+] Provisioning %d trackers..." % args.trackers)
+    trackers = provision(client, args.trackers, workers=64)
+    sessions = login_clients(client, trackers[:args.clients], password="bench-password")
+
+    print("[+] Running load for %.0f seconds..." % args.duration)
+    report = run_load(client, trackers, sessions, args)
+
+    for subject, stats in report.items():
+        db = "%.2f" % stats["db_ms_mean"] if stats["db_ms_mean"] is not None else "n/a"
+        print("%-24s %7d req %5d err %9.1f req/s   p50 %7.2f  p95 %7.2f  p99 %7.2f ms   db %s ms" % (
+            subject, stats["requests"], stats["errors"], stats["throughput_rps"],
+            stats["p50_ms"], stats["p95_ms"], stats["p99_ms"], db))
+
+    revision = git_revision()
+    output = args.output or os.path.join(BENCH_DIR, "results", "fleet-%s-%s.json" % (datetime.now().strftime("%Y%m%d-%H%M%S"), revision))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump({"revision": revision, "timestamp": datetime.now().isoformat(), "config": vars(args), "subjects": report}, file, indent=2)
+    print("[+] Results saved to %s" % output)
+
+    if args.compare and compare(report, args.compare):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
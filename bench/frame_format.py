@@ -0,0 +1,118 @@
+"""
+    Size and decode cost of the binary upload frame (src/binary_frame.py) against the JSON uploads it replaces.
+
+    For 1, 10 and 100 fixes per upload, compares:
+        json-legacy   "received coords"/"received coords batch" with "hmac" inside the JSON (re-serialized on verify)
+        json-header   the same JSON signed over the raw body (X-Signature header, header bytes counted)
+        frame         binary_frame.encode()
+
+    Decode cost covers everything the server does before the insert: signature check, parsing and turning the fixes
+    into (latitude, longitude, timestamp) floats. No database is involved.
+
+    Usage:
+        python bench/frame_format.py [--iterations 20000]
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+import binary_frame
+
+TRACKER_ID = "Tracker#26349"
+TOKEN_KEY = "3f" * 32
+
+
+def make_fixes(count, seed=1):
+    rng = random.Random(seed)
+    return [(55.0 + rng.random(), 12.0 + rng.random(), 1729238400 + i * 15) for i in range(count)]
+
+
+def json_packet(fixes):
+    if len(fixes) == 1:
+        lat, long, _ = fixes[0]
+        return {'data': 'received coords', 'coords_lat': f"{lat}", 'coords_long': f"{long}", 'tracker_id': TRACKER_ID}
+    return {'data': 'received coords batch',
+            'fixes': [{'coords_lat': f"{lat}", 'coords_long': f"{long}", 'timestamp': timestamp} for lat, long, timestamp in fixes],
+            'tracker_id': TRACKER_ID}
+
+
+def encode_legacy(fixes):
+    packet = json_packet(fixes)
+    payload_str = json.dumps(packet, separators=(',', ':'))
+    packet["hmac"] = hmac.new(TOKEN_KEY.encode(), payload_str.encode(), hashlib.sha256).hexdigest()
+    return json.dumps(packet).encode()
+
+
+def encode_header(fixes):
+    body = json.dumps(json_packet(fixes)).encode()
+    signature = hmac.new(TOKEN_KEY.encode(), body, hashlib.sha256).hexdigest()
+    headers = "X-Tracker-Id: %s\r\nX-Signature: %s\r\n" % (TRACKER_ID, signature)
+    return body, signature, len(body) + len(headers)
+
+
+def json_fixes(packet):
+    if 'fixes' in packet:
+        return [(float(fix['coords_lat']), float(fix['coords_long']), int(fix['timestamp'])) for fix in packet['fixes']]
+    return [(float(packet['coords_lat']), float(packet['coords_long']), None)]
+
+
+def decode_legacy(body):
+    packet = json.loads(body)
+    received_hmac = packet.pop("hmac")
+    payload_str = json.dumps(packet, separators=(',', ':'))
+    computed_hmac = hmac.new(TOKEN_KEY.encode(), payload_str.encode(), hashlib.sha256).hexdigest()
+    assert hmac.compare_digest(computed_hmac, received_hmac)
+    return json_fixes(packet)
+
+
+def decode_header(body, signature):
+    computed_hmac = hmac.new(TOKEN_KEY.encode(), body, hashlib.sha256).hexdigest()
+    assert hmac.compare_digest(computed_hmac, signature)
+    return json_fixes(json.loads(body))
+
+
+def decode_frame(frame):
+    tracker_id, count = binary_frame.read_header(frame)
+    assert binary_frame.verify(frame, TOKEN_KEY.encode())
+    return binary_frame.decode_fixes(frame, count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print("%-6s %-12s %10s %14s %10s" % ("fixes", "format", "bytes", "decode us", "vs legacy"))
+    for count in (1, 10, 100):
+        fixes = make_fixes(count)
+        iterations = max(100, args.iterations // count)
+
+        legacy = encode_legacy(fixes)
+        body, signature, header_size = encode_header(fixes)
+        frame = binary_frame.encode(TRACKER_ID, fixes, TOKEN_KEY.encode())
+
+        decoded = decode_frame(frame)
+        assert all(abs(a[0] - b[0]) < 1e-6 and abs(a[1] - b[1]) < 1e-6 for a, b in zip(decoded, fixes))
+
+        cases = [
+            ("json-legacy", len(legacy), lambda: decode_legacy(legacy)),
+            ("json-header", header_size, lambda: decode_header(body, signature)),
+            ("frame", len(frame), lambda: decode_frame(frame)),
+        ]
+        baseline = None
+        for name, size, decode in cases:
+            seconds = min(timeit.repeat(decode, number=iterations, repeat=3)) / iterations
+            baseline = baseline or seconds
+            print("%-6d %-12s %10d %14.2f %9.1fx" % (count, name, size, seconds * 1e6, baseline / seconds))
+
+
+if __name__ == "__main__":
+    main()
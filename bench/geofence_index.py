@@ -0,0 +1,98 @@
+"""
+    Point-in-geofence throughput of the grid index in src/geofence.py against a linear scan over every fence.
+
+    Builds N random fences (half circles of 50-2000 m, half 4-12 vertex polygons) spread over Denmark, a share of them
+    fleet-wide and the rest owned by random trackers, then tests random fixes against them. Both methods must find the
+    same fences for every point.
+
+    Usage:
+        python bench/geofence_index.py [--fences 10000] [--points 100000] [--trackers 1000]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+import geofence
+
+# Danmark, groft
+MIN_LAT, MAX_LAT = 54.6, 57.7
+MIN_LONG, MAX_LONG = 8.1, 12.7
+
+
+def make_fences(count, trackers, fleet_share, rng):
+    fences = []
+    for fence_id in range(count):
+        tracker_id = None if rng.random() < fleet_share else "Tracker#%d" % rng.randrange(trackers)
+        lat, long = rng.uniform(MIN_LAT, MAX_LAT), rng.uniform(MIN_LONG, MAX_LONG)
+
+        if fence_id % 2 == 0:
+            geometry = {"center": [lat, long], "radius_m": rng.uniform(50, 2000)}
+            fences.append(geofence.Fence(fence_id, tracker_id, "circle-%d" % fence_id, "circle", geometry))
+        else:
+            radius = rng.uniform(0.002, 0.02)
+            sides = rng.randint(4, 12)
+            vertices = [[lat + radius * math.sin(2 * math.pi * i / sides) * rng.uniform(0.6, 1.0),
+                         long + radius * 1.7 * math.cos(2 * math.pi * i / sides) * rng.uniform(0.6, 1.0)] for i in range(sides)]
+            fences.append(geofence.Fence(fence_id, tracker_id, "polygon-%d" % fence_id, "polygon", {"vertices": vertices}))
+    return fences
+
+
+def linear_containing(fences, tracker_id, lat, long):
+    return {fence.id for fence in fences if fence.applies_to(tracker_id) and fence.contains(lat, long)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fences", type=int, default=10000)
+    parser.add_argument("--points", type=int, default=100000)
+    parser.add_argument("--trackers", type=int, default=1000)
+    parser.add_argument("--fleet-share", type=float, default=0.2, help="share of fences that apply to every tracker")
+    parser.add_argument("--linear-points", type=int, default=2000, help="points for the (slow) linear baseline")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fences = make_fences(args.fences, args.trackers, args.fleet_share, rng)
+    points = [("Tracker#%d" % rng.randrange(args.trackers), rng.uniform(MIN_LAT, MAX_LAT), rng.uniform(MIN_LONG, MAX_LONG))
+              for _ in range(args.points)]
+
+    started = time.perf_counter()
+    index = geofence.GridIndex()
+    for fence in fences:
+        index.insert(fence)
+    build = time.perf_counter() - started
+    print("[+] Indexed %d fences in %.1f ms (%d cells, %d large fences)" % (len(fences), build * 1000, len(index.cells), len(index.large)))
+
+    started = time.perf_counter()
+    hits = 0
+    for tracker_id, lat, long in points:
+        hits += len(index.containing(tracker_id, lat, long))
+    grid = time.perf_counter() - started
+
+    sample = points[:args.linear_points]
+    started = time.perf_counter()
+    for tracker_id, lat, long in sample:
+        linear_containing(fences, tracker_id, lat, long)
+    linear = time.perf_counter() - started
+
+    mismatches = sum(1 for tracker_id, lat, long in sample
+                     if index.containing(tracker_id, lat, long) != linear_containing(fences, tracker_id, lat, long))
+
+    grid_rate = len(points) / grid
+    linear_rate = len(sample) / linear
+    print("grid    %10.0f points/s   %8.2f us/point   (%d hits in %d points)" % (grid_rate, 1e6 / grid_rate, hits, len(points)))
+    print("linear  %10.0f points/s   %8.2f us/point" % (linear_rate, 1e6 / linear_rate))
+    print("speedup %9.0fx   mismatches: %d of %d" % (grid_rate / linear_rate, mismatches, len(sample)))
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,13 +22,47 @@ CHARACTERISTIC_UUID_TRACKER_PASSWORD = "1370af71-05bd-42cd-9604-72667f439c42"
 TARGET_DEVICE_NAME = "car_tracker"
 
 class CoordinatesHandling:
+    def __init__(self):
+        # Session tokens pr. tracker ID, så password kun sendes (og bcrypt-tjekkes) ved login
+        self.session_tokens = {}
+
+    def login(self, tracker_id, password):
+        response = requests.post(URL, json={'data': 'login request',
+                                            'tracker_id': tracker_id,
+                                            'password': password
+                                        }, verify=False)
+
+        if response.status_code == 200 and response.json().get('status') == 'success':
+            self.session_tokens[tracker_id] = response.json().get('session_token')
+            return self.session_tokens[tracker_id]
+        return None
+
+    def request_coordinates(self, tracker_id, password):
+        session_token = self.session_tokens.get(tracker_id) or self.login(tracker_id, password)
+        if session_token is None:
+            # Login fejlede, lad serveren give fejlbeskeden via password-tjekket
+            return requests.post(URL, json={'data': 'get coords', 'tracker_id': tracker_id, 'password': password}, verify=False)
+
+        for attempt in range(2):
+            response = requests.post(URL, json={'data': 'get coords',
+                                                'tracker_id': tracker_id,
+                                                'session_token': session_token
+                                            }, verify=False)
+
+            # Udløbet eller tilbagekaldt token, log ind igen én gang
+            if response.status_code != 401 or attempt == 1:
+                break
+
+            self.session_tokens.pop(tracker_id, None)
+            session_token = self.login(tracker_id, password)
+            if session_token is None:
+                break
+        return response
+
     def get_coordinates(self, tracker_id, password):
         try:
-            # Send HTTP POST request to the Flask backend with tracker ID and password for validation
-            response = requests.post(URL, json={'data': 'get coords', 
-                                                'tracker_id': tracker_id, 
-                                                'password': password 
-                                            }, verify=False)
+            # Send HTTP POST request to the Flask backend with tracker ID and session token (or password) for validation
+            response = self.request_coordinates(tracker_id, password)
 
             # Check if the request was successful
             if response.status_code == 200:
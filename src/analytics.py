@@ -0,0 +1,242 @@
+"""
+    Fleet analytics over Lokation_log with NumPy: per tracker and day the distance driven, max and average speed,
+    idle time, dwell clusters and coverage.
+
+    A tracker's fixes are read in chunks into latitude, longitude and timestamp arrays, and every measure is computed
+    over the whole array at once instead of row by row. Segments are pairs of consecutive fixes:
+        - distance      haversine sum over the segments, leaving out jumps faster than ANALYTICS_MAX_SPEED (GPS glitches)
+        - moving/idle   segments no longer than TRIP_GAP_SECONDS, split by ANALYTICS_IDLE_SPEED; the average speed is
+                        moving distance over moving time
+        - max speed     fastest plausible segment no longer than the gap
+        - dwells        runs of consecutive fixes in one ANALYTICS_DWELL_CELL_M grid cell lasting TRIP_STATIONARY_SECONDS
+                        or more; a gap in the fixes doesn't end a dwell, so a tracker sleeping while parked still dwells
+        - coverage      distinct ANALYTICS_COVERAGE_CELL_M grid cells visited and their area
+    A segment counts for the day it ends on, a dwell for the day it starts on. Days are the server's local dates, like
+    Tidspunkt. Fixes already folded into Lokation_rollup are not in Lokation_log and are not counted.
+
+    Usage:
+        python analytics.py report [--date YYYY-MM-DD] [--days 1] [--json]
+"""
+import os
+
+import numpy as np
+
+from geo import EARTH_RADIUS_M
+from trips import TRIP_GAP_SECONDS, TRIP_STATIONARY_SECONDS
+
+ANALYTICS_CHUNK_SIZE = int(os.getenv("ANALYTICS_CHUNK_SIZE", 50000))
+ANALYTICS_IDLE_SPEED = float(os.getenv("ANALYTICS_IDLE_SPEED", 0.5))
+ANALYTICS_MAX_SPEED = float(os.getenv("ANALYTICS_MAX_SPEED", 70))
+ANALYTICS_DWELL_CELL_M = float(os.getenv("ANALYTICS_DWELL_CELL_M", 100))
+ANALYTICS_COVERAGE_CELL_M = float(os.getenv("ANALYTICS_COVERAGE_CELL_M", 250))
+
+REPORT_COLUMNS = ("tracker_id", "date", "points", "distance_km", "max_speed_kmh", "avg_speed_kmh", "moving_min", "idle_min",
+                  "dwells", "dwell_min", "longest_dwell_min", "cells", "coverage_km2")
+
+
+def haversine(lat1, long1, lat2, long2):
+    """
+        geo.haversine() over arrays: great-circle distances in metres between points given in decimal degrees.
+    """
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(long2 - long1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def segment_lengths(lat, long):
+    """
+        Distances between consecutive points; the same as haversine(lat[:-1], long[:-1], lat[1:], long[1:]) with every
+        radians/cosine computed once per point instead of twice.
+    """
+    phi = np.radians(lat)
+    cos_phi = np.cos(phi)
+    a = np.sin(np.diff(phi) / 2) ** 2 + cos_phi[:-1] * cos_phi[1:] * np.sin(np.radians(np.diff(long)) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def grid_cells(lat, long, size_m):
+    """
+        Snaps points to cells of about size_m by size_m and returns an int64 cell key per point. Rows are size_m high;
+        each row's cells are widened by 1/cos(latitude) so they stay about size_m wide.
+    """
+    step = np.degrees(size_m / EARTH_RADIUS_M)
+    rows = np.floor(lat / step)
+    cols = np.floor(long * np.cos(np.radians((rows + 0.5) * step)) / step)
+    return (rows.astype(np.int64) + (1 << 20)) * (1 << 32) + (cols.astype(np.int64) + (1 << 31))
+
+
+def dwell_clusters(lat, long, seconds, cell_m=ANALYTICS_DWELL_CELL_M, min_seconds=TRIP_STATIONARY_SECONDS):
+    """
+        Runs of consecutive fixes in one grid cell that last at least min_seconds. Returns (first index, last index,
+        mean latitude, mean longitude) arrays, one entry per dwell. Jitter across a cell border splits a stop in two.
+    """
+    if not len(lat):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0), np.zeros(0)
+
+    cells = grid_cells(lat, long, cell_m)
+    starts = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1])))
+    ends = np.concatenate((starts[1:], [len(cells)])) - 1
+    counts = ends - starts + 1
+
+    keep = seconds[ends] - seconds[starts] >= min_seconds
+    centre_lat = np.add.reduceat(lat, starts)[keep] / counts[keep]
+    centre_long = np.add.reduceat(long, starts)[keep] / counts[keep]
+    return starts[keep], ends[keep], centre_lat, centre_long
+
+
+def daily_report(lat, long, stamps):
+    """
+        Per-day measures of one tracker's fixes in time order (stamps as datetime64). Returns a dict per day with fixes,
+        in SI units:
+            {"date": "2026-10-17", "points": ..., "distance_m": ..., "moving_s": ..., "idle_s": ..., "max_speed_ms": ...,
+             "avg_speed_ms": ..., "dwells": ..., "dwell_s": ..., "longest_dwell_s": ..., "cells": ..., "coverage_km2": ...}
+    """
+    count = len(lat)
+    if not count:
+        return []
+
+    seconds = (stamps - stamps[0]) / np.timedelta64(1, 's')
+    dates = stamps.astype('datetime64[D]')
+    day_starts = np.flatnonzero(np.concatenate(([True], dates[1:] != dates[:-1])))
+    day_count = len(day_starts)
+    point_day = np.repeat(np.arange(day_count), np.diff(np.append(day_starts, count)))
+
+    # Segment i går fra punkt i til i + 1 og tælles på slutpunktets dag
+    distance = segment_lengths(lat, long)
+    elapsed = np.diff(seconds)
+    segment_day = point_day[1:]
+    speed = np.divide(distance, elapsed, out=np.where(distance > 0, np.inf, 0.0), where=elapsed > 0)
+
+    plausible = speed <= ANALYTICS_MAX_SPEED
+    in_track = (elapsed > 0) & (elapsed <= TRIP_GAP_SECONDS) & plausible
+    moving = in_track & (speed > ANALYTICS_IDLE_SPEED)
+    idle = in_track & ~moving
+
+    def per_day(mask, weights):
+        return np.bincount(segment_day[mask], weights=weights[mask], minlength=day_count)
+
+    total_distance = per_day(plausible, distance)
+    moving_distance = per_day(moving, distance)
+    moving_time = per_day(moving, elapsed)
+    idle_time = per_day(idle, elapsed)
+    max_speed = np.zeros(day_count)
+    np.maximum.at(max_speed, segment_day[in_track], speed[in_track])
+
+    first, last, _, _ = dwell_clusters(lat, long, seconds)
+    dwell_day = point_day[first]
+    dwell_time = seconds[last] - seconds[first]
+    dwells = np.bincount(dwell_day, minlength=day_count)
+    dwell_total = np.bincount(dwell_day, weights=dwell_time, minlength=day_count)
+    longest_dwell = np.zeros(day_count)
+    np.maximum.at(longest_dwell, dwell_day, dwell_time)
+
+    cells = grid_cells(lat, long, ANALYTICS_COVERAGE_CELL_M)
+    bounds = np.append(day_starts, count)
+    cell_area = (ANALYTICS_COVERAGE_CELL_M / 1000) ** 2
+
+    report = []
+    for day in range(day_count):
+        visited = len(np.unique(cells[bounds[day]:bounds[day + 1]]))
+        report.append({
+            "date": str(dates[day_starts[day]]),
+            "points": int(bounds[day + 1] - bounds[day]),
+            "distance_m": float(total_distance[day]),
+            "moving_s": float(moving_time[day]),
+            "idle_s": float(idle_time[day]),
+            "max_speed_ms": float(max_speed[day]),
+            "avg_speed_ms": float(moving_distance[day] / moving_time[day]) if moving_time[day] else 0.0,
+            "dwells": int(dwells[day]),
+            "dwell_s": float(dwell_total[day]),
+            "longest_dwell_s": float(longest_dwell[day]),
+            "cells": visited,
+            "coverage_km2": visited * cell_area,
+        })
+    return report
+
+
+def load_track(db, tracker_id, start, end, chunk_size=ANALYTICS_CHUNK_SIZE):
+    """
+        Reads the tracker's fixes in [start, end) into (latitude, longitude, datetime64 timestamps) arrays, chunk_size
+        rows per query in (Tidspunkt, id) order, so only one chunk at a time exists as row dicts.
+    """
+    lats, longs, stamps = [], [], []
+    after_time, after_id = None, 0
+    while True:
+        if after_time is None:
+            query = ("SELECT id, Latitude, Longitude, Tidspunkt FROM Lokation_log WHERE Tracker_id = %s "
+                     "AND Tidspunkt >= %s AND Tidspunkt < %s ORDER BY Tidspunkt, id LIMIT %s")
+            db.execute_query(query, (tracker_id, start, end, chunk_size))
+        else:
+            query = ("SELECT id, Latitude, Longitude, Tidspunkt FROM Lokation_log WHERE Tracker_id = %s "
+                     "AND (Tidspunkt > %s OR (Tidspunkt = %s AND id > %s)) AND Tidspunkt < %s ORDER BY Tidspunkt, id LIMIT %s")
+            db.execute_query(query, (tracker_id, after_time, after_time, after_id, end, chunk_size))
+        rows = db.fetchall()
+        if not rows:
+            break
+
+        lats.append(np.fromiter((row['Latitude'] for row in rows), dtype=np.float64, count=len(rows)))
+        longs.append(np.fromiter((row['Longitude'] for row in rows), dtype=np.float64, count=len(rows)))
+        stamps.append(np.array([row['Tidspunkt'] for row in rows], dtype='datetime64[us]'))
+        if len(rows) < chunk_size:
+            break
+        after_time, after_id = rows[-1]['Tidspunkt'], rows[-1]['id']
+
+    if not lats:
+        return np.zeros(0), np.zeros(0), np.zeros(0, dtype='datetime64[us]')
+    return np.concatenate(lats), np.concatenate(longs), np.concatenate(stamps)
+
+
+def report(db, start, end, chunk_size=ANALYTICS_CHUNK_SIZE):
+    """
+        Yields (tracker_id, day) for every tracker and every day in [start, end) it has fixes on; day is a
+        daily_report() dict.
+    """
+    db.execute_query("SELECT Tracker_id FROM Tracker_enheder ORDER BY Tracker_id")
+    tracker_ids = [row['Tracker_id'] for row in db.fetchall()]
+
+    for tracker_id in tracker_ids:
+        lat, long, stamps = load_track(db, tracker_id, start, end, chunk_size)
+        for day in daily_report(lat, long, stamps):
+            yield tracker_id, day
+
+
+def report_row(tracker_id, day):
+    return (tracker_id, day["date"], day["points"], round(day["distance_m"] / 1000, 3), round(day["max_speed_ms"] * 3.6, 1),
+            round(day["avg_speed_ms"] * 3.6, 1), round(day["moving_s"] / 60, 1), round(day["idle_s"] / 60, 1), day["dwells"],
+            round(day["dwell_s"] / 60, 1), round(day["longest_dwell_s"] / 60, 1), day["cells"], round(day["coverage_km2"], 3))
+
+
+if __name__ == "__main__":
+    import argparse
+    import csv
+    import json
+    import sys
+    from datetime import date, datetime, timedelta
+
+    import logs
+    from storage import open_database
+
+    logs.setup()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--date", type=date.fromisoformat, default=date.today() - timedelta(days=1), help="first day (default yesterday)")
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="one JSON object per line instead of CSV")
+    args = parser.parse_args()
+
+    start = datetime.combine(args.date, datetime.min.time())
+    end = start + timedelta(days=args.days)
+
+    db = open_database()
+    with db.connection():
+        if args.json:
+            for tracker_id, day in report(db, start, end):
+                print(json.dumps({"tracker_id": tracker_id, **day}))
+        else:
+            writer = csv.writer(sys.stdout)
+            writer.writerow(REPORT_COLUMNS)
+            for tracker_id, day in report(db, start, end):
+                writer.writerow(report_row(tracker_id, day))
@@ -0,0 +1,95 @@
+"""
+    Compact binary upload format for trackers, shared by the firmware (MicroPython) and server.py.
+
+    Frame layout, all fields big-endian:
+        header   magic 'BT' (H), version (B), fix count (B), tracker number (I)            8 bytes
+        fix      latitude, longitude in microdegrees (i, i), unix timestamp (I)           12 bytes per fix
+        tag      first TAG_SIZE bytes of HMAC-SHA256(Token_key, header + fixes)           8 bytes
+
+    The tracker number is the digits of the tracker id ("Tracker#26349" -> 26349). Microdegrees give ~0.1 m
+    resolution, well below GPS accuracy. A single fix costs 28 bytes against ~200 for the signed JSON upload.
+
+    Only struct, hmac and hashlib are used, so the module runs unchanged on MicroPython.
+"""
+import struct
+import hmac
+import hashlib
+
+MAGIC = 0x4254  # 'BT'
+VERSION = 1
+TAG_SIZE = 8
+MAX_FIXES = 255
+TRACKER_PREFIX = 'Tracker#'
+
+HEADER_FORMAT = '>HBBI'
+FIX_FORMAT = '>iiI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FIX_SIZE = struct.calcsize(FIX_FORMAT)
+
+
+class FrameError(ValueError):
+    pass
+
+
+def tracker_number(tracker_id):
+    if not tracker_id.startswith(TRACKER_PREFIX):
+        raise FrameError("tracker id %s has no numeric form" % tracker_id)
+    return int(tracker_id[len(TRACKER_PREFIX):])
+
+
+def tracker_id(number):
+    return TRACKER_PREFIX + str(number)
+
+
+def _tag(token_key, message):
+    return hmac.new(token_key, message, hashlib.sha256).digest()[:TAG_SIZE]
+
+
+def encode(tracker_id, fixes, token_key):
+    """
+        Builds a frame from (latitude, longitude, unix_timestamp) tuples. token_key is the tracker's Token_key as bytes.
+    """
+    if not 1 <= len(fixes) <= MAX_FIXES:
+        raise FrameError("a frame carries between 1 and %d fixes" % MAX_FIXES)
+
+    frame = bytearray(HEADER_SIZE + FIX_SIZE * len(fixes) + TAG_SIZE)
+    struct.pack_into(HEADER_FORMAT, frame, 0, MAGIC, VERSION, len(fixes), tracker_number(tracker_id))
+    offset = HEADER_SIZE
+    for lat, long, timestamp in fixes:
+        struct.pack_into(FIX_FORMAT, frame, offset, int(round(lat * 1000000)), int(round(long * 1000000)), int(timestamp))
+        offset += FIX_SIZE
+
+    frame[offset:] = _tag(token_key, bytes(frame[:offset]))
+    return bytes(frame)
+
+
+def read_header(frame):
+    """
+        Returns (tracker_id, fix count) after checking magic, version and length. Cheap enough to run before the key lookup.
+    """
+    if len(frame) < HEADER_SIZE + FIX_SIZE + TAG_SIZE:
+        raise FrameError("frame too short")
+
+    magic, version, count, number = struct.unpack_from(HEADER_FORMAT, frame, 0)
+    if magic != MAGIC:
+        raise FrameError("bad magic")
+    if version != VERSION:
+        raise FrameError("unsupported frame version %d" % version)
+    if count == 0 or len(frame) != HEADER_SIZE + FIX_SIZE * count + TAG_SIZE:
+        raise FrameError("frame length does not match fix count")
+
+    return tracker_id(number), count
+
+
+def verify(frame, token_key):
+    return hmac.compare_digest(_tag(token_key, frame[:-TAG_SIZE]), frame[-TAG_SIZE:])
+
+
+def decode_fixes(frame, count):
+    """
+        Returns [(latitude, longitude, unix_timestamp), ...]. Call only after verify().
+    """
+    fixes = []
+    for lat, long, timestamp in struct.iter_unpack(FIX_FORMAT, frame[HEADER_SIZE:HEADER_SIZE + FIX_SIZE * count]):
+        fixes.append((lat / 1000000, long / 1000000, timestamp))
+    return fixes
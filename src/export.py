@@ -0,0 +1,60 @@
+"""
+    Track export formats for the "export history" subject. Every writer takes the tracker id and an iterable of
+    row lists (as yielded by stream_query(): dicts with Latitude, Longitude and Tidspunkt) and yields the file as
+    text, one piece per row list, so an export of any length is written without holding it in memory.
+
+    Tidspunkt is the server's local time; GPX and GeoJSON get UTC times, CSV has both the unix time and the local time.
+"""
+import json
+from datetime import timezone
+from xml.sax.saxutils import escape
+
+
+def utc(timestamp):
+    return timestamp.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def gpx(tracker_id, chunks):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="Bil-Tracker" xmlns="http://www.topografix.com/GPX/1/1">\n'
+           '<trk><name>%s</name><trkseg>\n' % escape(tracker_id))
+    for rows in chunks:
+        yield "".join('<trkpt lat="%.6f" lon="%.6f"><time>%s</time></trkpt>\n'
+                      % (row['Latitude'], row['Longitude'], utc(row['Tidspunkt'])) for row in rows)
+    yield '</trkseg></trk>\n</gpx>\n'
+
+
+def csv(tracker_id, chunks):
+    yield "tracker_id,latitude,longitude,timestamp,local_time\n"
+    # Tracker-id'et er det eneste felt der kan indeholde komma eller anførselstegn
+    name = '"%s"' % tracker_id.replace('"', '""') if any(c in tracker_id for c in ',"\n') else tracker_id
+    for rows in chunks:
+        yield "".join("%s,%.6f,%.6f,%.0f,%s\n" % (name, row['Latitude'], row['Longitude'], row['Tidspunkt'].timestamp(),
+                                                  row['Tidspunkt'].isoformat(" ")) for row in rows)
+
+
+def geojson(tracker_id, chunks):
+    """
+        FeatureCollection of Point features with the time as a property; a LineString can't carry per-point times.
+    """
+    yield '{"type": "FeatureCollection", "properties": {"tracker_id": %s}, "features": [\n' % json.dumps(tracker_id)
+    separator = ""
+    for rows in chunks:
+        yield "".join('%s{"type": "Feature", "geometry": {"type": "Point", "coordinates": [%.6f, %.6f]}, "properties": {"time": "%s"}}'
+                      % (separator if i == 0 else ",\n", row['Longitude'], row['Latitude'], utc(row['Tidspunkt']))
+                      for i, row in enumerate(rows))
+        separator = ",\n"
+    yield "\n]}\n"
+
+
+# format -> (writer, mimetype, file extension)
+FORMATS = {
+    "gpx": (gpx, "application/gpx+xml", "gpx"),
+    "csv": (csv, "text/csv", "csv"),
+    "geojson": (geojson, "application/geo+json", "geojson"),
+}
+
+
+def filename(tracker_id, export_format):
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in tracker_id)
+    return "%s.%s" % (safe, FORMATS[export_format][2])
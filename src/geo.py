@@ -0,0 +1,104 @@
+"""
+    Geometry helpers for GPS tracks: great-circle distances and track simplification.
+
+    Points are (latitude, longitude, ...) tuples; anything after the coordinates (timestamp, row id) is carried along untouched.
+"""
+import heapq
+import math
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine(lat1, long1, lat2, long2):
+    """
+        Great-circle distance in metres between two points given in decimal degrees.
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(long2 - long1)
+
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def track_length(points):
+    return sum(haversine(a[0], a[1], b[0], b[1]) for a, b in zip(points, points[1:]))
+
+
+def _project(points):
+    """
+        Equirectangular projection to metres around the track's mean latitude. Accurate enough for
+        perpendicular distances within a single track.
+    """
+    mean_lat = math.radians(sum(p[0] for p in points) / len(points))
+    scale = math.cos(mean_lat)
+    return [(math.radians(p[1]) * scale * EARTH_RADIUS_M, math.radians(p[0]) * EARTH_RADIUS_M) for p in points]
+
+
+def _segment_distance(p, a, b):
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    if dx == 0 and dy == 0:
+        return math.hypot(p[0] - a[0], p[1] - a[1])
+
+    t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / (dx * dx + dy * dy)))
+    return math.hypot(p[0] - (a[0] + t * dx), p[1] - (a[1] + t * dy))
+
+
+def douglas_peucker(points, max_points):
+    """
+        Simplifies a track to at most max_points points, keeping the points that deviate most from the
+        simplified line first (Douglas-Peucker driven by a max-deviation priority instead of a fixed tolerance).
+
+        First and last point are always kept. Runs iteratively, so long tracks can't hit the recursion limit.
+    """
+    if len(points) <= max_points or len(points) < 3:
+        return list(points)
+
+    projected = _project(points)
+    keep = {0, len(points) - 1}
+    # Hob af segmenter (-afvigelse, start, slut, index for største afvigelse)
+    candidates = []
+
+    def split(start, end):
+        best_index, best_distance = None, -1.0
+        for i in range(start + 1, end):
+            distance = _segment_distance(projected[i], projected[start], projected[end])
+            if distance > best_distance:
+                best_index, best_distance = i, distance
+        if best_index is not None:
+            heapq.heappush(candidates, (-best_distance, start, end, best_index))
+
+    split(0, len(points) - 1)
+    while candidates and len(keep) < max_points:
+        _, start, end, index = heapq.heappop(candidates)
+        keep.add(index)
+        split(start, index)
+        split(index, end)
+
+    return [points[i] for i in sorted(keep)]
+
+
+def bucket_by_time(points, max_points, time_index=2):
+    """
+        Splits the time span into max_points equal buckets and keeps the last point of every non-empty bucket.
+        Cheaper than Douglas-Peucker and keeps the sampling even over time; first and last point are kept.
+    """
+    if len(points) <= max_points or max_points < 2:
+        return list(points)
+
+    start = points[0][time_index].timestamp()
+    span = points[-1][time_index].timestamp() - start
+    if span <= 0:
+        return [points[0], points[-1]]
+
+    buckets = {}
+    for point in points:
+        bucket = min(max_points - 1, int((point[time_index].timestamp() - start) / span * (max_points - 1)))
+        buckets[bucket] = point
+
+    simplified = [buckets[b] for b in sorted(buckets)]
+    if simplified[0] is not points[0]:
+        simplified[0] = points[0]
+    return simplified
@@ -0,0 +1,317 @@
+"""
+    Geofences: circles and polygons per tracker or for the whole fleet, with enter/exit events on ingest.
+
+    Fences are kept in memory in a uniform grid over latitude/longitude. A fence is registered in every cell its
+    bounding box touches, so a point test looks up one cell and runs the exact test on the few fences there:
+    O(1) on average however many fences exist. Fences whose box spans more than GRID_MAX_CELLS cells (whole
+    regions) go in a short overflow list that is checked by bounding box.
+
+    DataHandler calls evaluate() with every batch of new fixes inside the ingest transaction, with the trackers locked.
+    It reads the inside-set from Geofence_inde, so every server process sees the same state, and writes the
+    transitions to Geofence_haendelse and the new inside-set back. publish() runs after the commit: it remembers the
+    last evaluated fix and calls the registered listeners, e.g.
+        data_handler.geofences.listeners.append(lambda event: print(event))
+    Fences created in another server process are picked up within GEOFENCE_RELOAD seconds.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+
+import geo
+
+log = logging.getLogger("biltracker.geofence")
+
+GRID_CELL_DEG = float(os.getenv("GEOFENCE_CELL_DEG", 0.05))
+GRID_MAX_CELLS = int(os.getenv("GEOFENCE_MAX_CELLS", 4096))
+MAX_RADIUS_M = 100000
+MAX_VERTICES = 500
+METRES_PER_DEGREE = geo.EARTH_RADIUS_M * math.pi / 180
+
+
+class Fence:
+    """
+        A circle (center, radius_m) or a polygon (list of (latitude, longitude) vertices). tracker_id None means every tracker.
+    """
+    def __init__(self, fence_id, tracker_id, name, shape, geometry):
+        self.id = fence_id
+        self.tracker_id = tracker_id
+        self.name = name
+        self.shape = shape
+
+        if shape == "circle":
+            self.lat, self.long = float(geometry['center'][0]), float(geometry['center'][1])
+            self.radius = float(geometry['radius_m'])
+            if not (-90 <= self.lat <= 90 and -180 <= self.long <= 180 and 0 < self.radius <= MAX_RADIUS_M):
+                raise ValueError("circle needs a valid center and 0 < radius_m <= %d" % MAX_RADIUS_M)
+
+            dlat = self.radius / METRES_PER_DEGREE
+            dlong = dlat / max(math.cos(math.radians(self.lat)), 1e-6)
+            self.bbox = (self.lat - dlat, self.long - dlong, self.lat + dlat, self.long + dlong)
+
+        elif shape == "polygon":
+            self.vertices = [(float(lat), float(long)) for lat, long in geometry['vertices']]
+            if not 3 <= len(self.vertices) <= MAX_VERTICES or \
+                    not all(-90 <= lat <= 90 and -180 <= long <= 180 for lat, long in self.vertices):
+                raise ValueError("polygon needs between 3 and %d valid vertices" % MAX_VERTICES)
+
+            lats = [lat for lat, _ in self.vertices]
+            longs = [long for _, long in self.vertices]
+            self.bbox = (min(lats), min(longs), max(lats), max(longs))
+
+        else:
+            raise ValueError("shape must be circle or polygon")
+
+    def geometry(self):
+        if self.shape == "circle":
+            return {"center": [self.lat, self.long], "radius_m": self.radius}
+        return {"vertices": [list(vertex) for vertex in self.vertices]}
+
+    def applies_to(self, tracker_id):
+        return self.tracker_id is None or self.tracker_id == tracker_id
+
+    def in_bbox(self, lat, long):
+        return self.bbox[0] <= lat <= self.bbox[2] and self.bbox[1] <= long <= self.bbox[3]
+
+    def contains(self, lat, long):
+        if not self.in_bbox(lat, long):
+            return False
+        if self.shape == "circle":
+            return geo.haversine(self.lat, self.long, lat, long) <= self.radius
+
+        # Ray casting i grader; fint til hegn der ikke krydser datolinjen eller polerne
+        inside = False
+        vertices = self.vertices
+        j = len(vertices) - 1
+        for i in range(len(vertices)):
+            lat_i, long_i = vertices[i]
+            lat_j, long_j = vertices[j]
+            if (lat_i > lat) != (lat_j > lat) and long < (long_j - long_i) * (lat - lat_i) / (lat_j - lat_i) + long_i:
+                inside = not inside
+            j = i
+        return inside
+
+    def as_dict(self):
+        return {"id": self.id, "tracker_id": self.tracker_id, "name": self.name, "shape": self.shape, "geometry": self.geometry()}
+
+
+class GridIndex:
+    """
+        Uniform grid of cell_deg x cell_deg cells mapping to the fences whose bounding box touches the cell.
+    """
+    def __init__(self, cell_deg=GRID_CELL_DEG, max_cells=GRID_MAX_CELLS):
+        self.cell_deg = cell_deg
+        self.max_cells = max_cells
+        self.cells = {}
+        self.large = []
+
+    def cell_range(self, fence):
+        min_lat, min_long, max_lat, max_long = fence.bbox
+        return (range(math.floor(min_lat / self.cell_deg), math.floor(max_lat / self.cell_deg) + 1),
+                range(math.floor(min_long / self.cell_deg), math.floor(max_long / self.cell_deg) + 1))
+
+    def insert(self, fence):
+        rows, columns = self.cell_range(fence)
+        if len(rows) * len(columns) > self.max_cells:
+            self.large.append(fence)
+            return
+
+        for row in rows:
+            for column in columns:
+                self.cells.setdefault((row, column), []).append(fence)
+
+    def remove(self, fence):
+        if fence in self.large:
+            self.large.remove(fence)
+            return
+
+        rows, columns = self.cell_range(fence)
+        for row in rows:
+            for column in columns:
+                bucket = self.cells.get((row, column))
+                if bucket and fence in bucket:
+                    bucket.remove(fence)
+                    if not bucket:
+                        del self.cells[(row, column)]
+
+    def candidates(self, lat, long):
+        bucket = self.cells.get((math.floor(lat / self.cell_deg), math.floor(long / self.cell_deg)), ())
+        if not self.large:
+            return bucket
+        return list(bucket) + [fence for fence in self.large if fence.in_bbox(lat, long)]
+
+    def containing(self, tracker_id, lat, long):
+        return {fence.id for fence in self.candidates(lat, long) if fence.applies_to(tracker_id) and fence.contains(lat, long)}
+
+
+class GeofenceEngine:
+    def __init__(self, db_connection, reload_interval=None):
+        self.db_connection = db_connection
+        self.reload_interval = reload_interval or float(os.getenv("GEOFENCE_RELOAD", 60))
+        self.lock = threading.Lock()
+        self.fences = {}
+        self.index = GridIndex()
+        self.loaded_at = None
+        # Tracker_id -> tidspunkt for seneste fix denne proces har evalueret
+        self.last_times = {}
+        self.listeners = []
+
+    def load(self):
+        self.db_connection.execute_query("SELECT Id, Tracker_id, Navn, Form, Geometri FROM Geofence")
+        fences = {}
+        for row in self.db_connection.fetchall():
+            try:
+                fences[row['Id']] = Fence(row['Id'], row['Tracker_id'], row['Navn'], row['Form'], json.loads(row['Geometri']))
+            except (ValueError, KeyError, TypeError) as e:
+                log.warning("Skipping malformed geofence %s: %s", row['Id'], e)
+
+        index = GridIndex()
+        for fence in fences.values():
+            index.insert(fence)
+
+        with self.lock:
+            self.fences, self.index, self.loaded_at = fences, index, time.monotonic()
+
+    def ensure_loaded(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.reload_interval:
+            self.load()
+
+    def inside(self, tracker_id):
+        query = "SELECT Geofence_id FROM Geofence_inde WHERE Tracker_id = %s"
+        self.db_connection.execute_query(query, (tracker_id,))
+        return {row['Geofence_id'] for row in self.db_connection.fetchall()}
+
+    def evaluate(self, rows):
+        """
+            Finds enter/exit transitions for (latitude, longitude, Tracker_id, Tidspunkt) rows and writes them inside the
+            caller's transaction. Fixes older than the last one this process evaluated for the tracker are skipped.
+            Returns the transitions for publish(). An error here never fails the ingest: the geofence writes are rolled
+            back to a savepoint, and the next batch starts again from Geofence_inde.
+        """
+        try:
+            self.ensure_loaded()
+            if not self.fences:
+                return []
+
+            by_tracker = {}
+            for lat, long, tracker_id, timestamp in rows:
+                by_tracker.setdefault(tracker_id, []).append((float(lat), float(long), timestamp))
+
+            transitions = []
+            with self.db_connection.savepoint("geofence"):
+                for tracker_id, points in by_tracker.items():
+                    transitions.append(self.transitions(tracker_id, points))
+                self.write(transitions)
+            return transitions
+
+        except Exception as e:
+            with self.lock:
+                for _, _, tracker_id, _ in rows:
+                    self.last_times.pop(tracker_id, None)
+            if self.db_connection.transient(e):
+                raise
+            log.exception("Exception in GeofenceEngine.evaluate")
+            return []
+
+    def transitions(self, tracker_id, points):
+        inside = self.inside(tracker_id)
+        with self.lock:
+            last_time = self.last_times.get(tracker_id)
+        events = []
+        for lat, long, timestamp in sorted(points, key=lambda point: point[2]):
+            if last_time is not None and timestamp < last_time:
+                continue
+            last_time = timestamp
+            now_inside = self.index.containing(tracker_id, lat, long)
+            for fence_id in now_inside - inside:
+                events.append((fence_id, tracker_id, "enter", lat, long, timestamp))
+            for fence_id in inside - now_inside:
+                events.append((fence_id, tracker_id, "exit", lat, long, timestamp))
+            inside = now_inside
+        return tracker_id, inside, last_time, events
+
+    def write(self, transitions):
+        events = [event for _, _, _, tracker_events in transitions for event in tracker_events]
+        if not events:
+            return
+
+        query = ("INSERT INTO Geofence_haendelse (Geofence_id, Tracker_id, Haendelse, Latitude, Longitude, Tidspunkt) "
+                 "VALUES (%s, %s, %s, %s, %s, %s)")
+        self.db_connection.execute_many(query, events)
+
+        enters = [(tracker_id, fence_id) for fence_id, tracker_id, kind, _, _, _ in events if kind == "enter"]
+        exits = [(tracker_id, fence_id) for fence_id, tracker_id, kind, _, _, _ in events if kind == "exit"]
+        if exits:
+            self.db_connection.execute_many("DELETE FROM Geofence_inde WHERE Tracker_id = %s AND Geofence_id = %s", exits)
+        if enters:
+            self.db_connection.execute_many("INSERT INTO Geofence_inde (Tracker_id, Geofence_id) VALUES (%s, %s)", enters)
+
+    def publish(self, transitions):
+        """
+            Remembers the last evaluated fix of committed transitions and hands every event to the listeners.
+        """
+        with self.lock:
+            for tracker_id, _, last_time, _ in transitions:
+                self.last_times[tracker_id] = last_time
+
+        for _, _, _, events in transitions:
+            for fence_id, tracker_id, kind, lat, long, timestamp in events:
+                event = {"fence_id": fence_id, "tracker_id": tracker_id, "event": kind,
+                         "latitude": lat, "longitude": long, "timestamp": timestamp.timestamp()}
+                for listener in self.listeners:
+                    try:
+                        listener(event)
+                    except Exception:
+                        log.exception("Exception in geofence listener")
+
+    def create(self, tracker_id, name, shape, geometry):
+        """
+            Validates and stores a fence; the caller commits. Raises ValueError for bad geometry.
+        """
+        fence = Fence(None, tracker_id, name, shape, geometry)
+        query = "INSERT INTO Geofence (Tracker_id, Navn, Form, Geometri, Oprettet) VALUES (%s, %s, %s, %s, %s)"
+        self.db_connection.execute_query(query, (tracker_id, name, shape, json.dumps(fence.geometry()), datetime.now()))
+        fence.id = self.db_connection.last_insert_id()
+        return fence
+
+    def added(self, fence):
+        with self.lock:
+            self.fences[fence.id] = fence
+            self.index.insert(fence)
+
+    def delete(self, fence_id):
+        """
+            Removes a fence and its inside-state without exit events; the caller commits and then calls removed().
+        """
+        self.db_connection.execute_query("DELETE FROM Geofence_inde WHERE Geofence_id = %s", (fence_id,))
+        self.db_connection.execute_query("DELETE FROM Geofence WHERE Id = %s", (fence_id,))
+        return self.db_connection.get_row_count() > 0
+
+    def removed(self, fence_id):
+        with self.lock:
+            fence = self.fences.pop(fence_id, None)
+            if fence is not None:
+                self.index.remove(fence)
+
+    def reset_tracker(self, tracker_id):
+        """
+            Password reset: drops the tracker's own fences and inside-state inside the caller's transaction; call forget() after commit.
+        """
+        self.db_connection.execute_query("DELETE FROM Geofence_inde WHERE Tracker_id = %s", (tracker_id,))
+        self.db_connection.execute_query("SELECT Id FROM Geofence WHERE Tracker_id = %s", (tracker_id,))
+        fence_ids = [row['Id'] for row in self.db_connection.fetchall()]
+        self.db_connection.execute_query("DELETE FROM Geofence WHERE Tracker_id = %s", (tracker_id,))
+        return fence_ids
+
+    def forget(self, tracker_id, fence_ids):
+        for fence_id in fence_ids:
+            self.removed(fence_id)
+        with self.lock:
+            self.last_times.pop(tracker_id, None)
+
+    def fence(self, fence_id):
+        self.ensure_loaded()
+        return self.fences.get(fence_id)
@@ -0,0 +1,134 @@
+"""
+    Logging for the server side: JSON lines on stdout, written by a background thread.
+
+    Modules log through logging.getLogger("biltracker.<module>"). setup() gives the "biltracker" logger a
+    QueueHandler, so a request thread only puts the record on a queue; formatting, redaction and the write to
+    stdout (terminal, journald) happen in a QueueListener thread. When the queue (LOG_QUEUE_SIZE) is full, records
+    are dropped and counted instead of blocking the request.
+
+    Every record becomes one JSON object:
+        {"time": "2026-10-18T09:02:56.120Z", "level": "INFO", "logger": "biltracker.server", "message": "...", <extra fields>}
+    Fields named like secrets (hmac, any *token*, password, ...) are replaced with "[redacted]" at any depth, in the
+    extra fields and in the message arguments.
+
+    LOG_LEVEL sets the level (default INFO). Per-request debug records are sampled: LOG_DEBUG_SAMPLE is the share of
+    requests (0 to 1, default 0) whose DEBUG records are kept; sample_request() makes the choice at the start of each.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", 0))
+
+# "token" dækker token_key, session_token, provisioning_token og andre *_token felter
+SECRET_FIELDS = ("hmac", "token", "password", "signature", "secret")
+REDACTED = "[redacted]"
+
+DROPPED = metrics.Counter("biltracker_log_dropped_total", "Log records dropped because the log queue was full.")
+
+# Attributter som alle LogRecords har; resten er extra-felter
+RECORD_FIELDS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "taskName"}
+
+_sampled = contextvars.ContextVar("log_sampled", default=False)
+_listener = None
+
+
+def secret(name):
+    name = str(name).lower()
+    return any(field in name for field in SECRET_FIELDS)
+
+
+def redact(value):
+    """
+        Copy of value with every dict entry whose key looks like a secret replaced by REDACTED.
+    """
+    if isinstance(value, dict):
+        return {key: REDACTED if secret(key) else redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item) for item in value)
+    return value
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        args = redact(record.args) if record.args else None
+        message = str(record.msg) % args if args else str(record.msg)
+
+        entry = {"time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "message": message}
+        for name, value in record.__dict__.items():
+            if name not in RECORD_FIELDS:
+                entry[name] = REDACTED if secret(name) else redact(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """
+        QueueHandler that leaves formatting to the listener thread and drops records when the queue is full.
+        Arguments are formatted later, so they must not be changed after the log call.
+    """
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, level):
+        super().__init__()
+        self.level = level
+
+    def filter(self, record):
+        return record.levelno >= self.level or (record.levelno <= logging.DEBUG and _sampled.get())
+
+
+def sample_request():
+    """
+        Decides whether the current request's DEBUG records are kept, LOG_DEBUG_SAMPLE of the time.
+    """
+    _sampled.set(LOG_DEBUG_SAMPLE > 0 and random.random() < LOG_DEBUG_SAMPLE)
+
+
+def setup():
+    """
+        Starts the pipeline once per process; later calls do nothing. Returns the "biltracker" logger.
+    """
+    global _listener
+    logger = logging.getLogger("biltracker")
+    if _listener is not None:
+        return logger
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JSONFormatter())
+    _listener = logging.handlers.QueueListener(queue.Queue(LOG_QUEUE_SIZE), output)
+
+    handler = BackgroundHandler(_listener.queue)
+    level = logging.getLevelName(LOG_LEVEL)
+    handler.addFilter(SamplingFilter(level))
+    logger.addHandler(handler)
+    logger.propagate = False
+    # Debug-records skal oprettes for at kunne samples; filteret holder resten på LOG_LEVEL
+    logger.setLevel(min(level, logging.DEBUG) if LOG_DEBUG_SAMPLE > 0 else level)
+
+    _listener.start()
+    atexit.register(_listener.stop)
+    return logger
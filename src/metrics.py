@@ -0,0 +1,124 @@
+"""
+    In-process metrics in the Prometheus text format, served on /metrics by server.py (with the PROVISIONING_TOKEN
+    as bearer token).
+
+    Metrics are created once at import time and updated from the hot paths; an update is a dict lookup and a
+    few additions under a per-metric lock, cheap enough to leave on in production.
+"""
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s %s" % (self.name, self.kind)]
+        with self.lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            lines.extend(self.render_sample(labels, value))
+        return lines
+
+    def render_sample(self, labels, value):
+        return ["%s%s %s" % (self.name, _format_labels(self.labelnames, labels), repr(float(value)))]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+        Gauge whose value is set directly or, with function, read when /metrics is scraped.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def render(self):
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = None
+            if value is not None:
+                self.set(value)
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render_sample(self, labels, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append("%s_bucket%s %d" % (self.name, _format_labels(self.labelnames, labels, [("le", le)]), cumulative))
+        lines.append("%s_sum%s %s" % (self.name, _format_labels(self.labelnames, labels), repr(total)))
+        lines.append("%s_count%s %d" % (self.name, _format_labels(self.labelnames, labels), count))
+        return lines
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Requests til handle(), pr. subject
+REQUESTS = Counter("biltracker_requests_total", "Requests handled per subject and HTTP status.", ("subject", "status"))
+REQUEST_ERRORS = Counter("biltracker_request_errors_total", "Requests answered with status 400 or above, per subject.", ("subject",))
+REQUEST_LATENCY = Histogram("biltracker_request_duration_seconds", "Time spent in handle() per subject.", ("subject",))
+
+# Database
+DB_QUERY_LATENCY = Histogram("biltracker_db_query_duration_seconds", "Time per execute_query/execute_many call.", ("backend", "operation"))
+DB_RECONNECTS = Counter("biltracker_db_reconnects_total", "Stale pooled connections reconnected at checkout.", ("backend",))
+DB_SERVER_LOST_RETRIES = Counter("biltracker_db_server_lost_retries_total", "Queries retried after CR_SERVER_LOST/CR_SERVER_GONE_ERROR.", ("backend",))
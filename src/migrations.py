@@ -0,0 +1,569 @@
+"""
+    Versioned schema migrations for the biltracker database.
+
+    Every migration is a (version, description, function) entry in MIGRATIONS. Applied versions are recorded
+    in Schema_version, so running "python migrations.py migrate" again only applies what is missing. The
+    functions inspect information_schema before altering anything, which makes them safe to run against the
+    hand-made tables of existing installations as well as against an empty database.
+
+    Usage:
+        python migrations.py migrate        Apply pending migrations
+        python migrations.py partitions     Add monthly Lokation_log partitions ahead of time (run from cron)
+        python migrations.py explain        Check that the hot DataHandler queries use the composite index
+"""
+import logging
+import secrets
+import sys
+from datetime import date, datetime, timedelta
+
+log = logging.getLogger("biltracker.migrations")
+
+PARTITION_MONTHS_AHEAD = 3
+LOKATION_INDEX = "idx_tracker_tidspunkt"
+
+
+def column_exists(db, table, column):
+    query = ("SELECT COUNT(*) AS n FROM information_schema.COLUMNS "
+             "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s")
+    db.execute_query(query, (table, column))
+    return db.fetchone()['n'] > 0
+
+
+def index_exists(db, table, index):
+    query = ("SELECT COUNT(*) AS n FROM information_schema.STATISTICS "
+             "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s")
+    db.execute_query(query, (table, index))
+    return db.fetchone()['n'] > 0
+
+
+def index_columns(db, table, index):
+    query = ("SELECT COLUMN_NAME FROM information_schema.STATISTICS "
+             "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s ORDER BY SEQ_IN_INDEX")
+    db.execute_query(query, (table, index))
+    return [row['COLUMN_NAME'] for row in db.fetchall()]
+
+
+def partition_names(db, table):
+    query = ("SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+             "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+             "ORDER BY PARTITION_ORDINAL_POSITION")
+    db.execute_query(query, (table,))
+    return [row['PARTITION_NAME'] for row in db.fetchall()]
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(day):
+    return month_start(month_start(day) + timedelta(days=32))
+
+
+def partition_clause(month):
+    """
+        Partition holding every row of the given month, e.g. p202410 VALUES LESS THAN (TO_DAYS('2024-11-01')).
+    """
+    return "PARTITION p%s VALUES LESS THAN (TO_DAYS('%s'))" % (month.strftime('%Y%m'), next_month(month).isoformat())
+
+
+def create_base_tables(db):
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS Tracker_enheder (
+            Tracker_id VARCHAR(32) NOT NULL,
+            Token_key CHAR(64) NOT NULL,
+            Password VARCHAR(60) NULL,
+            PRIMARY KEY (Tracker_id)
+        ) ENGINE=InnoDB
+    """)
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS Lokation_log (
+            id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+            Tracker_id VARCHAR(32) NOT NULL,
+            Latitude DECIMAL(9,6) NOT NULL,
+            Longitude DECIMAL(9,6) NOT NULL,
+            Tidspunkt DATETIME NOT NULL,
+            PRIMARY KEY (id, Tidspunkt)
+        ) ENGINE=InnoDB
+    """)
+
+
+def create_tracker_seneste(db):
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS Tracker_seneste (
+            Tracker_id VARCHAR(32) NOT NULL,
+            Latitude DECIMAL(9,6) NOT NULL,
+            Longitude DECIMAL(9,6) NOT NULL,
+            Tidspunkt DATETIME NOT NULL,
+            PRIMARY KEY (Tracker_id)
+        ) ENGINE=InnoDB
+    """)
+
+    # Eksisterende installationer: fyld tabellen fra loggen én gang
+    db.execute_query("""
+        INSERT IGNORE INTO Tracker_seneste (Tracker_id, Latitude, Longitude, Tidspunkt)
+        SELECT l.Tracker_id, l.Latitude, l.Longitude, l.Tidspunkt
+        FROM Lokation_log l
+        JOIN (SELECT Tracker_id, MAX(Tidspunkt) AS Tidspunkt FROM Lokation_log GROUP BY Tracker_id) seneste
+          ON seneste.Tracker_id = l.Tracker_id AND seneste.Tidspunkt = l.Tidspunkt
+    """)
+
+
+def create_tracker_sekvens(db):
+    """
+        Counter and permutation key for TrackerIdAllocator in server.py. The key must never change once ids have been handed out.
+    """
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS Tracker_sekvens (
+            Navn VARCHAR(32) NOT NULL,
+            Naeste BIGINT UNSIGNED NOT NULL,
+            Noegle CHAR(32) NOT NULL,
+            PRIMARY KEY (Navn)
+        ) ENGINE=InnoDB
+    """)
+    db.execute_query("INSERT IGNORE INTO Tracker_sekvens (Navn, Naeste, Noegle) VALUES ('tracker', 0, %s)", (secrets.token_hex(16),))
+
+
+def index_lokation_log(db):
+    """
+        Upgrades hand-made Lokation_log tables: adds the surrogate id key that partitioning and keyset
+        pagination need, drops foreign keys (not allowed on partitioned InnoDB tables) and adds the
+        (Tracker_id, Tidspunkt) index. A primary key without Tidspunkt, e.g. PRIMARY KEY (id), is rebuilt as
+        (id, Tidspunkt), as every unique key of a partitioned table must contain the partitioning column.
+    """
+    query = ("SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS "
+             "WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = 'Lokation_log'")
+    db.execute_query(query)
+    for row in db.fetchall():
+        db.execute_query("ALTER TABLE Lokation_log DROP FOREIGN KEY `%s`" % row['CONSTRAINT_NAME'])
+
+    if not column_exists(db, 'Lokation_log', 'id'):
+        drop_primary = "DROP PRIMARY KEY, " if index_exists(db, 'Lokation_log', 'PRIMARY') else ""
+        db.execute_query("ALTER TABLE Lokation_log %s"
+                         "ADD COLUMN id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT FIRST, "
+                         "ADD PRIMARY KEY (id, Tidspunkt)" % drop_primary)
+    else:
+        primary = index_columns(db, 'Lokation_log', 'PRIMARY')
+        if 'Tidspunkt' not in primary:
+            drop_primary = "DROP PRIMARY KEY, " if primary else ""
+            db.execute_query("ALTER TABLE Lokation_log %sADD PRIMARY KEY (id, Tidspunkt)" % drop_primary)
+
+    if not index_exists(db, 'Lokation_log', LOKATION_INDEX):
+        db.execute_query("CREATE INDEX %s ON Lokation_log (Tracker_id, Tidspunkt)" % LOKATION_INDEX)
+
+
+def partition_lokation_log(db):
+    """
+        Range-partitions Lokation_log by month on Tidspunkt, covering the existing data up to
+        PARTITION_MONTHS_AHEAD months from now plus a catch-all pmax partition.
+
+        This rebuilds the table, so run it in a maintenance window on large installations.
+    """
+    if partition_names(db, 'Lokation_log'):
+        return
+
+    db.execute_query("SELECT MIN(Tidspunkt) AS oldest FROM Lokation_log")
+    oldest = db.fetchone()['oldest'] or datetime.now()
+
+    month = month_start(oldest)
+    last = month_start(date.today())
+    for _ in range(PARTITION_MONTHS_AHEAD):
+        last = next_month(last)
+
+    partitions = []
+    while month <= last:
+        partitions.append(partition_clause(month))
+        month = next_month(month)
+    partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+
+    db.execute_query("ALTER TABLE Lokation_log PARTITION BY RANGE (TO_DAYS(Tidspunkt)) (%s)" % ", ".join(partitions))
+
+
+def ensure_partitions(db, months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+        Splits pmax so monthly partitions exist up to months_ahead months from now. Cheap while pmax is empty,
+        which it is as long as this runs regularly.
+    """
+    existing = set(partition_names(db, 'Lokation_log'))
+    if not existing:
+        return []
+
+    month = month_start(date.today())
+    wanted = []
+    for _ in range(months_ahead + 1):
+        if 'p' + month.strftime('%Y%m') not in existing:
+            wanted.append(partition_clause(month))
+        month = next_month(month)
+
+    if wanted:
+        wanted.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+        db.execute_query("ALTER TABLE Lokation_log REORGANIZE PARTITION pmax INTO (%s)" % ", ".join(wanted))
+    return wanted[:-1]
+
+
+def drop_expired_partitions(db, cutoff):
+    """
+        Drops the monthly Lokation_log partitions that only hold rows older than cutoff. Much cheaper than deleting
+        the rows; what is left of the cutoff month is removed by PurgeWorker's chunked deletes.
+    """
+    dropped = []
+    for name in partition_names(db, 'Lokation_log'):
+        if name == 'pmax':
+            continue
+        month = datetime.strptime(name[1:], '%Y%m').date()
+        if next_month(month) <= cutoff.date():
+            dropped.append(name)
+
+    if dropped:
+        db.execute_query("ALTER TABLE Lokation_log DROP PARTITION %s" % ", ".join(dropped))
+    return dropped
+
+
+def create_sletning_job(db):
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS Sletning_job (
+            Id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+            Tracker_id VARCHAR(32) NOT NULL,
+            Foer DATETIME NOT NULL,
+            Status VARCHAR(16) NOT NULL DEFAULT 'pending',
+            Slettet BIGINT UNSIGNED NOT NULL DEFAULT 0,
+            Oprettet DATETIME NOT NULL,
+            Faerdig DATETIME NULL,
+            PRIMARY KEY (Id),
+            KEY idx_sletning_tracker (Tracker_id, Foer),
+            KEY idx_sletning_status (Status)
+        ) ENGINE=InnoDB
+    """)
+
+
+def create_lokation_rollup(db):
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS Lokation_rollup (
+            Tracker_id VARCHAR(32) NOT NULL,
+            Periode DATETIME NOT NULL,
+            Niveau VARCHAR(8) NOT NULL,
+            Foerste_lat DECIMAL(9,6) NOT NULL,
+            Foerste_long DECIMAL(9,6) NOT NULL,
+            Foerste_tid DATETIME NOT NULL,
+            Sidste_lat DECIMAL(9,6) NOT NULL,
+            Sidste_long DECIMAL(9,6) NOT NULL,
+            Sidste_tid DATETIME NOT NULL,
+            Min_lat DECIMAL(9,6) NOT NULL,
+            Max_lat DECIMAL(9,6) NOT NULL,
+            Min_long DECIMAL(9,6) NOT NULL,
+            Max_long DECIMAL(9,6) NOT NULL,
+            Distance_m DOUBLE NOT NULL,
+            Antal INT UNSIGNED NOT NULL,
+            PRIMARY KEY (Tracker_id, Periode, Niveau),
+            KEY idx_rollup_sidste (Sidste_tid)
+        ) ENGINE=InnoDB
+    """)
+
+
+def create_geofence_tables(db):
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS Geofence (
+            Id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+            Tracker_id VARCHAR(32) NULL,
+            Navn VARCHAR(100) NOT NULL,
+            Form VARCHAR(16) NOT NULL,
+            Geometri TEXT NOT NULL,
+            Oprettet DATETIME NOT NULL,
+            PRIMARY KEY (Id),
+            KEY idx_geofence_tracker (Tracker_id)
+        ) ENGINE=InnoDB
+    """)
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS Geofence_haendelse (
+            Id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+            Geofence_id BIGINT UNSIGNED NOT NULL,
+            Tracker_id VARCHAR(32) NOT NULL,
+            Haendelse VARCHAR(8) NOT NULL,
+            Latitude DECIMAL(9,6) NOT NULL,
+            Longitude DECIMAL(9,6) NOT NULL,
+            Tidspunkt DATETIME NOT NULL,
+            PRIMARY KEY (Id),
+            KEY idx_haendelse_tracker (Tracker_id, Tidspunkt)
+        ) ENGINE=InnoDB
+    """)
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS Geofence_inde (
+            Tracker_id VARCHAR(32) NOT NULL,
+            Geofence_id BIGINT UNSIGNED NOT NULL,
+            PRIMARY KEY (Tracker_id, Geofence_id),
+            KEY idx_inde_geofence (Geofence_id)
+        ) ENGINE=InnoDB
+    """)
+
+
+def create_trip_tables(db):
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS Trips (
+            Id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+            Tracker_id VARCHAR(32) NOT NULL,
+            Start_tid DATETIME NOT NULL,
+            Start_lat DECIMAL(9,6) NOT NULL,
+            Start_long DECIMAL(9,6) NOT NULL,
+            Slut_tid DATETIME NOT NULL,
+            Slut_lat DECIMAL(9,6) NOT NULL,
+            Slut_long DECIMAL(9,6) NOT NULL,
+            Distance_m DOUBLE NOT NULL,
+            Antal INT UNSIGNED NOT NULL,
+            Aaben TINYINT(1) NOT NULL,
+            PRIMARY KEY (Id),
+            KEY idx_trips_tracker (Tracker_id, Start_tid)
+        ) ENGINE=InnoDB
+    """)
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS Trip_checkpoint (
+            Tracker_id VARCHAR(32) NOT NULL,
+            Trip_id BIGINT UNSIGNED NULL,
+            Sidste_lat DECIMAL(9,6) NOT NULL,
+            Sidste_long DECIMAL(9,6) NOT NULL,
+            Sidste_tid DATETIME NOT NULL,
+            Anker_lat DECIMAL(9,6) NULL,
+            Anker_long DECIMAL(9,6) NULL,
+            Anker_tid DATETIME NULL,
+            Anker_distance DOUBLE NOT NULL,
+            Anker_antal INT UNSIGNED NOT NULL,
+            Distance_m DOUBLE NOT NULL,
+            Antal INT UNSIGNED NOT NULL,
+            PRIMARY KEY (Tracker_id)
+        ) ENGINE=InnoDB
+    """)
+
+
+MIGRATIONS = [
+    (1, "Base tables Tracker_enheder and Lokation_log", create_base_tables),
+    (2, "Lokation_log surrogate key and (Tracker_id, Tidspunkt) index", index_lokation_log),
+    (3, "Tracker_seneste last-known-position table", create_tracker_seneste),
+    (4, "Monthly range partitioning of Lokation_log", partition_lokation_log),
+    (5, "Tracker_sekvens counter for the tracker id allocator", create_tracker_sekvens),
+    (6, "Sletning_job queue for chunked background deletes", create_sletning_job),
+    (7, "Lokation_rollup hourly/daily summaries", create_lokation_rollup),
+    (8, "Geofence, Geofence_haendelse and Geofence_inde tables", create_geofence_tables),
+    (9, "Trips and Trip_checkpoint for trip segmentation", create_trip_tables),
+]
+
+
+def current_version(db):
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS Schema_version (
+            Version INT NOT NULL,
+            Beskrivelse VARCHAR(255) NOT NULL,
+            Udfoert DATETIME NOT NULL,
+            PRIMARY KEY (Version)
+        ) ENGINE=InnoDB
+    """)
+    db.execute_query("SELECT MAX(Version) AS version FROM Schema_version")
+    return db.fetchone()['version'] or 0
+
+
+# SQLite (DB_BACKEND=sqlite) har ingen gamle installationer at opgradere, så skemaet oprettes direkte.
+SQLITE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS Tracker_enheder (
+        Tracker_id TEXT NOT NULL PRIMARY KEY,
+        Token_key TEXT NOT NULL,
+        Password TEXT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS Lokation_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        Tracker_id TEXT NOT NULL,
+        Latitude REAL NOT NULL,
+        Longitude REAL NOT NULL,
+        Tidspunkt TIMESTAMP NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS %s ON Lokation_log (Tracker_id, Tidspunkt)" % LOKATION_INDEX,
+    """CREATE TABLE IF NOT EXISTS Tracker_seneste (
+        Tracker_id TEXT NOT NULL PRIMARY KEY,
+        Latitude REAL NOT NULL,
+        Longitude REAL NOT NULL,
+        Tidspunkt TIMESTAMP NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS Tracker_sekvens (
+        Navn TEXT NOT NULL PRIMARY KEY,
+        Naeste INTEGER NOT NULL,
+        Noegle TEXT NOT NULL
+    )""",
+    "INSERT OR IGNORE INTO Tracker_sekvens (Navn, Naeste, Noegle) VALUES ('tracker', 0, lower(hex(randomblob(16))))",
+    """CREATE TABLE IF NOT EXISTS Sletning_job (
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        Tracker_id TEXT NOT NULL,
+        Foer TIMESTAMP NOT NULL,
+        Status TEXT NOT NULL DEFAULT 'pending',
+        Slettet INTEGER NOT NULL DEFAULT 0,
+        Oprettet TIMESTAMP NOT NULL,
+        Faerdig TIMESTAMP NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_sletning_tracker ON Sletning_job (Tracker_id, Foer)",
+    "CREATE INDEX IF NOT EXISTS idx_sletning_status ON Sletning_job (Status)",
+    """CREATE TABLE IF NOT EXISTS Lokation_rollup (
+        Tracker_id TEXT NOT NULL,
+        Periode TIMESTAMP NOT NULL,
+        Niveau TEXT NOT NULL,
+        Foerste_lat REAL NOT NULL,
+        Foerste_long REAL NOT NULL,
+        Foerste_tid TIMESTAMP NOT NULL,
+        Sidste_lat REAL NOT NULL,
+        Sidste_long REAL NOT NULL,
+        Sidste_tid TIMESTAMP NOT NULL,
+        Min_lat REAL NOT NULL,
+        Max_lat REAL NOT NULL,
+        Min_long REAL NOT NULL,
+        Max_long REAL NOT NULL,
+        Distance_m REAL NOT NULL,
+        Antal INTEGER NOT NULL,
+        PRIMARY KEY (Tracker_id, Periode, Niveau)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_rollup_sidste ON Lokation_rollup (Sidste_tid)",
+    """CREATE TABLE IF NOT EXISTS Geofence (
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        Tracker_id TEXT NULL,
+        Navn TEXT NOT NULL,
+        Form TEXT NOT NULL,
+        Geometri TEXT NOT NULL,
+        Oprettet TIMESTAMP NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_geofence_tracker ON Geofence (Tracker_id)",
+    """CREATE TABLE IF NOT EXISTS Geofence_haendelse (
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        Geofence_id INTEGER NOT NULL,
+        Tracker_id TEXT NOT NULL,
+        Haendelse TEXT NOT NULL,
+        Latitude REAL NOT NULL,
+        Longitude REAL NOT NULL,
+        Tidspunkt TIMESTAMP NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_haendelse_tracker ON Geofence_haendelse (Tracker_id, Tidspunkt)",
+    """CREATE TABLE IF NOT EXISTS Geofence_inde (
+        Tracker_id TEXT NOT NULL,
+        Geofence_id INTEGER NOT NULL,
+        PRIMARY KEY (Tracker_id, Geofence_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_inde_geofence ON Geofence_inde (Geofence_id)",
+    """CREATE TABLE IF NOT EXISTS Trips (
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        Tracker_id TEXT NOT NULL,
+        Start_tid TIMESTAMP NOT NULL,
+        Start_lat REAL NOT NULL,
+        Start_long REAL NOT NULL,
+        Slut_tid TIMESTAMP NOT NULL,
+        Slut_lat REAL NOT NULL,
+        Slut_long REAL NOT NULL,
+        Distance_m REAL NOT NULL,
+        Antal INTEGER NOT NULL,
+        Aaben INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_trips_tracker ON Trips (Tracker_id, Start_tid)",
+    """CREATE TABLE IF NOT EXISTS Trip_checkpoint (
+        Tracker_id TEXT NOT NULL PRIMARY KEY,
+        Trip_id INTEGER NULL,
+        Sidste_lat REAL NOT NULL,
+        Sidste_long REAL NOT NULL,
+        Sidste_tid TIMESTAMP NOT NULL,
+        Anker_lat REAL NULL,
+        Anker_long REAL NULL,
+        Anker_tid TIMESTAMP NULL,
+        Anker_distance REAL NOT NULL,
+        Anker_antal INTEGER NOT NULL,
+        Distance_m REAL NOT NULL,
+        Antal INTEGER NOT NULL
+    )""",
+]
+
+
+def migrate(db):
+    """
+        Applies every migration newer than the recorded schema version. Returns the list of applied versions.
+
+        SQLite databases get SQLITE_SCHEMA instead, which is idempotent and returns an empty list.
+    """
+    if db.dialect == "sqlite":
+        for statement in SQLITE_SCHEMA:
+            db.execute_query(statement)
+        db.commit()
+        return []
+
+    applied = []
+    version = current_version(db)
+
+    for number, description, function in MIGRATIONS:
+        if number <= version:
+            continue
+
+        log.info("Applying migration %d: %s", number, description)
+        function(db)
+        db.execute_query("INSERT INTO Schema_version (Version, Beskrivelse, Udfoert) VALUES (%s, %s, NOW())",
+                         (number, description))
+        db.commit()
+        applied.append(number)
+
+    return applied
+
+
+# Queries DataHandler runs on every request or per tracker, with the index they have to use.
+HOT_QUERIES = [
+    ("latest position fallback",
+     "SELECT Latitude, Longitude, Tidspunkt FROM Lokation_log WHERE Tracker_id = %s ORDER BY Tidspunkt DESC LIMIT 1",
+     ("Tracker#10000",), LOKATION_INDEX),
+    ("history page",
+     "SELECT id, Latitude, Longitude, Tidspunkt FROM Lokation_log "
+     "WHERE Tracker_id = %s AND Tidspunkt < %s AND (Tidspunkt > %s OR (Tidspunkt = %s AND id > %s)) "
+     "ORDER BY Tidspunkt, id LIMIT %s",
+     ("Tracker#10000", datetime(2024, 2, 1), datetime(2024, 1, 1), datetime(2024, 1, 1), 0, 1001), LOKATION_INDEX),
+    ("export range scan",
+     "SELECT Latitude, Longitude, Tidspunkt FROM Lokation_log WHERE Tracker_id = %s AND Tidspunkt >= %s AND Tidspunkt < %s ORDER BY Tidspunkt, id",
+     ("Tracker#10000", datetime(2024, 1, 1), datetime(2024, 2, 1)), LOKATION_INDEX),
+    # Samme sætning som storage.STATEMENTS["purge_tracker_chunk"]["mysql"] (storage importerer dette modul)
+    ("per-tracker purge chunk",
+     "DELETE FROM Lokation_log WHERE Tracker_id = %s AND Tidspunkt < %s ORDER BY Tidspunkt LIMIT %s",
+     ("Tracker#10000", datetime(2024, 1, 1), 5000), LOKATION_INDEX),
+    ("last position lookup",
+     "SELECT Latitude, Longitude, Tidspunkt FROM Tracker_seneste WHERE Tracker_id = %s",
+     ("Tracker#10000",), "PRIMARY"),
+]
+
+
+def check_indexes(db, queries=HOT_QUERIES):
+    """
+        Runs EXPLAIN on every hot query. Returns a list of (name, ok, plan) where plan is the EXPLAIN row,
+        and ok is True when MySQL picked the expected index.
+
+        Run it against a populated database; on near-empty tables the optimizer may prefer a full scan.
+    """
+    results = []
+    for name, query, params, expected in queries:
+        db.execute_query("EXPLAIN " + query, params)
+        plan = db.fetchall()[0]
+        results.append((name, plan.get('key') == expected, plan))
+    return results
+
+
+if __name__ == "__main__":
+    # Direkte gennem storage: server.data_handler ville starte PurgeWorker mod tabeller der måske ikke findes endnu
+    import logs
+    from storage import open_database
+
+    logs.setup()
+
+    db = open_database()
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+
+    with db.connection():
+        if command == "migrate":
+            applied = migrate(db)
+            print("[+] Schema is up to date (applied: %s)" % (applied or "none"))
+
+        elif command == "partitions":
+            added = ensure_partitions(db)
+            print("[+] Added partitions: %s" % (", ".join(added) or "none"))
+
+        elif command == "explain":
+            failed = False
+            for name, ok, plan in check_indexes(db):
+                print("[%s] %s: key=%s type=%s rows=%s" % ("+" if ok else "!", name, plan.get('key'), plan.get('type'), plan.get('rows')))
+                failed = failed or not ok
+            sys.exit(1 if failed else 0)
+
+        else:
+            print(__doc__)
+            sys.exit(2)
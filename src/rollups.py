@@ -0,0 +1,198 @@
+"""
+    Rollups of old Lokation_log points into per-tracker hourly and daily summaries in Lokation_rollup.
+
+    Raw fixes older than the rollup age are folded into 'hour' rows, and hour rows older than the daily age into
+    'day' rows. A summary keeps the first and last point, the bounding box, the distance travelled and the point
+    count. Folded rows are deleted in the same transaction that writes the summary, so every fix lives in exactly
+    one tier and a run can stop and resume anywhere. Fixes that arrive late for an hour that is already rolled up
+    are merged into the existing summary on the next run.
+
+    PurgeWorker in server.py runs the rollup when ROLLUP_AFTER_DAYS is set. Enable it on one server process only;
+    two processes folding the same tracker at the same time would count its points twice.
+
+    Usage:
+        python rollups.py           Run one rollup pass with the configured ages (from cron, instead of the worker);
+                                    refuses to run unless ROLLUP_AFTER_DAYS is set
+"""
+import geo
+
+HOUR = "hour"
+DAY = "day"
+DELETE_BATCH = 500
+
+COLUMNS = ("Tracker_id, Periode, Niveau, Foerste_lat, Foerste_long, Foerste_tid, Sidste_lat, Sidste_long, Sidste_tid, "
+           "Min_lat, Max_lat, Min_long, Max_long, Distance_m, Antal")
+
+
+def hour_start(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(timestamp):
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class Summary:
+    """
+        Running summary of a stretch of track. Points are (latitude, longitude, datetime).
+    """
+    def __init__(self, lat, long, timestamp):
+        self.first = self.last = (lat, long, timestamp)
+        self.min_lat = self.max_lat = lat
+        self.min_long = self.max_long = long
+        self.distance = 0.0
+        self.count = 1
+
+    @classmethod
+    def from_row(cls, row):
+        summary = cls(float(row['Foerste_lat']), float(row['Foerste_long']), row['Foerste_tid'])
+        summary.last = (float(row['Sidste_lat']), float(row['Sidste_long']), row['Sidste_tid'])
+        summary.min_lat, summary.max_lat = float(row['Min_lat']), float(row['Max_lat'])
+        summary.min_long, summary.max_long = float(row['Min_long']), float(row['Max_long'])
+        summary.distance = float(row['Distance_m'])
+        summary.count = int(row['Antal'])
+        return summary
+
+    def add(self, lat, long, timestamp):
+        """
+            Appends a point that is not older than the current last point.
+        """
+        self.distance += geo.haversine(self.last[0], self.last[1], lat, long)
+        self.last = (lat, long, timestamp)
+        self.min_lat, self.max_lat = min(self.min_lat, lat), max(self.max_lat, lat)
+        self.min_long, self.max_long = min(self.min_long, long), max(self.max_long, long)
+        self.count += 1
+
+    def merge(self, other):
+        """
+            Adds another summary. The gap between the two is counted as distance when they don't overlap in time;
+            overlapping ones (late fixes) just add up their distances.
+        """
+        earlier, later = (self, other) if self.first[2] <= other.first[2] else (other, self)
+        gap = 0.0
+        if earlier.last[2] <= later.first[2]:
+            gap = geo.haversine(earlier.last[0], earlier.last[1], later.first[0], later.first[1])
+
+        self.distance += other.distance + gap
+        self.first = earlier.first
+        self.last = max(self.last, other.last, key=lambda point: point[2])
+        self.min_lat, self.max_lat = min(self.min_lat, other.min_lat), max(self.max_lat, other.max_lat)
+        self.min_long, self.max_long = min(self.min_long, other.min_long), max(self.max_long, other.max_long)
+        self.count += other.count
+
+    def row(self, tracker_id, period, level):
+        return (tracker_id, period, level, self.first[0], self.first[1], self.first[2], self.last[0], self.last[1], self.last[2],
+                self.min_lat, self.max_lat, self.min_long, self.max_long, self.distance, self.count)
+
+
+def store(db, tracker_id, level, summaries):
+    """
+        Merges the summaries ({period: Summary}) into the tracker's existing rows of that level and writes them back.
+    """
+    periods = sorted(summaries)
+    query = ("SELECT * FROM Lokation_rollup WHERE Tracker_id = %s AND Periode >= %s AND Periode <= %s AND Niveau = %s")
+    db.execute_query(query, (tracker_id, periods[0], periods[-1], level))
+    for row in db.fetchall():
+        period = row['Periode']
+        if period in summaries:
+            existing = Summary.from_row(row)
+            existing.merge(summaries[period])
+            summaries[period] = existing
+
+    query = "REPLACE INTO Lokation_rollup (%s) VALUES (%s)" % (COLUMNS, ", ".join(["%s"] * 15))
+    db.execute_many(query, [summaries[period].row(tracker_id, period, level) for period in periods])
+
+
+def fold_fixes(db, tracker_id, before, limit):
+    """
+        Folds up to limit of the tracker's oldest raw fixes before the given time into hour summaries and deletes them.
+        Returns the number of fixes folded; commits.
+    """
+    query = ("SELECT id, Latitude, Longitude, Tidspunkt FROM Lokation_log WHERE Tracker_id = %s AND Tidspunkt < %s "
+             "ORDER BY Tidspunkt, id LIMIT %s")
+    db.execute_query(query, (tracker_id, before, limit))
+    rows = db.fetchall()
+    if not rows:
+        return 0
+
+    summaries = {}
+    for row in rows:
+        period = hour_start(row['Tidspunkt'])
+        point = (float(row['Latitude']), float(row['Longitude']), row['Tidspunkt'])
+        if period in summaries:
+            summaries[period].add(*point)
+        else:
+            summaries[period] = Summary(*point)
+
+    store(db, tracker_id, HOUR, summaries)
+
+    # Slet præcis de læste rækker (id + Tidspunkt rammer den rigtige partition)
+    for i in range(0, len(rows), DELETE_BATCH):
+        batch = rows[i:i + DELETE_BATCH]
+        query = "DELETE FROM Lokation_log WHERE Tracker_id = %%s AND Tidspunkt <= %%s AND id IN (%s)" % ", ".join(["%s"] * len(batch))
+        db.execute_query(query, (tracker_id, batch[-1]['Tidspunkt'], *[row['id'] for row in batch]))
+
+    db.commit()
+    return len(rows)
+
+
+def fold_hours(db, tracker_id, before, limit):
+    """
+        Folds up to limit of the tracker's oldest hour summaries before the given time into day summaries and deletes them.
+        Returns the number of hour rows folded; commits.
+    """
+    query = ("SELECT * FROM Lokation_rollup WHERE Tracker_id = %s AND Niveau = %s AND Periode < %s "
+             "ORDER BY Periode LIMIT %s")
+    db.execute_query(query, (tracker_id, HOUR, before, limit))
+    rows = db.fetchall()
+    if not rows:
+        return 0
+
+    summaries = {}
+    for row in rows:
+        period = day_start(row['Periode'])
+        if period in summaries:
+            summaries[period].merge(Summary.from_row(row))
+        else:
+            summaries[period] = Summary.from_row(row)
+
+    store(db, tracker_id, DAY, summaries)
+
+    query = "DELETE FROM Lokation_rollup WHERE Tracker_id = %s AND Niveau = %s AND Periode <= %s"
+    db.execute_query(query, (tracker_id, HOUR, rows[-1]['Periode']))
+
+    db.commit()
+    return len(rows)
+
+
+def summary_points(db, tracker_id, start, end):
+    """
+        First and last point of every summary of the tracker that overlaps [start, end), for history views.
+        Returns (points, number of summaries read).
+    """
+    query = ("SELECT Foerste_lat, Foerste_long, Foerste_tid, Sidste_lat, Sidste_long, Sidste_tid FROM Lokation_rollup "
+             "WHERE Tracker_id = %s AND Periode < %s AND Sidste_tid >= %s ORDER BY Periode")
+    db.execute_query(query, (tracker_id, end, start))
+    rows = db.fetchall()
+
+    points = []
+    for row in rows:
+        for prefix in ("Foerste", "Sidste"):
+            timestamp = row[prefix + '_tid']
+            if start <= timestamp < end and not (prefix == "Sidste" and timestamp == row['Foerste_tid']):
+                points.append((float(row[prefix + '_lat']), float(row[prefix + '_long']), timestamp))
+    return points, len(rows)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from server import data_handler, PurgeWorker
+
+    # Serverens egen worker stoppes, så kun denne kørsel folder punkter
+    data_handler.purger.stop()
+    worker = PurgeWorker(data_handler.db_connection, start=False)
+    if worker.rollup_days <= 0:
+        print("[!] Set ROLLUP_AFTER_DAYS to the age in days before fixes are rolled up; refusing to run without it")
+        sys.exit(2)
+    print("[+] Rolled up: %s" % worker.roll_up())
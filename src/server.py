@@ -1,241 +1,1761 @@
 import os
-from flask import Flask, request, jsonify
-import mysql.connector as mysql
-from mysql.connector import Error, OperationalError
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from collections import OrderedDict, deque
 import secrets
 import bcrypt
 import time
 import json, hmac, hashlib
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import atexit
+import logging
+import signal
+import sys
+from datetime import datetime, timedelta
+import geo
+import geofence
+import trips
+import binary_frame
+import export
+from storage import open_database, StreamsBusy
+import migrations
+import rollups
+import metrics
+import logs
 
 app = Flask(__name__)
+logs.setup()
+log = logging.getLogger("biltracker.server")
+
+MAX_BATCH_FIXES = int(os.getenv("MAX_BATCH_FIXES", 500))
+# Enhedens tidsstempler skal ligge i et vindue om serverens tid; et ur uden NTP-synkronisering står på år 2000
+FIX_MAX_AHEAD_SECONDS = int(os.getenv("FIX_MAX_AHEAD_SECONDS", 86400))
+FIX_MAX_AGE_DAYS = int(os.getenv("FIX_MAX_AGE_DAYS", 30))
+INGEST_MODE = os.getenv("INGEST_MODE", "sync")
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 50000))
+HISTORY_DEFAULT_POINTS = int(os.getenv("HISTORY_DEFAULT_POINTS", 500))
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", 5000))
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", 15))
+# Signatur i headers over den rå body; den gamle "hmac" i JSON accepteres kun i overgangsperioden
+TRACKER_ID_HEADER = "X-Tracker-Id"
+SIGNATURE_HEADER = "X-Signature"
+ALLOW_LEGACY_HMAC = os.getenv("ALLOW_LEGACY_HMAC", "1") == "1"
+# Bulk provisioning ("provision trackers") er slået fra, medmindre PROVISIONING_TOKEN er sat
+PROVISIONING_TOKEN = os.getenv("PROVISIONING_TOKEN")
+PROVISIONING_MAX = int(os.getenv("PROVISIONING_MAX", 10000))
+GEOFENCE_EVENT_LIMIT = int(os.getenv("GEOFENCE_EVENT_LIMIT", 1000))
+TRIPS_PAGE_SIZE = int(os.getenv("TRIPS_PAGE_SIZE", 500))
+FLEET_MAX_TRACKERS = int(os.getenv("FLEET_MAX_TRACKERS", 200))
+# Token buckets pr. emne, (tokens pr. sekund, burst) pr. tracker id og pr. klient-IP; None = ingen grænse, "*" = øvrige emner
+RATE_LIMITING = os.getenv("RATE_LIMITING", "1") == "1"
+RATE_LIMITS = {
+    "received coords":          {"tracker": (1, 10), "ip": (50, 200)},
+    "received coords batch":    {"tracker": (0.5, 5), "ip": (50, 200)},
+    "binary frame":             {"tracker": (0.5, 5), "ip": (50, 200)},
+    "signed request":           {"tracker": (1, 10), "ip": (50, 200)},
+    "tracker id request":       {"tracker": None, "ip": (1 / 60, 5)},
+    "provision trackers":       {"tracker": None, "ip": (0.1, 2)},
+    "login request":            {"tracker": (0.2, 5), "ip": (2, 20)},
+    # Flådelogin koster én token pr. tracker id (et bcrypt-tjek hver); IP-burst skal rumme FLEET_MAX_TRACKERS
+    "fleet login":              {"tracker": (0.2, 5), "ip": (1, FLEET_MAX_TRACKERS)},
+    "reset password request":   {"tracker": (0.05, 3), "ip": (0.5, 10)},
+    "update password request":  {"tracker": (0.05, 3), "ip": (0.5, 10)},
+    "*":                        {"tracker": (5, 20), "ip": (20, 100)},
+}
+# Fx RATE_LIMITS='{"received coords": {"tracker": [2, 20], "ip": null}}'
+for _subject, _limits in json.loads(os.getenv("RATE_LIMITS", "{}")).items():
+    RATE_LIMITS[_subject] = {kind: tuple(limit) if limit else None for kind, limit in _limits.items()}
+# Bag nginx: klientens adresse fra proxy-headeren; tom værdi = remote_addr
+REAL_IP_HEADER = os.getenv("REAL_IP_HEADER", "X-Real-IP")
+
+INGEST_FLUSH_LATENCY = metrics.Histogram("biltracker_ingest_flush_duration_seconds", "Time per write-behind group commit.")
+INGEST_REJECTED = metrics.Counter("biltracker_ingest_rejected_fixes_total", "Fixes rejected because the write-behind queue was full.")
+SIGNED_REQUESTS = metrics.Counter("biltracker_signed_requests_total", "Signature checks per scheme (header/legacy) and result.", ("scheme", "result"))
+GEOFENCE_EVENTS = metrics.Counter("biltracker_geofence_events_total", "Geofence enter/exit events.", ("event",))
+PURGED_ROWS = metrics.Counter("biltracker_purged_rows_total", "Lokation_log rows removed by PurgeWorker, per reason.", ("reason",))
+EXPORTED_ROWS = metrics.Counter("biltracker_exported_rows_total", "Fixes written by history exports, per format.", ("format",))
+RATE_LIMITED = metrics.Counter("biltracker_rate_limited_total", "Requests rejected with 429, per subject and bucket (tracker/ip).", ("subject", "bucket"))
+BCRYPT_REJECTED = metrics.Counter("biltracker_bcrypt_rejected_total", "bcrypt jobs rejected by the worker pool.", ("reason",))
+
+class TrackerKeyCache:
+    """
+        Bounded LRU cache of Token_key values with a TTL, shared by the integrity check and the ingest path.
+
+        Unknown tracker ids are cached as well (with a shorter TTL) so spoofed ids don't cost a query per request.
+        Entries are dropped explicitly whenever a tracker is created or reset.
+    """
+    MISSING = object()
+
+    def __init__(self, max_size=None, ttl=None, negative_ttl=None):
+        self.max_size = max_size or int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+        self.ttl = ttl or float(os.getenv("TOKEN_CACHE_TTL", 300))
+        self.negative_ttl = negative_ttl or float(os.getenv("TOKEN_CACHE_NEGATIVE_TTL", 30))
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, tracker_id):
+        """
+            Returns the cached Token_key, TrackerKeyCache.MISSING for a cached unknown id, or None on a cache miss.
+        """
+        with self.lock:
+            entry = self.entries.get(tracker_id)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[tracker_id]
+                return None
+
+            self.entries.move_to_end(tracker_id)
+            return value
+
+    def put(self, tracker_id, token_key):
+        ttl = self.ttl if token_key is not self.MISSING else self.negative_ttl
+        with self.lock:
+            self.entries[tracker_id] = (token_key, time.monotonic() + ttl)
+            self.entries.move_to_end(tracker_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, tracker_id):
+        with self.lock:
+            self.entries.pop(tracker_id, None)
+
+
+class PositionCache:
+    """
+        Last known position per tracker, updated by the ingest path after each commit.
+
+        Entries expire after POSITION_CACHE_TTL seconds so several server processes can't serve each other's
+        stale positions for long; a miss falls back to the Tracker_seneste summary table.
+    """
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("POSITION_CACHE_TTL", 5))
+        self.positions = {}
+        self.lock = threading.Lock()
+
+    def get(self, tracker_id):
+        with self.lock:
+            entry = self.positions.get(tracker_id)
+            if entry is None or entry[3] < time.monotonic():
+                return None
+            return entry[:3]
+
+    def update(self, tracker_id, lat, long, timestamp):
+        """
+            Stores the position unless a newer one is already cached.
+        """
+        with self.lock:
+            entry = self.positions.get(tracker_id)
+            if entry is None or entry[2] <= timestamp:
+                self.positions[tracker_id] = (lat, long, timestamp, time.monotonic() + self.ttl)
+
+    def invalidate(self, tracker_id):
+        with self.lock:
+            self.positions.pop(tracker_id, None)
+
+
+class LocationWriter:
+    """
+        Write-behind writer for Lokation_log.
+
+        Validated fixes are queued in memory and the request returns straight away; a background thread
+        inserts them in group commits once batch_size rows are waiting or every interval_ms milliseconds.
+        When the queue is full, submit() waits up to put_timeout seconds and then rejects the fixes so the
+        caller can answer 503 (backpressure). stop() drains the queue before the process exits, at exit and on SIGTERM.
+
+        The queued fixes have already been answered 202, so nothing is dropped while the database is unreachable:
+        transient errors (see storage transient()) are retried with backoff up to INGEST_RETRY_MAX_MS apart, and the
+        queue fills up meanwhile. A group commit that keeps failing for another reason is split in halves until the
+        rows that fail are isolated; only those are dropped.
+    """
+    def __init__(self, db_connection, data_handler, max_queue=None, batch_size=None, interval_ms=None, put_timeout=None,
+                 retry_max_ms=None):
+        self.db_connection = db_connection
+        self.data_handler = data_handler
+        self.max_queue = max_queue or int(os.getenv("INGEST_QUEUE_SIZE", 10000))
+        self.batch_size = batch_size or int(os.getenv("INGEST_BATCH_SIZE", 500))
+        self.interval = (interval_ms or int(os.getenv("INGEST_FLUSH_MS", 200))) / 1000.0
+        self.put_timeout = put_timeout if put_timeout is not None else float(os.getenv("INGEST_PUT_TIMEOUT", 0.5))
+        self.retry_max = (retry_max_ms or int(os.getenv("INGEST_RETRY_MAX_MS", 5000))) / 1000.0
+
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.stopping = False
+
+        self.counters = {"enqueued": 0, "rejected": 0, "flushed": 0, "failed": 0, "flushes": 0, "retries": 0,
+                         "flush_seconds_total": 0.0, "flush_seconds_last": 0.0, "flush_seconds_max": 0.0}
+
+        self.thread = threading.Thread(target=self.run, name="location-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, rows):
+        """
+            Queues (latitude, longitude, Tracker_id, Tidspunkt) rows. Returns False if the queue stayed full.
+        """
+        with self.cond:
+            has_room = self.cond.wait_for(lambda: self.stopping or len(self.pending) + len(rows) <= self.max_queue,
+                                          timeout=self.put_timeout)
+            if not has_room or self.stopping:
+                self.counters["rejected"] += len(rows)
+                INGEST_REJECTED.inc(amount=len(rows))
+                return False
+
+            self.pending.extend(rows)
+            self.counters["enqueued"] += len(rows)
+            if len(self.pending) >= self.batch_size:
+                self.cond.notify_all()
+            return True
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.stopping or len(self.pending) >= self.batch_size, timeout=self.interval)
+                if self.stopping and not self.pending:
+                    return
+
+                rows = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+                self.cond.notify_all()
+
+            if rows:
+                self.flush(rows)
+
+    def flush(self, rows, attempts=3):
+        query = "INSERT INTO Lokation_log (latitude, longitude, Tracker_id, Tidspunkt) VALUES (%s, %s, %s, %s)"
+
+        attempt = 0
+        delay = 0.1
+        while attempt < attempts:
+            started = time.perf_counter()
+            try:
+                with self.db_connection.connection():
+                    self.db_connection.execute_many(query, rows)
+                    derived = self.data_handler.write_derived(rows)
+                    self.db_connection.commit()
+                self.data_handler.publish_derived(derived)
+            except Exception as e:
+                try:
+                    with self.db_connection.connection():
+                        self.db_connection.rollback()
+                except Exception:
+                    pass
+
+                if self.db_connection.transient(e):
+                    # Databasen er væk, ikke rækkerne: vent og prøv igen, mens køen giver modtryk
+                    log.warning("Database unavailable, retrying %d rows in %.1f s: %s", len(rows), delay, e)
+                    with self.cond:
+                        self.counters["retries"] += 1
+                    time.sleep(delay)
+                    delay = min(2 * delay, self.retry_max)
+                    continue
+
+                attempt += 1
+                if len(rows) == 1 or attempts > 1:
+                    log.exception("Exception in LocationWriter.flush of %d rows (attempt %d/%d)", len(rows), attempt, attempts)
+                if attempt < attempts:
+                    time.sleep(0.1 * attempt)
+                continue
+
+            elapsed = time.perf_counter() - started
+            INGEST_FLUSH_LATENCY.observe(elapsed)
+            with self.cond:
+                self.counters["flushed"] += len(rows)
+                self.counters["flushes"] += 1
+                self.counters["flush_seconds_total"] += elapsed
+                self.counters["flush_seconds_last"] = elapsed
+                self.counters["flush_seconds_max"] = max(self.counters["flush_seconds_max"], elapsed)
+            return True
+
+        if len(rows) > 1:
+            # En enkelt dårlig række må ikke koste hele gruppen: halvdelene skrives hver for sig, uden flere forsøg
+            middle = len(rows) // 2
+            first = self.flush(rows[:middle], attempts=1)
+            second = self.flush(rows[middle:], attempts=1)
+            return first and second
+
+        log.error("Dropping fix of %s at %s after failed writes", rows[0][2], rows[0][3])
+        with self.cond:
+            self.counters["failed"] += 1
+        return False
+
+    def stop(self, timeout=30):
+        """
+            Stops accepting fixes and waits for the queued ones to be written.
+        """
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+    def stats(self):
+        with self.cond:
+            return dict(self.counters, queue_depth=len(self.pending), queue_capacity=self.max_queue)
+
+
+class PurgeWorker:
+    """
+        Background deletes from Lokation_log in bounded chunks, so a large purge never holds locks for long or
+        stalls ingest.
+
+        password_reset() queues a job in Sletning_job (all of a tracker's rows before the reset) inside its own
+        transaction; the worker deletes chunk_size rows per transaction, records progress in the job row and sleeps
+        pause_ms between chunks. Jobs survive restarts and are picked up again on start. With RETENTION_DAYS set, the
+        same loop drops rows older than the retention window every RETENTION_INTERVAL seconds (whole expired
+        partitions are dropped first on MySQL), and with ROLLUP_AFTER_DAYS set it folds older fixes into hourly
+        and, after ROLLUP_DAILY_AFTER_DAYS, daily summaries (see rollups.py).
+    """
+    def __init__(self, db_connection, chunk_size=None, pause_ms=None, retention_days=None, retention_interval=None,
+                 rollup_days=None, rollup_daily_days=None, start=True):
+        self.db_connection = db_connection
+        self.chunk_size = chunk_size or int(os.getenv("PURGE_CHUNK_SIZE", 5000))
+        self.pause = (pause_ms if pause_ms is not None else int(os.getenv("PURGE_PAUSE_MS", 50))) / 1000.0
+        self.retention_days = retention_days if retention_days is not None else int(os.getenv("RETENTION_DAYS", 0))
+        self.retention_interval = retention_interval or float(os.getenv("RETENTION_INTERVAL", 3600))
+        self.rollup_days = rollup_days if rollup_days is not None else int(os.getenv("ROLLUP_AFTER_DAYS", 0))
+        self.rollup_daily_days = rollup_daily_days or int(os.getenv("ROLLUP_DAILY_AFTER_DAYS", 90))
+
+        self.cond = threading.Condition()
+        self.wakeups = 0
+        self.stopping = False
+        self.counters = {"jobs_done": 0, "reset_rows": 0, "retention_rows": 0, "chunks": 0, "errors": 0,
+                         "retention_runs": 0, "retention_last": None, "rollup_fixes": 0, "rollup_hours": 0, "rollup_runs": 0}
+
+        self.thread = threading.Thread(target=self.run, name="purge-worker", daemon=True)
+        if start:
+            self.thread.start()
+
+    def schedule(self, tracker_id, before):
+        """
+            Queues deletion of the tracker's rows older than before. Runs inside the caller's transaction; call wake() after commit.
+        """
+        query = "INSERT INTO Sletning_job (Tracker_id, Foer, Oprettet) VALUES (%s, %s, %s)"
+        self.db_connection.execute_query(query, (tracker_id, before, datetime.now()))
 
-class DatabaseConnection:
-    def __init__(self):
-        self.db = None
-        self.mycursor = None
-        self.connect()
+    def wake(self):
+        with self.cond:
+            self.wakeups += 1
+            self.cond.notify_all()
+
+    def run(self):
+        next_retention = time.monotonic()
+        seen = -1
+        while True:
+            with self.cond:
+                timeout = max(0.0, next_retention - time.monotonic()) if self.retention_days or self.rollup_days > 0 else None
+                self.cond.wait_for(lambda: self.stopping or self.wakeups != seen, timeout=timeout)
+                if self.stopping:
+                    return
+                seen = self.wakeups
+
+            try:
+                while not self.stopping and self.run_next_job():
+                    pass
+
+                if (self.retention_days or self.rollup_days > 0) and time.monotonic() >= next_retention:
+                    if self.retention_days:
+                        self.enforce_retention()
+                    if self.rollup_days > 0:
+                        self.roll_up()
+                    next_retention = time.monotonic() + self.retention_interval
+            except Exception:
+                log.exception("Exception in PurgeWorker")
+                with self.cond:
+                    self.counters["errors"] += 1
+                    # Prøv igen om lidt, eller så snart et nyt job bliver lagt i kø
+                    self.cond.wait_for(lambda: self.stopping or self.wakeups != seen, timeout=60)
+                    seen = -1
+
+    def delete_chunks(self, statement, params, on_chunk=None):
+        """
+            Runs the chunked DELETE until it removes fewer than chunk_size rows. Every chunk is its own transaction.
+        """
+        query = self.db_connection.statement(statement)
+        total = 0
+        while not self.stopping:
+            with self.db_connection.connection():
+                self.db_connection.execute_query(query, params + (self.chunk_size,))
+                deleted = self.db_connection.get_row_count()
+                if on_chunk is not None:
+                    on_chunk(deleted)
+                self.db_connection.commit()
+
+            total += deleted
+            with self.cond:
+                self.counters["chunks"] += 1
+            if deleted < self.chunk_size:
+                break
+            time.sleep(self.pause)
+        return total
+
+    def run_next_job(self):
+        with self.db_connection.connection():
+            query = "SELECT Id, Tracker_id, Foer FROM Sletning_job WHERE Status = 'pending' ORDER BY Id LIMIT 1"
+            self.db_connection.execute_query(query)
+            job = self.db_connection.fetchone()
+        if job is None:
+            return False
+
+        def progress(deleted):
+            query = "UPDATE Sletning_job SET Slettet = Slettet + %s WHERE Id = %s"
+            self.db_connection.execute_query(query, (deleted, job['Id']))
+
+        deleted = self.delete_chunks("purge_tracker_chunk", (job['Tracker_id'], job['Foer']), progress)
+        if self.stopping:
+            return False
+
+        with self.db_connection.connection():
+            query = "DELETE FROM Lokation_rollup WHERE Tracker_id = %s AND Periode < %s"
+            self.db_connection.execute_query(query, (job['Tracker_id'], job['Foer']))
+
+            query = "DELETE FROM Geofence_haendelse WHERE Tracker_id = %s AND Tidspunkt < %s"
+            self.db_connection.execute_query(query, (job['Tracker_id'], job['Foer']))
+
+            query = "DELETE FROM Trips WHERE Tracker_id = %s AND Start_tid < %s"
+            self.db_connection.execute_query(query, (job['Tracker_id'], job['Foer']))
+
+            query = "UPDATE Sletning_job SET Status = 'done', Faerdig = %s WHERE Id = %s"
+            self.db_connection.execute_query(query, (datetime.now(), job['Id']))
+            self.db_connection.commit()
+
+        PURGED_ROWS.inc("reset", amount=deleted)
+        with self.cond:
+            self.counters["jobs_done"] += 1
+            self.counters["reset_rows"] += deleted
+        log.info("Purge job %d done: %d rows of %s deleted", job['Id'], deleted, job['Tracker_id'])
+        return True
+
+    def enforce_retention(self):
+        cutoff = datetime.now() - timedelta(days=self.retention_days)
+
+        if self.db_connection.dialect == "mysql":
+            with self.db_connection.connection():
+                dropped = migrations.drop_expired_partitions(self.db_connection, cutoff)
+            if dropped:
+                log.info("Retention dropped partitions: %s", ", ".join(dropped))
+
+        deleted = self.delete_chunks("purge_before_chunk", (cutoff,))
+        self.delete_chunks("purge_rollup_before_chunk", (cutoff,))
+        PURGED_ROWS.inc("retention", amount=deleted)
+        with self.cond:
+            self.counters["retention_rows"] += deleted
+            self.counters["retention_runs"] += 1
+            self.counters["retention_last"] = cutoff.isoformat()
+
+    def roll_up(self):
+        """
+            One rollup pass over every tracker, chunk_size rows per transaction with the usual pause in between.
+            Returns {"fixes": raw fixes folded into hours, "hours": hour rows folded into days}.
+        """
+        if self.rollup_days <= 0:
+            # Med 0 dage ville alle fix før den aktuelle time blive foldet og slettet
+            raise ValueError("Rollup needs ROLLUP_AFTER_DAYS > 0 (got %r)" % self.rollup_days)
+
+        now = datetime.now()
+        hour_before = rollups.hour_start(now - timedelta(days=self.rollup_days))
+        day_before = rollups.day_start(now - timedelta(days=max(self.rollup_daily_days, self.rollup_days)))
+
+        with self.db_connection.connection():
+            self.db_connection.execute_query("SELECT Tracker_id FROM Tracker_enheder")
+            tracker_ids = [row['Tracker_id'] for row in self.db_connection.fetchall()]
+
+        folded = {"fixes": 0, "hours": 0}
+        for tracker_id in tracker_ids:
+            for name, fold, before in (("fixes", rollups.fold_fixes, hour_before), ("hours", rollups.fold_hours, day_before)):
+                while not self.stopping:
+                    with self.db_connection.connection():
+                        count = fold(self.db_connection, tracker_id, before, self.chunk_size)
+                    folded[name] += count
+                    if count < self.chunk_size:
+                        break
+                    time.sleep(self.pause)
+
+        with self.cond:
+            self.counters["rollup_fixes"] += folded["fixes"]
+            self.counters["rollup_hours"] += folded["hours"]
+            self.counters["rollup_runs"] += 1
+        return folded
+
+    def pending_jobs(self):
+        with self.db_connection.connection():
+            query = "SELECT Id, Tracker_id, Foer, Slettet, Oprettet FROM Sletning_job WHERE Status = 'pending' ORDER BY Id"
+            self.db_connection.execute_query(query)
+            return [{"id": row['Id'], "tracker_id": row['Tracker_id'], "before": row['Foer'].isoformat(),
+                     "deleted": int(row['Slettet']), "created": row['Oprettet'].isoformat()} for row in self.db_connection.fetchall()]
+
+    def stop(self, timeout=10):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+    def stats(self):
+        with self.cond:
+            return dict(self.counters, chunk_size=self.chunk_size, pause_ms=int(self.pause * 1000), retention_days=self.retention_days,
+                        rollup_days=self.rollup_days, rollup_daily_days=self.rollup_daily_days)
+
+
+class SessionTokens:
+    """
+        Short-lived HMAC-signed session tokens for app clients.
+
+        A token is "<base64 payload>.<hex hmac>", where the payload holds the tracker id (or, for a fleet token, a
+        list of tracker ids), issue time and expiry. Tokens are checked without touching the database or bcrypt. revoke() invalidates every token issued for a
+        tracker before that moment; revocations live in this process, so multi-process deployments must share
+        SESSION_SECRET and keep SESSION_TTL short.
+    """
+    def __init__(self, secret=None, ttl=None):
+        secret = secret or os.getenv("SESSION_SECRET")
+        self.secret = secret.encode('utf-8') if secret else secrets.token_bytes(32)
+        self.ttl = ttl or int(os.getenv("SESSION_TTL", 900))
+        self.revoked_before = {}
+        self.lock = threading.Lock()
+
+    def sign(self, payload):
+        return hmac.new(self.secret, payload, hashlib.sha256).hexdigest()
+
+    def issue(self, tracker_id):
+        return self.encode({"tid": tracker_id})
+
+    def issue_fleet(self, tracker_ids):
+        """
+            One token for several trackers; it works for every read subject of each of them.
+        """
+        return self.encode({"tids": list(tracker_ids)})
 
-    def connect(self):
+    def encode(self, claims):
+        now_ms = int(time.time() * 1000)
+        claims = dict(claims, iat=now_ms, exp=now_ms + self.ttl * 1000)
+        payload = base64.urlsafe_b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+        return "%s.%s" % (payload.decode('ascii'), self.sign(payload)), self.ttl
+
+    def decode(self, token):
+        """
+            Returns the claims of an authentic, unexpired token, otherwise None.
+        """
         try:
-            self.db = mysql.connect(
-                unix_socket="/var/run/mysqld/mysqld.sock",
-                user="tracker",
-                passwd=os.getenv("MY_DB_PASSWORD"),
-                database="biltracker",
-                connection_timeout=300
-            )
-            self.mycursor = self.db.cursor(dictionary=True)
-            print("Connected to database")
-        except Error as e:
-            print(f"Error connecting to MySQL: {e}")
-            raise
-
-    def reconnect(self):
-        if self.db is None or not self.db.is_connected():
-            self.connect()
-
-    def execute_query(self, query, params=None):
-        self.reconnect()
+            payload, signature = token.encode('ascii').rsplit(b'.', 1)
+            if not hmac.compare_digest(self.sign(payload), signature.decode('ascii')):
+                return None
+            claims = json.loads(base64.urlsafe_b64decode(payload))
+        except (AttributeError, ValueError, UnicodeError):
+            return None
+
+        if not isinstance(claims, dict) or claims.get("exp", 0) < time.time() * 1000:
+            return None
+        return claims
+
+    def verify(self, token, tracker_id):
+        """
+            Returns True if the token is authentic, unexpired, issued for tracker_id and not revoked.
+        """
+        return tracker_id in self.trackers(token)
+
+    def trackers(self, token):
+        """
+            Tracker ids the token is currently valid for: its tracker, or a fleet token's trackers, minus the revoked ones.
+        """
+        claims = self.decode(token)
+        if claims is None:
+            return set()
+
+        tracker_ids = claims.get("tids") or [claims.get("tid")]
+        with self.lock:
+            return {tracker_id for tracker_id in tracker_ids
+                    if isinstance(tracker_id, str) and claims.get("iat", 0) > self.revoked_before.get(tracker_id, 0)}
+
+    def revoke(self, tracker_id):
+        with self.lock:
+            self.revoked_before[tracker_id] = int(time.time() * 1000)
+
+
+class RateLimiter:
+    """
+        In-process token buckets for admission control, checked in handle() and /frame before any signature check
+        or query.
+
+        Every subject has a bucket per tracker id and one per client IP, with the limits from RATE_LIMITS ("*" for
+        subjects not listed there). The tracker id is the one the request claims, so a spoofed id can drain a real
+        tracker's bucket; the IP bucket is what holds the spoofer back. Requests signed in headers are checked as
+        "signed request" (X-Tracker-Id and IP) before the signature and before the body is decoded, and against their
+        subject once it is known. Buckets live in a bounded LRU and an evicted bucket comes back full.
+    """
+    def __init__(self, limits, max_buckets=None):
+        self.limits = limits
+        self.max_buckets = max_buckets or int(os.getenv("RATE_LIMIT_BUCKETS", 100000))
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, now, cost=1):
+        """
+            Takes cost tokens from the bucket and returns 0, or the seconds until there are enough. A cost above the
+            burst needs a full bucket. Caller holds the lock.
+        """
+        tokens, updated = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        cost = min(cost, burst)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+
+        self.buckets[key] = (tokens, now)
+        self.buckets.move_to_end(key)
+        return wait
+
+    def check(self, subject, tracker_id, ip):
+        """
+            Returns None if the request may go ahead, otherwise (bucket, seconds to wait) for the first empty bucket.
+            tracker_id may be a tuple of ids (fleet login): each id takes a token from its own bucket and the IP bucket
+            gives one token per id.
+        """
+        if subject not in self.limits:
+            subject = "*"
+        limits = self.limits[subject]
+        tracker_ids = tracker_id if isinstance(tracker_id, tuple) else (tracker_id,)
+        now = time.monotonic()
+
+        with self.lock:
+            try:
+                for bucket, key, cost in [("ip", ip, len(tracker_ids))] + [("tracker", key, 1) for key in tracker_ids]:
+                    limit = limits.get(bucket)
+                    if limit is None or key is None:
+                        continue
+
+                    wait = self.take((subject, bucket, str(key)[:64]), limit[0], limit[1], now, cost)
+                    if wait:
+                        return bucket, wait
+                return None
+            finally:
+                while len(self.buckets) > self.max_buckets:
+                    self.buckets.popitem(last=False)
+
+
+class AuthBusy(Exception):
+    """
+        Raised when the bcrypt pool is saturated or a hash doesn't finish within the timeout.
+    """
+
+
+class BcryptPool:
+    """
+        Bounded worker pool for bcrypt hashing and verification, so auth bursts queue here instead of
+        tying up request threads that coordinate ingest needs.
+
+        bcrypt releases the GIL while hashing, so a thread pool runs hashes in parallel without the pickling and
+        fork-at-import problems a process pool would have with this module. At most BCRYPT_QUEUE_LIMIT jobs may be
+        running or waiting; BCRYPT_REJECT decides whether further jobs fail immediately ("fail") or wait up to
+        BCRYPT_TIMEOUT for room ("wait"). A job that doesn't finish within BCRYPT_TIMEOUT raises AuthBusy as well.
+    """
+    def __init__(self, workers=None, queue_limit=None, timeout=None, reject=None):
+        self.workers = workers or int(os.getenv("BCRYPT_WORKERS", 2))
+        self.queue_limit = queue_limit or int(os.getenv("BCRYPT_QUEUE_LIMIT", 32))
+        self.timeout = timeout or float(os.getenv("BCRYPT_TIMEOUT", 5))
+        self.reject = reject or os.getenv("BCRYPT_REJECT", "fail")
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self.slots = threading.BoundedSemaphore(self.queue_limit)
+        self.rejected = 0
+
+    def run(self, function, *args):
+        return self.wait(self.submit(function, *args))
+
+    def submit(self, function, *args):
+        if self.reject == "wait":
+            acquired = self.slots.acquire(timeout=self.timeout)
+        else:
+            acquired = self.slots.acquire(blocking=False)
+
+        if not acquired:
+            self.rejected += 1
+            BCRYPT_REJECTED.inc("queue full")
+            raise AuthBusy("bcrypt queue is full")
+
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def wait(self, future):
         try:
-            self.mycursor.execute(query, params)
-        except OperationalError as err:
-            if err.errno in (mysql.errorcode.CR_SERVER_LOST, mysql.errorcode.CR_SERVER_GONE_ERROR):
-                print("Lost connection to MySQL server, attempting to reconnect...")
-                self.reconnect()
-                self.mycursor.execute(query, params)
-            else:
-                print(f"Error executing query: {err}")
-                raise
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            self.rejected += 1
+            BCRYPT_REJECTED.inc("timeout")
+            raise AuthBusy("bcrypt job timed out")
 
-    def fetchall(self):
-        return self.mycursor.fetchall()
+    def hashpw(self, password):
+        return self.run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt())
 
-    def fetchone(self):
-        return self.mycursor.fetchone()
+    def checkpw(self, password, hashed):
+        return self.run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
 
-    def fetchone_column(self, column):
-        row = self.fetchone()
-        if row:
-            return row.get(column)
-        return None
+    def checkpw_many(self, pairs):
+        """
+            Checks a list of (password, hash) pairs and returns a list of booleans. At most `workers` of them are queued
+            at a time, so a fleet login leaves room in the queue for everyone else.
+        """
+        results = []
+        for i in range(0, len(pairs), self.workers):
+            futures = [self.submit(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+                       for password, hashed in pairs[i:i + self.workers]]
+            results.extend(self.wait(future) for future in futures)
+        return results
+
+
+class PositionBroadcaster:
+    """
+        Wakes live-position streams when new fixes for their tracker have been committed in this process.
+
+        Every commit bumps a per-tracker version; subscribers wait for the version to change. Subscribers
+        also re-check the database on every heartbeat, so fixes committed by other server processes arrive
+        with at most one heartbeat of delay.
+    """
+    def __init__(self):
+        self.versions = {}
+        self.cond = threading.Condition()
 
-    def commit(self):
-        self.db.commit()
+    def version(self, tracker_id):
+        with self.cond:
+            return self.versions.get(tracker_id, 0)
 
-    def rollback(self):
-        self.db.rollback()
+    def publish(self, tracker_ids):
+        with self.cond:
+            for tracker_id in tracker_ids:
+                self.versions[tracker_id] = self.versions.get(tracker_id, 0) + 1
+            self.cond.notify_all()
 
-    def get_row_count(self):
-        return self.mycursor.rowcount
+    def wait(self, tracker_id, seen_version, timeout):
+        """
+            Blocks until the tracker's version differs from seen_version or timeout passes. Returns the current version.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.versions.get(tracker_id, 0) != seen_version, timeout=timeout)
+            return self.versions.get(tracker_id, 0)
+
+
+class TrackerIdAllocator:
+    """
+        Hands out tracker ids from the counter in Tracker_sekvens, mapped through a keyed permutation so devices
+        flashed one after another don't get consecutive ids.
+
+        The permutation is a small Feistel network over 28-bit values, cycle-walked into [0, ID_SPACE). It is a
+        bijection, so distinct counter values never collide and no existence check is needed. The key is stored next
+        to the counter, so every server process maps the counter the same way. Ids run from Tracker#100000000 up,
+        clear of the five-digit ids of the old random generator, and fit the uint32 tracker number of binary_frame.
+    """
+    ID_OFFSET = 100000000
+    ID_SPACE = 100000000
+    HALF_BITS = 14
+    ROUNDS = 4
+
+    def __init__(self, db_connection):
+        self.db_connection = db_connection
+
+    def permute(self, value, key):
+        mask = (1 << self.HALF_BITS) - 1
+        while True:
+            left, right = value >> self.HALF_BITS, value & mask
+            for round_number in range(self.ROUNDS):
+                digest = hashlib.blake2s(right.to_bytes(2, 'big') + bytes([round_number]), key=key, digest_size=4).digest()
+                left, right = right, left ^ (int.from_bytes(digest, 'big') & mask)
+            value = (left << self.HALF_BITS) | right
+            if value < self.ID_SPACE:
+                return value
+
+    def allocate(self, count):
+        """
+            Reserves count ids with one UPDATE and one SELECT, whatever the count. Runs inside the caller's transaction;
+            the counter row stays locked until it commits, and a rollback hands the block back.
+        """
+        self.db_connection.execute_query("UPDATE Tracker_sekvens SET Naeste = Naeste + %s WHERE Navn = %s", (count, "tracker"))
+        self.db_connection.execute_query("SELECT Naeste, Noegle FROM Tracker_sekvens WHERE Navn = %s", ("tracker",))
+        row = self.db_connection.fetchone()
+
+        end = int(row['Naeste'])
+        if end > self.ID_SPACE:
+            raise RuntimeError("Tracker id space exhausted")
+
+        key = bytes.fromhex(row['Noegle'])
+        return ['Tracker#%d' % (self.ID_OFFSET + self.permute(counter, key)) for counter in range(end - count, end)]
+
+
+def stop_on_sigterm(stop):
+    """
+        Runs stop() on SIGTERM, then the handler that was installed before (systemd and gunicorn stop with SIGTERM, and
+        the default handler ends the process without running atexit). Only the main thread can install handlers.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handler(signum, frame):
+        stop()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            sys.exit(128 + signum)
+
+    signal.signal(signal.SIGTERM, handler)
 
 
 class DataHandler:
     def __init__(self):
-        self.db_connection = DatabaseConnection()
+        self.db_connection = open_database()
+        self.key_cache = TrackerKeyCache()
+        self.position_cache = PositionCache()
+        self.sessions = SessionTokens()
+        self.bcrypt_pool = BcryptPool()
+        self.broadcaster = PositionBroadcaster()
+        self.id_allocator = TrackerIdAllocator(self.db_connection)
+        self.purger = PurgeWorker(self.db_connection)
+        self.geofences = geofence.GeofenceEngine(self.db_connection)
+        self.geofences.listeners.append(lambda event: GEOFENCE_EVENTS.inc(event["event"]))
+        self.trips = trips.TripSegmenter(self.db_connection)
+        atexit.register(self.purger.stop)
+
+        # INGEST_MODE=write-behind svarer på ingest requests før rækkerne er skrevet til databasen
+        self.writer = None
+        if INGEST_MODE == "write-behind":
+            self.writer = LocationWriter(self.db_connection, self)
+            atexit.register(self.writer.stop)
+            stop_on_sigterm(self.writer.stop)
+
+    def lookup_token_key(self, tracker_id):
+        """
+            Returns the Token_key of a tracker, or None if the tracker doesn't exist. Served from key_cache in the steady state.
+        """
+        token_key = self.key_cache.get(tracker_id)
+
+        if token_key is None:
+            query = "SELECT Token_key FROM Tracker_enheder WHERE Tracker_id = %s"
+            self.db_connection.execute_query(query, (tracker_id,))
+            result = self.db_connection.fetchone()
+
+            token_key = result['Token_key'] if result and result['Token_key'] else TrackerKeyCache.MISSING
+            self.key_cache.put(tracker_id, token_key)
+
+        if token_key is TrackerKeyCache.MISSING:
+            return None
+        return token_key
+
+    def verify_signature(self, tracker_id, body, signature):
+        """
+            Checks the X-Signature header: hex HMAC-SHA256 of the raw request body, keyed with the tracker's Token_key.
+
+            Runs before the body is parsed, so forged or garbage payloads cost one (cached) key lookup and one hash.
+        """
+        token_key = self.lookup_token_key(tracker_id)
+        if token_key is None:
+            return False
+
+        computed_hmac = hmac.new(bytes(token_key, 'utf-8'), body, hashlib.sha256).hexdigest()
+        # compare_digest afviser str med ikke-ASCII tegn (TypeError), så der sammenlignes bytes
+        return hmac.compare_digest(computed_hmac.encode(), signature.lower().encode('utf-8', 'replace'))
 
     def intergrity_check(self, tracker_id=None, received_payload=None):
-        
-        query = "SELECT Token_key FROM Tracker_enheder WHERE Tracker_id = %s"
-        self.db_connection.execute_query(query, (tracker_id,))
-        token_key = self.db_connection.fetchone()
+        """
+            Legacy scheme: "hmac" inside the JSON, computed over the compact re-serialized payload without it.
+            Only used while ALLOW_LEGACY_HMAC is set; new firmware signs the raw body (see verify_signature).
+        """
+        token_key = self.lookup_token_key(tracker_id)
+        if token_key is None or "hmac" not in received_payload:
+            return False
 
-        token_key = bytes(token_key['Token_key'], 'utf-8')
+        token_key = bytes(token_key, 'utf-8')
 
         received_hmac = received_payload.pop("hmac")
+        if not isinstance(received_hmac, str):
+            return False
         payload_str = json.dumps(received_payload, separators=(',', ':'))
         computed_hmac = hmac.new(token_key, payload_str.encode('utf-8'), hashlib.sha256).hexdigest()
 
-        if hmac.compare_digest(computed_hmac, received_hmac):
+        if hmac.compare_digest(computed_hmac.encode(), received_hmac.encode('utf-8', 'replace')):
             return True # Sammenligning success
         else:
             return False # Sammenligning fejlede
 
     def received_coords(self, lat=None, long=None, tracker_id=None):
         """
-            Successful tracker-id verification, results in a "result" variable value of:
-                result = {'Tracker_id': 'Tracker#53355'} 
+            Tracker-id verification goes through lookup_token_key(), which returns the tracker's Token_key:
+                'a3f1...'
 
-            If verification fails, "result" value is of NoneType.
+            If verification fails (unknown tracker), the lookup returns None.
         """
         try:
-            # Tjek 'Tracker_enheder' tabellen om 'Tracker_id' eksisterer.
-            query = "SELECT Tracker_id FROM Tracker_enheder WHERE Tracker_id = %s"
-            self.db_connection.execute_query(query, (tracker_id,))
-            result:str = self.db_connection.fetchone()
-
-            if result is None:
+            # Tjek om 'Tracker_id' eksisterer (fra key_cache, ellers 'Tracker_enheder' tabellen).
+            if self.lookup_token_key(tracker_id) is None:
                 return {"status": "error", "message": "Tracker identification not found"}, 404
 
-            query = "INSERT INTO Lokation_log (latitude, longitude, Tracker_id, Tidspunkt) VALUES (%s, %s, %s, NOW())"
-            self.db_connection.execute_query(query, (lat, long, tracker_id,))
+            try:
+                lat, long = float(lat), float(long)
+                if not (-90 <= lat <= 90 and -180 <= long <= 180):
+                    raise ValueError("coordinates out of range")
+            except (TypeError, ValueError) as e:
+                return {"status": "error", "message": "Malformed coordinates: %s" % e}, 400
+
+            rows = [(lat, long, tracker_id, datetime.now())]
+
+            if self.writer is not None:
+                return self.enqueue_fixes(rows)
+
+            query = "INSERT INTO Lokation_log (latitude, longitude, Tracker_id, Tidspunkt) VALUES (%s, %s, %s, %s)"
+            self.db_connection.execute_query(query, rows[0])
+            derived = self.write_derived(rows)
             self.db_connection.commit()
+            self.publish_derived(derived)
 
             return {"status": "success", "message": "Coordinates insertion successful"}, 200
 
-        except Exception as e:
-            print(f"Exception in received_coords:", e)
+        except Exception:
+            log.exception("Exception in received_coords")
             self.db_connection.rollback()
             return {"status": "error", "message": "Error during coordinates insertion"}, 500
 
-    def get_coords(self, tracker_id=None, tracker_password=None):
+    def fix_time(self, timestamp):
         """
-            Runs bcrypt password check before sending coordinates to client device.
+            Device timestamp (unix seconds) as a server-local datetime. Raises ValueError for times more than
+            FIX_MAX_AHEAD_SECONDS ahead of the server or older than FIX_MAX_AGE_DAYS (RETENTION_DAYS when that is shorter);
+            such fixes would fall outside the history, trip and retention windows.
+        """
+        measured = datetime.fromtimestamp(timestamp)
+        now = datetime.now()
+        max_age = min(FIX_MAX_AGE_DAYS, self.purger.retention_days) if self.purger.retention_days > 0 else FIX_MAX_AGE_DAYS
+        if measured > now + timedelta(seconds=FIX_MAX_AHEAD_SECONDS):
+            raise ValueError("timestamp %d is ahead of server time" % timestamp)
+        if measured < now - timedelta(days=max_age):
+            raise ValueError("timestamp %d is older than %d days" % (timestamp, max_age))
+        return measured
+
+    def received_coords_batch(self, fixes=None, tracker_id=None):
+        """
+            Inserts a batch of fixes in one multi-row INSERT and one transaction.
 
-            This is to implement a layer of security if spoofing of tracker device occurs.
+            Every fix carries the device-side timestamp (unix seconds) so buffered points keep the time they were measured:
+                fixes = [{'coords_lat': '55.7123', 'coords_long': '12.0564', 'timestamp': 1729238400}, ...]
+            A timestamp outside the window checked by fix_time() rejects the batch with 400.
+        """
+        if not fixes or len(fixes) > MAX_BATCH_FIXES:
+            return {"status": "error", "message": "Batch must contain between 1 and %d fixes" % MAX_BATCH_FIXES}, 400
+
+        try:
+            rows = []
+            for fix in fixes:
+                lat = float(fix['coords_lat'])
+                long = float(fix['coords_long'])
+                if not (-90 <= lat <= 90 and -180 <= long <= 180):
+                    raise ValueError("coordinates out of range")
+                rows.append((lat, long, tracker_id, self.fix_time(int(fix['timestamp']))))
+        except (KeyError, TypeError, ValueError, OverflowError, OSError) as e:
+            return {"status": "error", "message": "Malformed fix in batch: %s" % e}, 400
+
+        return self.store_fixes(rows, tracker_id)
+
+    def received_frame(self, frame):
+        """
+            Ingests a binary upload (see binary_frame.py). The header and truncated HMAC are checked before any fix is
+            decoded; the fixes then take the same path as "received coords batch".
+        """
+        try:
+            tracker_id, count = binary_frame.read_header(frame)
+        except binary_frame.FrameError as e:
+            return {"status": "error", "message": "Malformed frame: %s" % e}, 400
+
+        token_key = self.lookup_token_key(tracker_id)
+        if token_key is None or not binary_frame.verify(frame, bytes(token_key, 'utf-8')):
+            return {"status": "error", "message": "Invalid frame signature"}, 401
+
+        rows = []
+        for lat, long, timestamp in binary_frame.decode_fixes(frame, count):
+            if not (-90 <= lat <= 90 and -180 <= long <= 180):
+                return {"status": "error", "message": "Malformed fix in frame: coordinates out of range"}, 400
+            try:
+                rows.append((lat, long, tracker_id, self.fix_time(timestamp)))
+            except (ValueError, OverflowError, OSError) as e:
+                return {"status": "error", "message": "Malformed fix in frame: %s" % e}, 400
+
+        return self.store_fixes(rows, tracker_id)
+
+    def store_fixes(self, rows, tracker_id):
+        """
+            Writes validated (latitude, longitude, Tracker_id, Tidspunkt) rows in one multi-row INSERT and one transaction,
+            or hands them to the write-behind writer.
+        """
+        try:
+            # Tjek om 'Tracker_id' eksisterer (fra key_cache, ellers 'Tracker_enheder' tabellen).
+            if self.lookup_token_key(tracker_id) is None:
+                return {"status": "error", "message": "Tracker identification not found"}, 404
+
+            if self.writer is not None:
+                return self.enqueue_fixes(rows)
+
+            query = "INSERT INTO Lokation_log (latitude, longitude, Tracker_id, Tidspunkt) VALUES (%s, %s, %s, %s)"
+            self.db_connection.execute_many(query, rows)
+            derived = self.write_derived(rows)
+            self.db_connection.commit()
+            self.publish_derived(derived)
+
+            return {"status": "success", "message": "Coordinates batch insertion successful", "inserted": len(rows)}, 200
+
+        except Exception:
+            log.exception("Exception in store_fixes")
+            self.db_connection.rollback()
+            return {"status": "error", "message": "Error during coordinates batch insertion"}, 500
+
+    def enqueue_fixes(self, rows):
+        """
+            Hands validated rows to the write-behind writer. The fixes are not yet committed when this returns.
+        """
+        if self.writer.submit(rows):
+            return {"status": "success", "message": "Coordinates queued for insertion", "queued": len(rows)}, 202
+
+        return {"status": "error", "message": "Ingest queue is full, retry later"}, 503
+
+    def write_derived(self, rows):
+        """
+            Updates everything derived from newly inserted (latitude, longitude, Tracker_id, Tidspunkt) rows inside the
+            caller's transaction: Tracker_seneste, geofence events and trips. Pass the result to publish_derived() after commit.
+
+            The trackers' Tracker_enheder rows are locked first, so concurrent ingests of one tracker (other server
+            processes, a firmware retry) take turns and each reads the state the previous one committed.
+        """
+        tracker_ids = sorted({tracker_id for _, _, tracker_id, _ in rows})
+        query = self.db_connection.statement("lock_trackers").format(", ".join(["%s"] * len(tracker_ids)))
+        self.db_connection.execute_query(query, tuple(tracker_ids))
+        self.db_connection.fetchall()
+
+        latest = self.write_latest(rows)
+        transitions = self.geofences.evaluate(rows)
+        self.trips.evaluate(rows)
+        return latest, transitions
+
+    def publish_derived(self, derived):
+        latest, transitions = derived
+        self.remember_latest(latest)
+        self.geofences.publish(transitions)
+
+    def write_latest(self, rows):
+        """
+            Upserts the newest of the given (latitude, longitude, Tracker_id, Tidspunkt) rows per tracker into
+            Tracker_seneste. Runs inside the caller's transaction; an older fix never overwrites a newer one.
+
+            Returns {tracker_id: (latitude, longitude, tidspunkt)} for remember_latest() once the transaction commits.
+        """
+        latest = {}
+        for lat, long, tracker_id, timestamp in rows:
+            if tracker_id not in latest or latest[tracker_id][2] <= timestamp:
+                latest[tracker_id] = (float(lat), float(long), timestamp)
+
+        query = self.db_connection.statement("upsert_latest")
+        self.db_connection.execute_many(query, [(tracker_id, *position) for tracker_id, position in latest.items()])
+        return latest
+
+    def remember_latest(self, latest):
+        for tracker_id, (lat, long, timestamp) in latest.items():
+            self.position_cache.update(tracker_id, lat, long, timestamp)
+        self.broadcaster.publish(latest.keys())
+
+    def latest_position(self, tracker_id):
+        """
+            Returns (latitude, longitude) of the newest fix, or None if the tracker has never reported.
+
+            Lookup order: position_cache, the Tracker_seneste summary row, and as a cold-start fallback
+            (trackers that haven't reported since Tracker_seneste was introduced) the newest Lokation_log row.
+        """
+        cached = self.position_cache.get(tracker_id)
+        if cached is not None:
+            return cached[0], cached[1]
+
+        query = "SELECT Latitude, Longitude, Tidspunkt FROM Tracker_seneste WHERE Tracker_id = %s"
+        self.db_connection.execute_query(query, (tracker_id,))
+        coordinates = self.db_connection.fetchone()
+
+        if coordinates is None:
+            floor = self.history_floor(tracker_id)
+            if floor is None:
+                query = "SELECT Latitude, Longitude, Tidspunkt FROM Lokation_log WHERE Tracker_id = %s ORDER BY Tidspunkt DESC LIMIT 1;"
+                self.db_connection.execute_query(query, (tracker_id,))
+            else:
+                query = "SELECT Latitude, Longitude, Tidspunkt FROM Lokation_log WHERE Tracker_id = %s AND Tidspunkt >= %s ORDER BY Tidspunkt DESC LIMIT 1;"
+                self.db_connection.execute_query(query, (tracker_id, floor))
+            coordinates = self.db_connection.fetchone()
+
+            if coordinates is None:
+                return None
+
+        latitude = float(coordinates['Latitude'])
+        longitude = float(coordinates['Longitude'])
+        self.position_cache.update(tracker_id, latitude, longitude, coordinates['Tidspunkt'])
+
+        return latitude, longitude
+
+    def latest_positions(self, tracker_ids):
+        """
+            latest_position() for many trackers at once: {tracker_id: (latitude, longitude, Tidspunkt)} from position_cache
+            and a single IN query on Tracker_seneste for the rest. Trackers without a Tracker_seneste row are left out;
+            the Lokation_log fallback would cost a query per tracker.
+        """
+        positions = {}
+        missing = []
+        for tracker_id in tracker_ids:
+            cached = self.position_cache.get(tracker_id)
+            if cached is not None:
+                positions[tracker_id] = cached
+            else:
+                missing.append(tracker_id)
+
+        if missing:
+            query = ("SELECT Tracker_id, Latitude, Longitude, Tidspunkt FROM Tracker_seneste WHERE Tracker_id IN (%s)"
+                     % ", ".join(["%s"] * len(missing)))
+            self.db_connection.execute_query(query, tuple(missing))
+            wanted = set(missing)
+            for row in self.db_connection.fetchall():
+                if row['Tracker_id'] not in wanted:
+                    continue
+                position = (float(row['Latitude']), float(row['Longitude']), row['Tidspunkt'])
+                self.position_cache.update(row['Tracker_id'], *position)
+                positions[row['Tracker_id']] = position
+
+        return positions
+
+    def history_floor(self, tracker_id):
+        """
+            Time of the tracker's latest password reset, or None. Rows before it belong to the previous owner and are
+            hidden from reads while PurgeWorker deletes them.
+        """
+        query = "SELECT MAX(Foer) AS foer FROM Sletning_job WHERE Tracker_id = %s"
+        self.db_connection.execute_query(query, (tracker_id,))
+        floor = self.db_connection.fetchone_column('foer')
+        if isinstance(floor, str):
+            floor = datetime.fromisoformat(floor)
+        return floor
+
+    def check_password(self, tracker_id, tracker_password):
+        """
+            Runs bcrypt password check for the tracker.
 
             A successful "result = self.db_connection.fetchone()" value:
                 result = {'Password': '$2b$12$s.NgSTS72KVed0mEXZ5r9ObbCtph3PtpfeefsjibgO10tFnwCpvSW'}
 
             If fetchone is not successful (wrong tracker-id in this case), result is of NoneType.
+            Trackers without a password (NULL) never pass the check.
         """
+        query = "SELECT Password FROM Tracker_enheder WHERE Tracker_id = %s"
+        self.db_connection.execute_query(query, (tracker_id,))
+        result:str = self.db_connection.fetchone()
+
+        if result is None or not result['Password']:
+            return False
 
+        return self.bcrypt_pool.checkpw(tracker_password, result['Password'])
+
+    def login(self, tracker_id=None, tracker_password=None):
+        """
+            Verifies the password once and hands out a session token that later "get coords" calls can use
+            instead of the password, so polling clients don't pay for a bcrypt check on every request.
+        """
         try:
-            query = "SELECT Password FROM Tracker_enheder WHERE Tracker_id = %s"
-            self.db_connection.execute_query(query, (tracker_id,))
-            result:str = self.db_connection.fetchone()
+            if not self.check_password(tracker_id, tracker_password):
+                return {"status": "error", "message": "Wrong tracker identification or password"}, 401
 
-            if bcrypt.checkpw(tracker_password.encode('utf-8'), result['Password'].encode('utf-8')):
+            session_token, expires_in = self.sessions.issue(tracker_id)
 
-                query = "SELECT Latitude, Longitude FROM Lokation_log WHERE Tracker_id = %s ORDER BY Tidspunkt DESC LIMIT 1;"
-                self.db_connection.execute_query(query, (tracker_id,))
-                coordinates = self.db_connection.fetchone()
+            return {"status": "success",
+                    "message": "Login successful",
+                    "session_token": session_token,
+                    "expires_in": expires_in}, 200
+
+        except AuthBusy as e:
+            log.warning("Authentication rejected: %s", e)
+            return {"status": "error", "message": "Authentication service busy, retry later"}, 503
+
+        except Exception:
+            log.exception("Exception in login")
+            return {"status": "error", "message": "Error during login"}, 500
+
+    def fleet_ids(self, tracker_ids):
+        """
+            Validates a fleet request's list of tracker ids; returns them without duplicates, or None.
+        """
+        if not isinstance(tracker_ids, list) or not tracker_ids or len(tracker_ids) > FLEET_MAX_TRACKERS:
+            return None
+        if not all(isinstance(tracker_id, str) and tracker_id for tracker_id in tracker_ids):
+            return None
+        return list(dict.fromkeys(tracker_ids))
+
+    def fleet_login(self, tracker_ids=None, tracker_password=None, passwords=None):
+        """
+            Login for fleet dashboards: checks every tracker's password once, either one shared password or
+            passwords = {tracker_id: password}, and issues one session token for all trackers that passed. The bcrypt
+            checks run side by side on the pool, and the token then serves "get fleet coords" without any bcrypt.
 
-                latitude = float(coordinates['Latitude'])
-                longitude = float(coordinates['Longitude'])
+            Trackers that failed are listed in "rejected"; the login only fails if none passed.
+        """
+        tracker_ids = self.fleet_ids(tracker_ids)
+        if tracker_ids is None:
+            return {"status": "error", "message": "tracker_ids must be a list of 1 to %d tracker ids" % FLEET_MAX_TRACKERS}, 400
+        if passwords is not None and not isinstance(passwords, dict):
+            return {"status": "error", "message": "passwords must map tracker ids to passwords"}, 400
+
+        try:
+            query = "SELECT Tracker_id, Password FROM Tracker_enheder WHERE Tracker_id IN (%s)" % ", ".join(["%s"] * len(tracker_ids))
+            self.db_connection.execute_query(query, tuple(tracker_ids))
+            hashes = {row['Tracker_id']: row['Password'] for row in self.db_connection.fetchall() if row['Password']}
+
+            candidates = []
+            for tracker_id in tracker_ids:
+                password = (passwords or {}).get(tracker_id, tracker_password)
+                if tracker_id in hashes and isinstance(password, str) and password:
+                    candidates.append((tracker_id, password))
+
+            results = self.bcrypt_pool.checkpw_many([(password, hashes[tracker_id]) for tracker_id, password in candidates])
+            accepted = [tracker_id for (tracker_id, _), ok in zip(candidates, results) if ok]
+            accepted_ids = set(accepted)
+            if not accepted:
+                return {"status": "error", "message": "Wrong tracker identification or password"}, 401
+
+            session_token, expires_in = self.sessions.issue_fleet(accepted)
+
+            return {"status": "success",
+                    "message": "Login successful",
+                    "session_token": session_token,
+                    "expires_in": expires_in,
+                    "tracker_ids": accepted,
+                    "rejected": [tracker_id for tracker_id in tracker_ids if tracker_id not in accepted_ids]}, 200
+
+        except AuthBusy as e:
+            log.warning("Authentication rejected: %s", e)
+            return {"status": "error", "message": "Authentication service busy, retry later"}, 503
+
+        except Exception:
+            log.exception("Exception in fleet_login")
+            return {"status": "error", "message": "Error during login"}, 500
+
+    def authorize(self, tracker_id, tracker_password=None, session_token=None):
+        """
+            App-client check shared by the read subjects: a session token from login() if given, otherwise the bcrypt password.
+        """
+        if session_token is not None:
+            return self.sessions.verify(session_token, tracker_id)
+        return self.check_password(tracker_id, tracker_password)
 
-                return {"status": "success", 
-                        "message": "Received coordinates successfully", 
-                        "longitude": longitude, "latitude": latitude}, 200
+    def get_coords(self, tracker_id=None, tracker_password=None, session_token=None):
+        """
+            Verifies the client before sending coordinates to client device, either with a session token from
+            login() or with a bcrypt password check.
+
+            This is to implement a layer of security if spoofing of tracker device occurs.
+        """
+
+        try:
+            if not self.authorize(tracker_id, tracker_password, session_token):
+                return {"status": "error", "message": "Wrong tracker identification, password or session token"}, 401
 
-        except Exception as e:
-            print(f"Exception in get_coords:", e)
+            position = self.latest_position(tracker_id)
+            if position is None:
+                return {"status": "error", "message": "No coordinates logged for tracker"}, 404
+
+            latitude, longitude = position
+
+            return {"status": "success", 
+                    "message": "Received coordinates successfully", 
+                    "longitude": longitude, "latitude": latitude}, 200
+
+        except AuthBusy as e:
+            log.warning("Authentication rejected: %s", e)
+            return {"status": "error", "message": "Authentication service busy, retry later"}, 503
+
+        except Exception:
+            log.exception("Exception in get_coords")
             return {"status": "error", "message": "Error retrieving coordinate data"}, 500
 
+    def get_fleet_coords(self, tracker_ids=None, session_token=None):
+        """
+            Latest position of every tracker in tracker_ids, authorized by one session token (from a fleet login, or a
+            single tracker's token for its own id). Positions come from the position cache and one batched query:
+                {"positions": {"Tracker#100000123": {"latitude": ..., "longitude": ..., "timestamp": ...}},
+                 "errors": {"Tracker#100000456": "not authorized"}}
+        """
+        tracker_ids = self.fleet_ids(tracker_ids)
+        if tracker_ids is None:
+            return {"status": "error", "message": "tracker_ids must be a list of 1 to %d tracker ids" % FLEET_MAX_TRACKERS}, 400
+
+        allowed = self.sessions.trackers(session_token)
+        if not allowed:
+            return {"status": "error", "message": "Wrong or expired session token"}, 401
+
+        try:
+            positions = self.latest_positions([tracker_id for tracker_id in tracker_ids if tracker_id in allowed])
+        except Exception:
+            log.exception("Exception in get_fleet_coords")
+            return {"status": "error", "message": "Error retrieving coordinate data"}, 500
+
+        result, errors = {}, {}
+        for tracker_id in tracker_ids:
+            if tracker_id not in allowed:
+                errors[tracker_id] = "not authorized"
+            elif tracker_id not in positions:
+                errors[tracker_id] = "no coordinates logged"
+            else:
+                latitude, longitude, timestamp = positions[tracker_id]
+                result[tracker_id] = {"latitude": latitude, "longitude": longitude, "timestamp": timestamp.timestamp()}
+
+        return {"status": "success",
+                "message": "Received fleet coordinates successfully",
+                "positions": result,
+                "errors": errors}, 200
+
+    def get_history(self, tracker_id=None, tracker_password=None, session_token=None,
+                    start=None, end=None, max_points=None, cursor=None, simplify="douglas-peucker"):
+        """
+            Returns the track of a tracker between start and end (unix seconds), simplified to at most max_points points.
+
+            Rows are read with keyset pagination on (Tidspunkt, id), HISTORY_PAGE_SIZE rows per call. If the window holds
+            more rows, "next_cursor" is returned and passed back as cursor to continue after the last row read:
+                next_cursor = '2024-10-18T14:03:15|81234'
+
+            simplify is "douglas-peucker" (keeps the shape), "time" (even time buckets) or "none".
+        """
+        try:
+            end = datetime.fromtimestamp(float(end)) if end is not None else datetime.now()
+            start = datetime.fromtimestamp(float(start)) if start is not None else end - timedelta(days=1)
+            max_points = min(int(max_points or HISTORY_DEFAULT_POINTS), HISTORY_MAX_POINTS)
+
+            if cursor:
+                if not isinstance(cursor, str):
+                    raise TypeError("cursor must be a string")
+                after_time, after_id = cursor.split('|')
+                after_time, after_id = datetime.fromisoformat(after_time), int(after_id)
+            else:
+                after_time, after_id = start, 0
+        except (TypeError, ValueError, OverflowError, OSError) as e:
+            return {"status": "error", "message": "Malformed history request: %s" % e}, 400
+
+        if max_points < 2 or simplify not in ("douglas-peucker", "time", "none"):
+            return {"status": "error", "message": "max_points must be at least 2 and simplify one of douglas-peucker, time, none"}, 400
+
+        try:
+            if not self.authorize(tracker_id, tracker_password, session_token):
+                return {"status": "error", "message": "Wrong tracker identification, password or session token"}, 401
+
+            floor = self.history_floor(tracker_id)
+            if floor is not None and after_time < floor:
+                after_time, after_id = floor, 0
+
+            # Ældre data findes kun som time/dags-opsummeringer; de læses med på første side
+            summary_points, rollup_count = [], 0
+            if not cursor:
+                summary_points, rollup_count = rollups.summary_points(self.db_connection, tracker_id, after_time, end)
+
+            query = ("SELECT id, Latitude, Longitude, Tidspunkt FROM Lokation_log "
+                     "WHERE Tracker_id = %s AND Tidspunkt < %s AND (Tidspunkt > %s OR (Tidspunkt = %s AND id > %s)) "
+                     "ORDER BY Tidspunkt, id LIMIT %s")
+            self.db_connection.execute_query(query, (tracker_id, end, after_time, after_time, after_id, HISTORY_PAGE_SIZE + 1))
+            rows = self.db_connection.fetchall()
+
+            next_cursor = None
+            if len(rows) > HISTORY_PAGE_SIZE:
+                rows = rows[:HISTORY_PAGE_SIZE]
+                next_cursor = "%s|%d" % (rows[-1]['Tidspunkt'].isoformat(), rows[-1]['id'])
+
+            points = [(float(row['Latitude']), float(row['Longitude']), row['Tidspunkt']) for row in rows]
+            if summary_points:
+                points = sorted(summary_points + points, key=lambda point: point[2])
+
+            if simplify == "time":
+                points = geo.bucket_by_time(points, max_points)
+            elif simplify == "douglas-peucker":
+                # Tidsbuckets først holder Douglas-Peucker billig på lange spor
+                points = geo.douglas_peucker(geo.bucket_by_time(points, 4 * max_points), max_points)
+
+            return {"status": "success",
+                    "message": "Received history successfully",
+                    "points": [[lat, long, timestamp.timestamp()] for lat, long, timestamp in points],
+                    "raw_count": len(rows),
+                    "rollup_count": rollup_count,
+                    "next_cursor": next_cursor}, 200
+
+        except AuthBusy as e:
+            log.warning("Authentication rejected: %s", e)
+            return {"status": "error", "message": "Authentication service busy, retry later"}, 503
+
+        except Exception:
+            log.exception("Exception in get_history")
+            return {"status": "error", "message": "Error retrieving history data"}, 500
+
+    def export_history(self, tracker_id=None, tracker_password=None, session_token=None, start=None, end=None, export_format="gpx"):
+        """
+            Exports the tracker's raw fixes between start and end (unix seconds; default all of them) as GPX, CSV or GeoJSON.
+
+            On success the result holds "body", a generator of text for a streamed response, with its "mimetype" and
+            "filename". Rows come from stream_query() in chunks, so memory use doesn't depend on the export's size.
+            Fixes already folded into rollups are not exported.
+        """
+        if not isinstance(export_format, str) or export_format not in export.FORMATS:
+            return {"status": "error", "message": "format must be one of %s" % ", ".join(export.FORMATS)}, 400
+
+        try:
+            end = datetime.fromtimestamp(float(end)) if end is not None else datetime.now()
+            start = datetime.fromtimestamp(float(start)) if start is not None else datetime.fromtimestamp(0)
+        except (TypeError, ValueError, OverflowError, OSError) as e:
+            return {"status": "error", "message": "Malformed export request: %s" % e}, 400
+
+        try:
+            if not self.authorize(tracker_id, tracker_password, session_token):
+                return {"status": "error", "message": "Wrong tracker identification, password or session token"}, 401
+
+            floor = self.history_floor(tracker_id)
+            if floor is not None and start < floor:
+                start = floor
+
+            query = ("SELECT Latitude, Longitude, Tidspunkt FROM Lokation_log "
+                     "WHERE Tracker_id = %s AND Tidspunkt >= %s AND Tidspunkt < %s ORDER BY Tidspunkt, id")
+            chunks = self.db_connection.stream_query(query, (tracker_id, start, end))
+
+        except AuthBusy as e:
+            log.warning("Authentication rejected: %s", e)
+            return {"status": "error", "message": "Authentication service busy, retry later"}, 503
+
+        except StreamsBusy as e:
+            log.warning("Export rejected: %s", e)
+            return {"status": "error", "message": "Too many exports running, retry later"}, 503
+
+        except Exception:
+            log.exception("Exception in export_history")
+            return {"status": "error", "message": "Error exporting history"}, 500
+
+        writer, mimetype, _ = export.FORMATS[export_format]
+
+        def counted():
+            for rows in chunks:
+                EXPORTED_ROWS.inc(export_format, amount=len(rows))
+                yield rows
+
+        def body():
+            try:
+                yield from writer(tracker_id, counted())
+            finally:
+                # Afbrudt download: forbindelsen lukkes med det samme
+                chunks.close()
+
+        return {"status": "success", "body": body(), "mimetype": mimetype,
+                "filename": export.filename(tracker_id, export_format)}, 200
+
+    def stream_positions(self, tracker_id, session_token, last_id=None):
+        """
+            Generator of Server-Sent Events with every new fix of the tracker, for the /stream route.
+
+            Starts after last_id (the Last-Event-ID of a previous stream) or, for a fresh subscription, with the newest
+            fix. Rows from before history_floor() are never sent. Event ids are Lokation_log ids, so a client that
+            reconnects resumes without gaps or duplicates. A comment line is sent every STREAM_HEARTBEAT seconds, and
+            the stream ends when the session token expires or is revoked. A database connection is only checked out
+            while new rows are read.
+        """
+        def fetch(query, params):
+            with self.db_connection.connection():
+                self.db_connection.execute_query(query, params)
+                return self.db_connection.fetchall()
+
+        def event(row):
+            data = json.dumps({"latitude": float(row['Latitude']),
+                               "longitude": float(row['Longitude']),
+                               "timestamp": row['Tidspunkt'].timestamp()})
+            return "id: %d\nevent: position\ndata: %s\n\n" % (row['id'], data)
+
+        seen_version = self.broadcaster.version(tracker_id)
+
+        # Rækker fra før seneste password reset tilhører den tidligere ejer
+        with self.db_connection.connection():
+            floor = self.history_floor(tracker_id) or datetime.fromtimestamp(0)
+
+        if last_id is None:
+            query = ("SELECT id, Latitude, Longitude, Tidspunkt FROM Lokation_log WHERE Tracker_id = %s AND Tidspunkt >= %s "
+                     "ORDER BY Tidspunkt DESC, id DESC LIMIT 1")
+            rows = fetch(query, (tracker_id, floor))
+            last_id = rows[0]['id'] if rows else 0
+            for row in rows:
+                yield event(row)
+
+        yield "retry: 2000\n\n"
+
+        query = ("SELECT id, Latitude, Longitude, Tidspunkt FROM Lokation_log WHERE Tracker_id = %s AND id > %s AND Tidspunkt >= %s "
+                 "ORDER BY id LIMIT 500")
+        while self.sessions.verify(session_token, tracker_id):
+            rows = fetch(query, (tracker_id, last_id, floor))
+            for row in rows:
+                last_id = row['id']
+                yield event(row)
+
+            if len(rows) == 500:
+                continue
+
+            version = self.broadcaster.wait(tracker_id, seen_version, STREAM_HEARTBEAT)
+            if version == seen_version:
+                yield ": heartbeat\n\n"
+            seen_version = version
+
     def generate_tracker_id(self):
         """
-            Generates tracker id when requested. Loops until fetchone request of the generated ID results in 'None'.
+            Generates a tracker id and token key for a freshly flashed device. The id comes from TrackerIdAllocator,
+            so it is unique without looking it up first.
+        """
+        try:
+            tracker_id = self.id_allocator.allocate(1)[0]
+            token_key = secrets.token_hex(32)
 
-            If generated ID exists, result of fetch will return the row containing the already existing ID and password - this data is not used:
+            query = "INSERT INTO Tracker_enheder (Tracker_id, Token_key) VALUES (%s, %s)"
+            self.db_connection.execute_query(query, (tracker_id, token_key))
+            self.db_connection.commit()
+            self.key_cache.invalidate(tracker_id)
 
-            "result = self.db_connection.fetchone()" result if ID exists already:
-                
-                result = {'Tracker_id': 'Tracker#26349', 'Password': None}
+            log.info("Tracker identification number and token key generated for %s", tracker_id)
 
-            "result = self.db_connection.fetchone()" result if ID doesn't exists already:
+            return {"status": "success", 
+                    "message": "Successfully generated tracker identification", 
+                    "tracker_id": tracker_id,
+                    "token_key": token_key}, 200
 
-                result = None
+        except Exception:
+            log.exception("Exception in generate_tracker_id")
+            self.db_connection.rollback()
+            return {"status": "error", "message": "Error generating tracker identification"}, 500
 
+    def fleet_authorized(self, provisioning_token):
+        """
+            Fleet-operator check for provisioning and fleet-wide settings: the PROVISIONING_TOKEN configured on the server.
         """
+        return bool(PROVISIONING_TOKEN) and isinstance(provisioning_token, str) and \
+            hmac.compare_digest(provisioning_token.encode('utf-8'), PROVISIONING_TOKEN.encode('utf-8'))
 
-        while True:
-            rtal = secrets.choice(range(10000, 99999))
-            tracker_id = ('Tracker#' + str(rtal))
+    def provision_trackers(self, count, provisioning_token):
+        """
+            Factory provisioning: creates count trackers with fresh token keys in one transaction and returns them all:
+                "trackers": [{"tracker_id": "Tracker#173040512", "token_key": "a3f1..."}, ...]
 
-            query = "SELECT * FROM Tracker_enheder WHERE Tracker_id = %s"
-            self.db_connection.execute_query(query, (tracker_id,))
-            result = self.db_connection.fetchone()
+            Requires the PROVISIONING_TOKEN configured on the server; without it the subject is disabled.
+        """
+        if not self.fleet_authorized(provisioning_token):
+            return {"status": "error", "message": "Provisioning not authorized"}, 403
 
-            if result is None:
-                try:
-                    token_key = secrets.token_hex(32)
+        if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= PROVISIONING_MAX:
+            return {"status": "error", "message": "Count must be between 1 and %d" % PROVISIONING_MAX}, 400
 
-                    query = "INSERT INTO Tracker_enheder (Tracker_id, Token_key) VALUES (%s, %s)"
-                    self.db_connection.execute_query(query, (tracker_id, token_key))
-                    self.db_connection.commit()
+        try:
+            trackers = [(tracker_id, secrets.token_hex(32)) for tracker_id in self.id_allocator.allocate(count)]
+
+            query = "INSERT INTO Tracker_enheder (Tracker_id, Token_key) VALUES (%s, %s)"
+            self.db_connection.execute_many(query, trackers)
+            self.db_connection.commit()
+            for tracker_id, _ in trackers:
+                self.key_cache.invalidate(tracker_id)
+
+            log.info("Provisioned %d trackers: %s - %s", count, trackers[0][0], trackers[-1][0])
+
+            return {"status": "success",
+                    "message": "Successfully provisioned %d trackers" % count,
+                    "trackers": [{"tracker_id": tracker_id, "token_key": token_key} for tracker_id, token_key in trackers]}, 200
+
+        except Exception:
+            log.exception("Exception in provision_trackers")
+            self.db_connection.rollback()
+            return {"status": "error", "message": "Error provisioning trackers"}, 500
+
+    def get_trips(self, tracker_id=None, tracker_password=None, session_token=None, start=None, end=None, limit=None):
+        """
+            Lists the tracker's trips that started between start and end (unix seconds), newest first, straight from Trips:
+                {"start": ..., "end": ..., "start_position": [lat, long], "end_position": [lat, long], "distance_m": ..., "points": ..., "open": false}
+
+            A trip stays open until the next fix decides whether it continues; one quiet for longer than TRIP_GAP_SECONDS
+            is reported as closed.
+        """
+        try:
+            end = datetime.fromtimestamp(float(end)) if end is not None else datetime.now()
+            start = datetime.fromtimestamp(float(start)) if start is not None else end - timedelta(days=7)
+            limit = min(int(limit or TRIPS_PAGE_SIZE), TRIPS_PAGE_SIZE)
+        except (TypeError, ValueError, OverflowError, OSError) as e:
+            return {"status": "error", "message": "Malformed trips request: %s" % e}, 400
+
+        try:
+            if not self.authorize(tracker_id, tracker_password, session_token):
+                return {"status": "error", "message": "Wrong tracker identification, password or session token"}, 401
+
+            floor = self.history_floor(tracker_id)
+            if floor is not None and start < floor:
+                start = floor
+
+            query = ("SELECT Start_tid, Start_lat, Start_long, Slut_tid, Slut_lat, Slut_long, Distance_m, Antal, Aaben FROM Trips "
+                     "WHERE Tracker_id = %s AND Start_tid >= %s AND Start_tid < %s ORDER BY Start_tid DESC LIMIT %s")
+            self.db_connection.execute_query(query, (tracker_id, start, end, limit))
+
+            now = datetime.now()
+            result = [{"start": row['Start_tid'].timestamp(), "end": row['Slut_tid'].timestamp(),
+                       "start_position": [float(row['Start_lat']), float(row['Start_long'])],
+                       "end_position": [float(row['Slut_lat']), float(row['Slut_long'])],
+                       "distance_m": round(float(row['Distance_m']), 1), "points": int(row['Antal']),
+                       "open": bool(row['Aaben']) and (now - row['Slut_tid']).total_seconds() <= self.trips.gap}
+                      for row in self.db_connection.fetchall()]
 
-                    print('[+] Tracker identification number and token key successfully generated: %s, %s' % (tracker_id, token_key))
+            return {"status": "success", "message": "Received trips successfully", "trips": result}, 200
 
-                    time.sleep(2)
+        except AuthBusy as e:
+            log.warning("Authentication rejected: %s", e)
+            return {"status": "error", "message": "Authentication service busy, retry later"}, 503
 
-                    return {"status": "success", 
-                            "message": "Successfully generated tracker identification", 
-                            "tracker_id": tracker_id,
-                            "token_key": token_key}, 200
+        except Exception:
+            log.exception("Exception in get_trips")
+            return {"status": "error", "message": "Error retrieving trips"}, 500
 
-                except Exception as e:
-                    print(f"Exception in generate_tracker_id:", e)
-                    self.db_connection.rollback()
-                    return {"status": "error", "message": "Error generating tracker identification"}, 500
+    def create_geofence(self, tracker_id=None, tracker_password=None, session_token=None, provisioning_token=None,
+                        name=None, shape=None, geometry=None):
+        """
+            Creates a circle or polygon fence. With tracker credentials it applies to that tracker only; with the
+            provisioning token and no tracker_id it applies to the whole fleet:
+                shape = "circle",  geometry = {"center": [55.67, 12.56], "radius_m": 250}
+                shape = "polygon", geometry = {"vertices": [[55.67, 12.56], [55.68, 12.56], [55.68, 12.58]]}
+        """
+        if not name or not isinstance(geometry, dict):
+            return {"status": "error", "message": "No name or geometry specified in received data"}, 400
+
+        try:
+            if tracker_id is None:
+                if not self.fleet_authorized(provisioning_token):
+                    return {"status": "error", "message": "Fleet geofences require the provisioning token"}, 403
+            elif not self.authorize(tracker_id, tracker_password, session_token):
+                return {"status": "error", "message": "Wrong tracker identification, password or session token"}, 401
+
+            try:
+                fence = self.geofences.create(tracker_id, str(name)[:100], shape, geometry)
+            except (ValueError, KeyError, TypeError) as e:
+                return {"status": "error", "message": "Malformed geofence: %s" % e}, 400
+
+            self.db_connection.commit()
+            self.geofences.added(fence)
+
+            return {"status": "success", "message": "Geofence created", "geofence": fence.as_dict()}, 200
+
+        except AuthBusy as e:
+            log.warning("Authentication rejected: %s", e)
+            return {"status": "error", "message": "Authentication service busy, retry later"}, 503
+
+        except Exception:
+            log.exception("Exception in create_geofence")
+            self.db_connection.rollback()
+            return {"status": "error", "message": "Error creating geofence"}, 500
+
+    def delete_geofence(self, fence_id, tracker_id=None, tracker_password=None, session_token=None, provisioning_token=None):
+        try:
+            fence = self.geofences.fence(fence_id)
+            if fence is None:
+                return {"status": "error", "message": "Geofence not found"}, 404
+
+            if fence.tracker_id is None or tracker_id is None:
+                authorized = self.fleet_authorized(provisioning_token)
             else:
-                print('[!] Device ID: %s already exist in the database, retrying...' % tracker_id)
+                authorized = fence.tracker_id == tracker_id and self.authorize(tracker_id, tracker_password, session_token)
+            if not authorized:
+                return {"status": "error", "message": "Not authorized to delete this geofence"}, 403
+
+            self.geofences.delete(fence_id)
+            self.db_connection.commit()
+            self.geofences.removed(fence_id)
+
+            return {"status": "success", "message": "Geofence deleted"}, 200
+
+        except AuthBusy as e:
+            log.warning("Authentication rejected: %s", e)
+            return {"status": "error", "message": "Authentication service busy, retry later"}, 503
+
+        except Exception:
+            log.exception("Exception in delete_geofence")
+            self.db_connection.rollback()
+            return {"status": "error", "message": "Error deleting geofence"}, 500
+
+    def get_geofence_events(self, tracker_id=None, tracker_password=None, session_token=None, since=None, limit=None):
+        """
+            Returns the tracker's enter/exit events since the given unix time, oldest first, with the fences currently containing it.
+        """
+        try:
+            since = datetime.fromtimestamp(float(since)) if since is not None else datetime.now() - timedelta(days=1)
+            limit = min(int(limit or GEOFENCE_EVENT_LIMIT), GEOFENCE_EVENT_LIMIT)
+        except (TypeError, ValueError, OverflowError, OSError) as e:
+            return {"status": "error", "message": "Malformed events request: %s" % e}, 400
+
+        try:
+            if not self.authorize(tracker_id, tracker_password, session_token):
+                return {"status": "error", "message": "Wrong tracker identification, password or session token"}, 401
+
+            floor = self.history_floor(tracker_id)
+            if floor is not None and since < floor:
+                since = floor
+
+            query = ("SELECT e.Geofence_id, g.Navn, e.Haendelse, e.Latitude, e.Longitude, e.Tidspunkt "
+                     "FROM Geofence_haendelse e LEFT JOIN Geofence g ON g.Id = e.Geofence_id "
+                     "WHERE e.Tracker_id = %s AND e.Tidspunkt >= %s ORDER BY e.Tidspunkt, e.Id LIMIT %s")
+            self.db_connection.execute_query(query, (tracker_id, since, limit))
+            events = [{"fence_id": row['Geofence_id'], "name": row['Navn'], "event": row['Haendelse'],
+                       "latitude": float(row['Latitude']), "longitude": float(row['Longitude']),
+                       "timestamp": row['Tidspunkt'].timestamp()} for row in self.db_connection.fetchall()]
+
+            inside = self.geofences.inside(tracker_id)
+
+            return {"status": "success", "message": "Received geofence events successfully",
+                    "events": events, "inside": sorted(inside)}, 200
+
+        except AuthBusy as e:
+            log.warning("Authentication rejected: %s", e)
+            return {"status": "error", "message": "Authentication service busy, retry later"}, 503
+
+        except Exception:
+            log.exception("Exception in get_geofence_events")
+            return {"status": "error", "message": "Error retrieving geofence events"}, 500
 
     def password_reset(self, tracker_id):
+        """
+            Clears the password and hands the tracker's history to PurgeWorker, which deletes it in chunks after the
+            request has returned. Until then history_floor() hides the rows from reads.
+        """
         try:
-            delete_log_query = "DELETE FROM Lokation_log WHERE Tracker_id = %s"
-            self.db_connection.execute_query(delete_log_query, (tracker_id,))
+            query = "DELETE FROM Tracker_seneste WHERE Tracker_id = %s"
+            self.db_connection.execute_query(query, (tracker_id,))
 
             query = "UPDATE Tracker_enheder SET Password = NULL WHERE Tracker_id = %s"
             self.db_connection.execute_query(query, (tracker_id,))
+
+            self.purger.schedule(tracker_id, datetime.now())
+            fence_ids = self.geofences.reset_tracker(tracker_id)
+            self.trips.reset_tracker(tracker_id)
             
             self.db_connection.commit()
+            self.purger.wake()
+            self.geofences.forget(tracker_id, fence_ids)
+            self.key_cache.invalidate(tracker_id)
+            self.position_cache.invalidate(tracker_id)
+            self.sessions.revoke(tracker_id)
 
             return {"status": "success", "message": "Password reset procedure exited successfully"}, 200
 
-        except Exception as e:
-            print(f"Exception in password_reset:", e)
+        except Exception:
+            log.exception("Exception in password_reset")
             self.db_connection.rollback()
             return {"status": "error", "message": "Error executing password reset procedure."}, 500
 
     def password_update(self, tracker_id, tracker_password):
         """
-            Successful tracker-id verification, results in a "result" variable value of:
-                result = {'Tracker_id': 'Tracker#53355'} 
+            Tracker-id verification goes through lookup_token_key(), which returns the tracker's Token_key:
+                'a3f1...'
 
-            If verification fails, "result" value is of NoneType.
+            If verification fails (unknown tracker), the lookup returns None.
 
             Password update only suceeds on Tracker'ids with currently non-set password values (NULL).
         """
 
-        # Tjek 'Tracker_enheder' tabellen om 'Tracker_id' eksisterer.
-        query = "SELECT Tracker_id FROM Tracker_enheder WHERE Tracker_id = %s"
-        self.db_connection.execute_query(query, (tracker_id,))
-        result:str = self.db_connection.fetchone()
-
-        if result is None:
+        # Tjek om 'Tracker_id' eksisterer (fra key_cache, ellers 'Tracker_enheder' tabellen).
+        if self.lookup_token_key(tracker_id) is None:
             return {"status": "error", "message": "Tracker identification not found"}, 404
 
         try:
-            hashed_password = bcrypt.hashpw(tracker_password.encode('utf-8'), bcrypt.gensalt())
+            hashed_password = self.bcrypt_pool.hashpw(tracker_password)
 
             query = "UPDATE Tracker_enheder SET Password = %s WHERE Tracker_id = %s AND Password IS NULL"
             self.db_connection.execute_query(query, (hashed_password.decode('utf-8'), tracker_id,))
@@ -243,33 +1763,218 @@ class DataHandler:
             self.db_connection.commit()
 
             if rows_updated > 0:
+                self.sessions.revoke(tracker_id)
                 return {"status": "success", "message": "Password updated successfully"}, 200
             else:
                 return {"status": "error", "message": "Password update failed. Password may already be set or Tracker_id is invalid."}, 400
 
-        except Exception as e:
-            print(f"Exception in password_reset:", e)
+        except AuthBusy as e:
+            log.warning("Authentication rejected: %s", e)
+            return {"status": "error", "message": "Authentication service busy, retry later"}, 503
+
+        except Exception:
+            log.exception("Exception in password_reset")
             self.db_connection.rollback()
             return {"status": "error", "message": "Error executing password update procedure."}, 500
 
 
 data_handler = DataHandler()
-@app.route('/', methods=['POST'])
-def handle():
-    data = request.json
+rate_limiter = RateLimiter(RATE_LIMITS)
+
+@app.before_request
+def sample_logs():
+    logs.sample_request()
+
+@app.teardown_request
+def release_db_connection(exception=None):
+    data_handler.db_connection.release()
+
+def operator_authorized():
+    """
+        Internal routes (/ingest/stats, /purge/stats, /metrics) are proxied like the rest of /api, so they need the
+        PROVISIONING_TOKEN as a bearer token (Prometheus: authorization.credentials):
+            Authorization: Bearer <token>
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and data_handler.fleet_authorized(token.strip())
+
+def operator_forbidden():
+    return jsonify({"status": "error", "message": "Not authorized"}), 403
+
+@app.route('/ingest/stats', methods=['GET'])
+def ingest_stats():
+    if not operator_authorized():
+        return operator_forbidden()
+
+    if data_handler.writer is None:
+        return jsonify({"status": "error", "message": "Write-behind ingest is not enabled"}), 404
+
+    return jsonify(data_handler.writer.stats()), 200
+
+@app.route('/purge/stats', methods=['GET'])
+def purge_stats():
+    if not operator_authorized():
+        return operator_forbidden()
+
+    return jsonify(dict(data_handler.purger.stats(), pending=data_handler.purger.pending_jobs())), 200
+
+@app.route('/stream', methods=['GET'])
+def stream():
+    """
+        Live positions as Server-Sent Events: GET /stream?tracker_id=...&session_token=...
+
+        The session token comes from "login request". Reconnecting clients send Last-Event-ID (EventSource does so
+        automatically) or last_id to resume after the last fix they received.
+    """
+    tracker_id = request.args.get('tracker_id')
+    session_token = request.args.get('session_token')
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+
+    if not tracker_id or not data_handler.sessions.verify(session_token, tracker_id):
+        return jsonify({"status": "error", "message": "Wrong tracker identification or session token"}), 401
+
+    try:
+        last_id = int(last_id) if last_id is not None else None
+    except ValueError:
+        return jsonify({"status": "error", "message": "Malformed Last-Event-ID"}), 400
+
+    return Response(stream_with_context(data_handler.stream_positions(tracker_id, session_token, last_id)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+metrics.Gauge("biltracker_ingest_queue_depth", "Fixes waiting in the write-behind queue.",
+              function=lambda: data_handler.writer.stats()["queue_depth"] if data_handler.writer else None)
+
+@app.route('/frame', methods=['POST'])
+def frame_endpoint():
+    """
+        Binary ingest for trackers (application/octet-stream); the frame carries its own tracker id and signature.
+    """
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        frame = request.get_data()
+        try:
+            tracker_id, _ = binary_frame.read_header(frame)
+        except binary_frame.FrameError:
+            tracker_id = None
+
+        throttled = admit("binary frame", tracker_id)
+        if throttled is not None:
+            response, status_code = throttled
+            return response, status_code
+
+        result, status_code = data_handler.received_frame(frame)
+        return jsonify(result), status_code
+    finally:
+        record_request("binary frame", status_code, started)
+
+def admit(subject, tracker_id):
+    """
+        Rate limiting for a request; returns None to let it through or a 429 response with Retry-After.
+    """
+    if not RATE_LIMITING:
+        return None
+
+    ip = (request.headers.get(REAL_IP_HEADER) if REAL_IP_HEADER else None) or request.remote_addr
+    throttled = rate_limiter.check(subject, tracker_id, ip)
+    if throttled is None:
+        return None
+
+    bucket, wait = throttled
+    RATE_LIMITED.inc(subject if subject in KNOWN_SUBJECTS or subject in ("binary frame", "signed request", "fleet login") else "unknown", bucket)
+    retry_after = int(wait) + 1
+    response = jsonify({"status": "error", "message": "Too many requests, retry in %d seconds" % retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+def record_request(subject, status_code, started):
+    metrics.REQUESTS.inc(subject, status_code)
+    if status_code >= 400:
+        metrics.REQUEST_ERRORS.inc(subject)
+    metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, subject)
 
-    print(data)
+KNOWN_SUBJECTS = {"received coords", "received coords batch", "get coords", "get fleet coords", "get history", "get trips", "export history", "login request",
+                  "tracker id request", "provision trackers", "create geofence", "delete geofence", "get geofence events",
+                  "reset password request", "update password request"}
 
-    if data.get('data') == "tracker id request":
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not operator_authorized():
+        return operator_forbidden()
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/', methods=['POST'])
+def handle():
+    """
+        Entry point for every subject; records request count, errors and latency per subject around dispatch().
+    """
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response, status_code = dispatch()
+        return response, status_code
+    finally:
+        subject = g.get('subject')
+        record_request(subject if subject in KNOWN_SUBJECTS else "unknown", status_code, started)
+
+def dispatch():
+    signature = request.headers.get(SIGNATURE_HEADER)
+    signed_tracker_id = request.headers.get(TRACKER_ID_HEADER) if signature is not None else None
+
+    if signature is not None:
+        # Signaturen tjekkes på de rå bytes før JSON-dekodning; emnet kendes ikke endnu, så her gælder "signed request"
+        if not signed_tracker_id:
+            return jsonify({"status": "error", "message": "No tracker identification specified in %s header" % TRACKER_ID_HEADER}), 400
+
+        throttled = admit("signed request", signed_tracker_id)
+        if throttled is not None:
+            return throttled
+
+        if not data_handler.verify_signature(signed_tracker_id, request.get_data(cache=True), signature):
+            SIGNED_REQUESTS.inc("header", "rejected")
+            return jsonify({"status": "error", "message": "Invalid signature"}), 401
+        SIGNED_REQUESTS.inc("header", "ok")
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Malformed JSON body"}), 400
+    # Emnet bruges som nøgle i sæt og metrik-labels; en liste eller et objekt ville give en 500
+    if not isinstance(data.get('data'), str):
+        return jsonify({"status": "error", "message": "No subject specified in received data"}), 400
+    g.subject = data['data']
+
+    # Før databaseopslag og, for usignerede requests, før integritetstjekket
+    throttled = admit(g.subject, signed_tracker_id or data.get('tracker_id'))
+    if throttled is not None:
+        return throttled
+
+    if log.isEnabledFor(logging.DEBUG):
+        # Kopi: loggen formateres senere i en anden tråd, og intergrity_check() fjerner "hmac" fra data
+        log.debug("Request %s", g.subject, extra={"body": dict(data)})
+
+    if data.get('data') in ("tracker id request", "provision trackers", "get fleet coords"):
         subject = data.get('data')
-    elif data.get('data') == "get coords":
+    elif data.get('data') in ("get coords", "get history", "login request", "create geofence", "delete geofence", "get geofence events", "get trips",
+                              "export history"):
+        subject = data.get('data')
+        tracker_id = data.get('tracker_id')
+    elif signed_tracker_id is not None:
+        tracker_id = data.get('tracker_id', signed_tracker_id)
+        if tracker_id != signed_tracker_id:
+            return jsonify({"status": "error", "message": "Tracker identification in body does not match %s header" % TRACKER_ID_HEADER}), 400
         subject = data.get('data')
     else:
         tracker_id = data.get('tracker_id')
         if not tracker_id:
             return jsonify({"status": "error", "message": "No tracker identification specified in received data"}), 400
 
+        if not ALLOW_LEGACY_HMAC:
+            return jsonify({"status": "error", "message": "Missing %s header" % SIGNATURE_HEADER}), 401
+
         result_of_intergrity = data_handler.intergrity_check(tracker_id, data)
+        SIGNED_REQUESTS.inc("legacy", "ok" if result_of_intergrity else "rejected")
         if result_of_intergrity:
             subject = data.get('data')
         else:
@@ -286,19 +1991,134 @@ def handle():
             result, status_code = data_handler.received_coords(lat=coords_lat, long=coords_long, tracker_id=tracker_id)
             return jsonify(result), status_code
 
-        case "get coords":
+        case "received coords batch":
+            fixes = data.get('fixes')
+
+            if not isinstance(fixes, list):
+                return jsonify({"status": "error", "message": "No fixes list specified in received data"}), 400
+
+            result, status_code = data_handler.received_coords_batch(fixes=fixes, tracker_id=tracker_id)
+            return jsonify(result), status_code
+
+        case "login request" if data.get('tracker_ids') is not None:
+            tracker_password = data.get('password')
+            passwords = data.get('passwords')
+
+            if not tracker_password and not passwords:
+                return jsonify({"status": "error", "message": "No password or passwords specified in received data"}), 400
+
+            tracker_ids = data_handler.fleet_ids(data.get('tracker_ids'))
+            if tracker_ids is None:
+                return jsonify({"status": "error", "message": "tracker_ids must be a list of 1 to %d tracker ids" % FLEET_MAX_TRACKERS}), 400
+
+            # Hvert tracker id koster et bcrypt-tjek, så det trækker også sin egen token
+            throttled = admit("fleet login", tuple(tracker_ids))
+            if throttled is not None:
+                return throttled
+
+            result, status_code = data_handler.fleet_login(tracker_ids=tracker_ids, tracker_password=tracker_password, passwords=passwords)
+            return jsonify(result), status_code
+
+        case "login request":
             tracker_password = data.get('password')
 
             if not tracker_id or not tracker_password:
                 return jsonify({"status": "error", "message": "No tracker identification or password specified in received data"}), 400
 
-            result, status_code = data_handler.get_coords(tracker_id=tracker_id, tracker_password=tracker_password)
+            result, status_code = data_handler.login(tracker_id=tracker_id, tracker_password=tracker_password)
+            return jsonify(result), status_code
+
+        case "get fleet coords":
+            session_token = data.get('session_token')
+
+            if not session_token:
+                return jsonify({"status": "error", "message": "No session token specified in received data, log in with tracker_ids first"}), 400
+
+            result, status_code = data_handler.get_fleet_coords(tracker_ids=data.get('tracker_ids'), session_token=session_token)
+            return jsonify(result), status_code
+
+        case "get coords":
+            tracker_password = data.get('password')
+            session_token = data.get('session_token')
+
+            if not tracker_id or not (tracker_password or session_token):
+                return jsonify({"status": "error", "message": "No tracker identification, password or session token specified in received data"}), 400
+
+            result, status_code = data_handler.get_coords(tracker_id=tracker_id, tracker_password=tracker_password, session_token=session_token)
+            return jsonify(result), status_code
+
+        case "get history":
+            tracker_password = data.get('password')
+            session_token = data.get('session_token')
+
+            if not tracker_id or not (tracker_password or session_token):
+                return jsonify({"status": "error", "message": "No tracker identification, password or session token specified in received data"}), 400
+
+            result, status_code = data_handler.get_history(tracker_id=tracker_id, tracker_password=tracker_password, session_token=session_token,
+                                                           start=data.get('from'), end=data.get('to'), max_points=data.get('max_points'),
+                                                           cursor=data.get('cursor'), simplify=data.get('simplify', "douglas-peucker"))
+            return jsonify(result), status_code
+
+        case "export history":
+            tracker_password = data.get('password')
+            session_token = data.get('session_token')
+
+            if not tracker_id or not (tracker_password or session_token):
+                return jsonify({"status": "error", "message": "No tracker identification, password or session token specified in received data"}), 400
+
+            result, status_code = data_handler.export_history(tracker_id=tracker_id, tracker_password=tracker_password, session_token=session_token,
+                                                              start=data.get('from'), end=data.get('to'), export_format=data.get('format', "gpx"))
+            if status_code != 200:
+                return jsonify(result), status_code
+
+            return Response(stream_with_context(result["body"]), mimetype=result["mimetype"],
+                            headers={'Content-Disposition': 'attachment; filename="%s"' % result["filename"],
+                                     'X-Accel-Buffering': 'no'}), status_code
+
+        case "get trips":
+            tracker_password = data.get('password')
+            session_token = data.get('session_token')
+
+            if not tracker_id or not (tracker_password or session_token):
+                return jsonify({"status": "error", "message": "No tracker identification, password or session token specified in received data"}), 400
+
+            result, status_code = data_handler.get_trips(tracker_id=tracker_id, tracker_password=tracker_password, session_token=session_token,
+                                                         start=data.get('from'), end=data.get('to'), limit=data.get('limit'))
+            return jsonify(result), status_code
+
+        case "create geofence":
+            result, status_code = data_handler.create_geofence(tracker_id=tracker_id, tracker_password=data.get('password'),
+                                                               session_token=data.get('session_token'), provisioning_token=data.get('provisioning_token'),
+                                                               name=data.get('name'), shape=data.get('shape'), geometry=data.get('geometry'))
+            return jsonify(result), status_code
+
+        case "delete geofence":
+            if not isinstance(data.get('fence_id'), int):
+                return jsonify({"status": "error", "message": "No fence_id specified in received data"}), 400
+
+            result, status_code = data_handler.delete_geofence(data['fence_id'], tracker_id=tracker_id, tracker_password=data.get('password'),
+                                                               session_token=data.get('session_token'), provisioning_token=data.get('provisioning_token'))
+            return jsonify(result), status_code
+
+        case "get geofence events":
+            tracker_password = data.get('password')
+            session_token = data.get('session_token')
+
+            if not tracker_id or not (tracker_password or session_token):
+                return jsonify({"status": "error", "message": "No tracker identification, password or session token specified in received data"}), 400
+
+            result, status_code = data_handler.get_geofence_events(tracker_id=tracker_id, tracker_password=tracker_password, session_token=session_token,
+                                                                   since=data.get('since'), limit=data.get('limit'))
             return jsonify(result), status_code
 
         case "tracker id request":
             result, status_code = data_handler.generate_tracker_id()
             return jsonify(result), status_code
 
+        case "provision trackers":
+            result, status_code = data_handler.provision_trackers(count=data.get('count'), provisioning_token=data.get('provisioning_token'))
+            return jsonify(result), status_code
+
         case "reset password request":
             result, status_code = data_handler.password_reset(tracker_id)
             return jsonify(result), status_code
@@ -316,4 +2136,5 @@ def handle():
             return jsonify({"status": "error", "message": "Error handeling received data"}), 500
 
 if __name__ == "__main__":
-    app.run(debug=True, port=13371)
\ No newline at end of file
+    # Uden reloader: den starter en ekstra proces med sin egen DataHandler, og to PurgeWorkers ville folde de samme punkter
+    app.run(debug=True, use_reloader=False, port=13371, threaded=True)
\ No newline at end of file
@@ -0,0 +1,470 @@
+"""
+    Storage backends behind DataHandler.
+
+    Both backends offer the same interface, so DataHandler's queries run unchanged on either:
+        execute_query / execute_many / fetchone / fetchall / fetchone_column / commit / rollback / get_row_count / last_insert_id
+        checkout / release / connection()   per-thread connection handling
+        stream_query                        large SELECTs read in chunks on a connection of their own
+        statement(name)                     SQL that differs between dialects (see STATEMENTS)
+        savepoint(name)                     nested part of a transaction that is undone on its own if it fails
+        transient(error)                    whether a failed transaction is worth retrying as it is
+
+    Queries are written in the MySQL style with %s placeholders; the SQLite backend translates them once per
+    distinct query string. DB_BACKEND selects the backend ("mysql", the default, or "sqlite" with SQLITE_PATH).
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import mysql.connector as mysql
+from mysql.connector import Error, InterfaceError, OperationalError, errorcode, pooling
+from mysql.connector.errors import PoolError
+
+import metrics
+import migrations
+
+log = logging.getLogger("biltracker.storage")
+
+STATEMENTS = {
+    # Nyeste fix pr. tracker; en ældre fix overskriver aldrig en nyere
+    "upsert_latest": {
+        "mysql": ("INSERT INTO Tracker_seneste (Tracker_id, Latitude, Longitude, Tidspunkt) VALUES (%s, %s, %s, %s) "
+                  "ON DUPLICATE KEY UPDATE "
+                  "Latitude = IF(VALUES(Tidspunkt) >= Tidspunkt, VALUES(Latitude), Latitude), "
+                  "Longitude = IF(VALUES(Tidspunkt) >= Tidspunkt, VALUES(Longitude), Longitude), "
+                  "Tidspunkt = GREATEST(Tidspunkt, VALUES(Tidspunkt))"),
+        "sqlite": ("INSERT INTO Tracker_seneste (Tracker_id, Latitude, Longitude, Tidspunkt) VALUES (%s, %s, %s, %s) "
+                   "ON CONFLICT (Tracker_id) DO UPDATE SET "
+                   "Latitude = CASE WHEN excluded.Tidspunkt >= Tidspunkt THEN excluded.Latitude ELSE Latitude END, "
+                   "Longitude = CASE WHEN excluded.Tidspunkt >= Tidspunkt THEN excluded.Longitude ELSE Longitude END, "
+                   "Tidspunkt = MAX(Tidspunkt, excluded.Tidspunkt)"),
+    },
+    # Sletning i bidder (PurgeWorker); SQLite har normalt ikke DELETE ... LIMIT
+    "purge_tracker_chunk": {
+        "mysql": "DELETE FROM Lokation_log WHERE Tracker_id = %s AND Tidspunkt < %s ORDER BY Tidspunkt LIMIT %s",
+        "sqlite": ("DELETE FROM Lokation_log WHERE id IN "
+                   "(SELECT id FROM Lokation_log WHERE Tracker_id = %s AND Tidspunkt < %s ORDER BY Tidspunkt LIMIT %s)"),
+    },
+    # Serialiserer afledte skrivninger (trips, geofences) pr. tracker på tværs af processer, i fast rækkefølge mod deadlocks.
+    # SQLite har kun én skriver ad gangen, og ingest-transaktionen har allerede skrevet, så der er intet at låse.
+    "lock_trackers": {
+        "mysql": "SELECT Tracker_id FROM Tracker_enheder WHERE Tracker_id IN ({}) ORDER BY Tracker_id FOR UPDATE",
+        "sqlite": "SELECT Tracker_id FROM Tracker_enheder WHERE Tracker_id IN ({})",
+    },
+    "purge_before_chunk": {
+        "mysql": "DELETE FROM Lokation_log WHERE Tidspunkt < %s LIMIT %s",
+        "sqlite": "DELETE FROM Lokation_log WHERE id IN (SELECT id FROM Lokation_log WHERE Tidspunkt < %s LIMIT %s)",
+    },
+    "purge_rollup_before_chunk": {
+        "mysql": "DELETE FROM Lokation_rollup WHERE Sidste_tid < %s LIMIT %s",
+        "sqlite": "DELETE FROM Lokation_rollup WHERE rowid IN (SELECT rowid FROM Lokation_rollup WHERE Sidste_tid < %s LIMIT %s)",
+    },
+}
+
+
+class StreamsBusy(Exception):
+    pass
+
+
+class RowStream:
+    """
+        Result of stream_query(). Iterating yields lists of rows; close(), which also runs after the last row, closes
+        the connection (dropping the rest of an unfinished result) and frees the stream slot. Unlike a generator it
+        can be closed before iteration has started.
+    """
+    def __init__(self, db, cursor, chunk_size, release):
+        self.db = db
+        self.cursor = cursor
+        self.chunk_size = chunk_size
+        self.release = release
+
+    def __iter__(self):
+        try:
+            while self.db is not None:
+                rows = self.cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            self.close()
+
+    def close(self):
+        db, self.db = self.db, None
+        if db is None:
+            return
+
+        try:
+            db.close()
+        except Exception as e:
+            log.warning("Error closing stream connection: %s", e)
+        finally:
+            self.release()
+
+
+class StorageBackend:
+    """
+        Shared part of the backends. Subclasses set dialect and implement connect, checkout, release,
+        execute_query, execute_many and open_stream; the current thread's connection and cursor live in self.local.
+    """
+    dialect = None
+    stream_chunk = int(os.getenv("DB_STREAM_CHUNK", 1000))
+    streams = threading.BoundedSemaphore(int(os.getenv("DB_STREAMS", 4)))
+
+    def statement(self, name):
+        return STATEMENTS[name][self.dialect]
+
+    def translate(self, query):
+        return query
+
+    def stream_query(self, query, params=None, chunk_size=None):
+        """
+            Runs a SELECT on a connection of its own with an unbuffered cursor and returns a RowStream of row lists of
+            up to chunk_size (DB_STREAM_CHUNK), so memory stays flat however many rows the result has. The query runs
+            before this returns, so errors surface here and not halfway through the rows.
+
+            It never takes a pool connection from the requests; at most DB_STREAMS run at once, StreamsBusy is raised
+            after DB_POOL_TIMEOUT seconds.
+        """
+        if not self.streams.acquire(timeout=self.pool_timeout):
+            raise StreamsBusy("No stream slot available within %.1f seconds" % self.pool_timeout)
+
+        db = None
+        try:
+            db, cursor = self.open_stream()
+            cursor.execute(self.translate(query), params or ())
+        except Exception:
+            if db is not None:
+                db.close()
+            self.streams.release()
+            raise
+
+        return RowStream(db, cursor, chunk_size or self.stream_chunk, self.streams.release)
+
+    @contextmanager
+    def connection(self):
+        """
+            Scopes a checkout for code running outside a Flask request (background threads, scripts).
+
+            If the thread already holds a connection it is reused and left checked out.
+        """
+        owned = getattr(self.local, 'db', None) is None
+        try:
+            yield self.checkout()
+        finally:
+            if owned:
+                self.release()
+
+    @contextmanager
+    def savepoint(self, name):
+        """
+            Runs the block inside SAVEPOINT name within the caller's transaction. If the block raises, its own writes are
+            undone and the rest of the transaction is kept; transient errors are re-raised untouched, as the transaction
+            itself has to be retried then (an InnoDB deadlock has already rolled all of it back).
+        """
+        self.execute_query("SAVEPOINT %s" % name)
+        try:
+            yield
+        except Exception as e:
+            if not self.transient(e):
+                self.execute_query("ROLLBACK TO SAVEPOINT %s" % name)
+            raise
+        self.execute_query("RELEASE SAVEPOINT %s" % name)
+
+    @property
+    def mycursor(self):
+        self.checkout()
+        return self.local.cursor
+
+    def fetchall(self):
+        return self.mycursor.fetchall()
+
+    def fetchone(self):
+        return self.mycursor.fetchone()
+
+    def fetchone_column(self, column):
+        row = self.fetchone()
+        if row:
+            return row.get(column)
+        return None
+
+    def commit(self):
+        self.checkout().commit()
+
+    def rollback(self):
+        self.checkout().rollback()
+
+    def get_row_count(self):
+        return self.mycursor.rowcount
+
+    def last_insert_id(self):
+        return self.mycursor.lastrowid
+
+
+class DatabaseConnection(StorageBackend):
+    """
+        Pooled MySQL connection layer.
+
+        Each thread checks out its own connection from the pool on the first query and keeps it until
+        release() is called (done at the end of every Flask request), so execute_query/fetchone/commit
+        keep working as a sequence on the same session while other requests run in parallel.
+
+        The pool size and checkout timeout are configured through DB_POOL_SIZE and DB_POOL_TIMEOUT.
+    """
+    dialect = "mysql"
+
+    def __init__(self, pool_size=None, pool_timeout=None):
+        self.pool_size = pool_size or int(os.getenv("DB_POOL_SIZE", 8))
+        self.pool_timeout = pool_timeout or float(os.getenv("DB_POOL_TIMEOUT", 10))
+        self.pool = None
+        self.settings = dict(unix_socket="/var/run/mysqld/mysqld.sock",
+                             user="tracker",
+                             passwd=os.getenv("MY_DB_PASSWORD"),
+                             database="biltracker",
+                             connection_timeout=300)
+        self.stream_timeout = int(os.getenv("DB_STREAM_TIMEOUT", 3600))
+        self.slots = threading.BoundedSemaphore(self.pool_size)
+        self.local = threading.local()
+        self.connect()
+
+    def connect(self):
+        try:
+            self.pool = pooling.MySQLConnectionPool(
+                pool_name="biltracker",
+                pool_size=self.pool_size,
+                pool_reset_session=True,
+                **self.settings
+            )
+            log.info("Connected to database (pool size: %d)", self.pool_size)
+        except Error as e:
+            log.error("Error connecting to MySQL: %s", e)
+            raise
+
+    def checkout(self):
+        """
+            Returns the connection held by the current thread, checking one out of the pool if needed.
+
+            The health check (ping + reconnect) runs once per checkout instead of before every query.
+        """
+        db = getattr(self.local, 'db', None)
+        if db is not None:
+            return db
+
+        if not self.slots.acquire(timeout=self.pool_timeout):
+            raise PoolError("No database connection available within %.1f seconds" % self.pool_timeout)
+
+        try:
+            db = self.pool.get_connection()
+            if not db.is_connected():
+                log.warning("Pooled connection is stale, reconnecting")
+                metrics.DB_RECONNECTS.inc(self.dialect)
+                db.reconnect(attempts=3, delay=1)
+        except Exception:
+            self.slots.release()
+            raise
+
+        self.local.db = db
+        self.local.cursor = db.cursor(dictionary=True, buffered=True)
+        return db
+
+    def release(self):
+        """
+            Returns the current thread's connection to the pool. Uncommitted work is discarded by the pool's session reset.
+        """
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            return
+
+        try:
+            self.local.cursor.close()
+            db.close()
+        except Error as e:
+            log.warning("Error releasing pooled connection: %s", e)
+        finally:
+            self.local.db = None
+            self.local.cursor = None
+            self.slots.release()
+
+    def transient(self, error):
+        """
+            True for errors that go away by themselves: a lost or refused connection, an empty pool, a lock timeout or deadlock.
+        """
+        if isinstance(error, (OperationalError, InterfaceError, PoolError)):
+            return True
+        return getattr(error, 'errno', None) in (errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT)
+
+    def execute_query(self, query, params=None):
+        self.checkout()
+        started = time.perf_counter()
+        try:
+            self.local.cursor.execute(query, params)
+        except OperationalError as err:
+            if err.errno in (errorcode.CR_SERVER_LOST, errorcode.CR_SERVER_GONE_ERROR):
+                log.warning("Lost connection to MySQL server, attempting to reconnect")
+                metrics.DB_SERVER_LOST_RETRIES.inc(self.dialect)
+                metrics.DB_RECONNECTS.inc(self.dialect)
+                self.local.db.reconnect(attempts=3, delay=1)
+                self.local.cursor = self.local.db.cursor(dictionary=True, buffered=True)
+                self.local.cursor.execute(query, params)
+            else:
+                log.error("Error executing query: %s", err)
+                raise
+        finally:
+            metrics.DB_QUERY_LATENCY.observe(time.perf_counter() - started, self.dialect, "query")
+
+    def open_stream(self):
+        """
+            Unpooled connection for stream_query(). The server waits at most net_write_timeout for a client that stops
+            reading an unbuffered result, so it is raised to DB_STREAM_TIMEOUT for slow downloads.
+        """
+        db = mysql.connect(**self.settings)
+        try:
+            cursor = db.cursor(dictionary=True, buffered=False)
+            cursor.execute("SET SESSION net_write_timeout = %s", (self.stream_timeout,))
+            return db, cursor
+        except Exception:
+            db.close()
+            raise
+
+    def execute_many(self, query, seq_params):
+        """
+            Runs an INSERT for every parameter tuple. mysql.connector rewrites "INSERT ... VALUES" into a
+            single multi-row statement, so the whole batch costs one round-trip.
+        """
+        self.checkout()
+        started = time.perf_counter()
+        try:
+            self.local.cursor.executemany(query, seq_params)
+        finally:
+            metrics.DB_QUERY_LATENCY.observe(time.perf_counter() - started, self.dialect, "many")
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+
+class SQLiteConnection(StorageBackend):
+    """
+        Embedded SQLite backend for small edge deployments and tests; no database daemon needed.
+
+        The database runs in WAL mode, so readers don't block the single writer. Each thread checks out its own
+        connection (at most DB_POOL_SIZE at a time) just like the MySQL pool. Translated queries are cached, and
+        sqlite3's per-connection statement cache keeps them prepared. execute_many reuses one prepared INSERT for
+        the whole batch inside the caller's transaction. The schema is created on startup.
+    """
+    dialect = "sqlite"
+
+    def __init__(self, path=None, pool_size=None, pool_timeout=None):
+        self.path = path or os.getenv("SQLITE_PATH", "biltracker.db")
+        self.pool_size = pool_size or int(os.getenv("DB_POOL_SIZE", 8))
+        self.pool_timeout = pool_timeout or float(os.getenv("DB_POOL_TIMEOUT", 10))
+        self.slots = threading.BoundedSemaphore(self.pool_size)
+        self.idle = []
+        self.idle_lock = threading.Lock()
+        self.translated = {}
+        self.local = threading.local()
+        self.connect()
+
+    def connect(self):
+        with self.connection():
+            migrations.migrate(self)
+        log.info("Connected to SQLite database %s", self.path)
+
+    def open(self):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                             detect_types=sqlite3.PARSE_DECLTYPES, cached_statements=256)
+        db.row_factory = _dict_row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def checkout(self):
+        db = getattr(self.local, 'db', None)
+        if db is not None:
+            return db
+
+        if not self.slots.acquire(timeout=self.pool_timeout):
+            raise sqlite3.OperationalError("No database connection available within %.1f seconds" % self.pool_timeout)
+
+        with self.idle_lock:
+            db = self.idle.pop() if self.idle else None
+        if db is None:
+            try:
+                db = self.open()
+            except Exception:
+                self.slots.release()
+                raise
+
+        self.local.db = db
+        self.local.cursor = db.cursor()
+        return db
+
+    def release(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            return
+
+        try:
+            self.local.cursor.close()
+            db.rollback()
+            with self.idle_lock:
+                self.idle.append(db)
+        except sqlite3.Error as e:
+            log.warning("Error releasing SQLite connection: %s", e)
+        finally:
+            self.local.db = None
+            self.local.cursor = None
+            self.slots.release()
+
+    def open_stream(self):
+        """
+            Fresh connection for stream_query(); sqlite3 cursors step through the result as rows are fetched, and in
+            WAL mode the long read doesn't block the writer.
+        """
+        db = self.open()
+        return db, db.cursor()
+
+    def transient(self, error):
+        """
+            True for a busy or unreachable database file and an empty pool; other OperationalErrors (missing tables, bad SQL) are not.
+        """
+        if not isinstance(error, sqlite3.OperationalError):
+            return False
+        message = str(error)
+        return any(reason in message for reason in ("locked", "busy", "unable to open", "disk I/O", "No database connection"))
+
+    def translate(self, query):
+        sqlite_query = self.translated.get(query)
+        if sqlite_query is None:
+            sqlite_query = self.translated[query] = query.replace("%s", "?")
+        return sqlite_query
+
+    def execute_query(self, query, params=None):
+        self.checkout()
+        started = time.perf_counter()
+        try:
+            self.local.cursor.execute(self.translate(query), params or ())
+        finally:
+            metrics.DB_QUERY_LATENCY.observe(time.perf_counter() - started, self.dialect, "query")
+
+    def execute_many(self, query, seq_params):
+        self.checkout()
+        started = time.perf_counter()
+        try:
+            self.local.cursor.executemany(self.translate(query), seq_params)
+        finally:
+            metrics.DB_QUERY_LATENCY.observe(time.perf_counter() - started, self.dialect, "many")
+
+
+def open_database():
+    backend = os.getenv("DB_BACKEND", "mysql")
+    if backend == "sqlite":
+        return SQLiteConnection()
+    return DatabaseConnection()
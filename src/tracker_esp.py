@@ -1,7 +1,9 @@
 from machine import Pin, UART, reset
 import time
 import captive_portal
+import binary_frame
 import urequests
+import ntptime
 
 import aioble
 import bluetooth
@@ -15,6 +17,7 @@ from micropython import const
 import gc
 
 SERVER_URL = "https://79.171.148.143/api"
+FRAME_URL = SERVER_URL + "/frame"
 TRACKER_ID = None
 TOKEN_KEY = None
 
@@ -24,6 +27,41 @@ _CHARACTERISTIC_UUID_WIFI_PASSWORD = bluetooth.UUID("dfc2c17e-9f7f-480e-82e4-b54
 _CHARACTERISTIC_UUID_TRACKER_PASSWORD = bluetooth.UUID("1370af71-05bd-42cd-9604-72667f439c42")
 _ADV_INTERVAL_US = const(100000)
 
+# Antal GPS fixes der samles før de sendes i én "received coords batch" pakke (1 = send hver fix for sig)
+GPS_BATCH_SIZE = const(1)
+# Send fixes som binære frames (binary_frame.py, 28 bytes for én fix) i stedet for signeret JSON.
+# Slået fra indtil frames er rullet ud på serverne; "received coords" bruger serverens tid
+USE_BINARY_FRAME = const(0)
+# MicroPython på ESP32 tæller fra 2000-01-01, serveren forventer unix tid
+_EPOCH_OFFSET = const(946684800) if time.gmtime(0)[0] == 2000 else 0
+
+
+def unix_time():
+    return time.time() + _EPOCH_OFFSET
+
+
+def sync_clock():
+    """
+        Sets the clock over NTP. Returns False when it fails; the clock then still counts from 2000.
+    """
+    try:
+        ntptime.settime()
+        return True
+    except Exception as e:
+        print(f"[!] NTP time sync failed: {e}")
+        return False
+
+
+def post_signed(data_packet):
+    """
+        Sends data_packet with an HMAC-SHA256 of the exact body bytes in the X-Signature header.
+        The server checks the signature before parsing, so key order and float formatting no longer matter.
+    """
+    body = json.dumps(data_packet).encode('utf-8')
+    signature = hmac.new(TOKEN_KEY.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    headers = {'Content-Type': 'application/json', 'X-Tracker-Id': TRACKER_ID, 'X-Signature': signature}
+    return urequests.post(SERVER_URL, data=body, headers=headers)
+
 
 class BLEPeripheral:
     def __init__(self):
@@ -165,15 +203,47 @@ class HTTPServer:
                     'tracker_id': TRACKER_ID
                     }
 
-                payload_str = json.dumps(data_packet, separators=(',', ':'))
-                hmac_signature = hmac.new(b'{}'.format(TOKEN_KEY), payload_str.encode('utf-8'), hashlib.sha256).hexdigest()
-                data_packet["hmac"] = hmac_signature
 
                 print(f"[+] Sending data: {json.dumps(data_packet)}")
-                response = urequests.post(SERVER_URL, json=data_packet)
+                response = post_signed(data_packet)
+
+            except Exception as e:
+                print(f"Unhandled exception: {e}")
+
+
+        elif 'send gps batch' == type:
+
+            try:
+                data_packet = {
+                    'data': 'received coords batch',
+                    'fixes': [{'coords_lat': f"{lat}", 'coords_long': f"{long}", 'timestamp': timestamp} for lat, long, timestamp in data],
+                    'tracker_id': TRACKER_ID
+                    }
+
+
+                print(f"[+] Sending batch of {len(data)} fixes")
+                response = post_signed(data_packet)
+
+                return response.status_code in (200, 202)
+
+            except Exception as e:
+                print(f"Unhandled exception: {e}")
+                return False
+
+
+        elif 'send gps frame' == type:
+
+            try:
+                frame = binary_frame.encode(TRACKER_ID, data[-binary_frame.MAX_FIXES:], TOKEN_KEY.encode('utf-8'))
+
+                print(f"[+] Sending frame of {len(data)} fixes ({len(frame)} bytes)")
+                response = urequests.post(FRAME_URL, data=frame, headers={'Content-Type': 'application/octet-stream'})
+
+                return response.status_code in (200, 202)
 
             except Exception as e:
                 print(f"Unhandled exception: {e}")
+                return False
 
 
         elif 'tracker password update' == type:
@@ -185,12 +255,9 @@ class HTTPServer:
                     'tracker_password': data
                     }
 
-                payload_str = json.dumps(data_packet, separators=(',', ':'))
-                hmac_signature = hmac.new(b'{}'.format(TOKEN_KEY), payload_str.encode('utf-8'), hashlib.sha256).hexdigest()
-                data_packet["hmac"] = hmac_signature
 
                 print(f"[+] Sending data: {json.dumps(data_packet)}")
-                response = urequests.post(SERVER_URL, json=data_packet)
+                response = post_signed(data_packet)
 
                 print(f"Server response: {response.text}")
 
@@ -211,12 +278,9 @@ class HTTPServer:
                     'tracker_id': TRACKER_ID
                     }
                         
-                payload_str = json.dumps(data_packet, separators=(',', ':'))
-                hmac_signature = hmac.new(b'{}'.format(TOKEN_KEY), payload_str.encode('utf-8'), hashlib.sha256).hexdigest()
-                data_packet["hmac"] = hmac_signature
 
                 print(f"[+] Sending data: {json.dumps(data_packet)}")
-                response = urequests.post(SERVER_URL, json=data_packet)
+                response = post_signed(data_packet)
                         
                 print(f"Server response: {response.text}")    
                     
@@ -487,18 +551,34 @@ async def main():
             
     
     print(f"Received IP: {ip_value}")
+
+    # Batch fixes og frames bærer enhedens eget tidsstempel, så uret skal synkroniseres
+    clock_synced = sync_clock()
     
     tracker_id_control()
     
     send_password()
     
     gps_device = GPS()
+    gps_buffer = []
 
     while True:
         if gps_device.check_speed(): # Returns non 0 value if device is moving
             gps_data = gps_device.read_gps()
-
-            if gps_data:
+            if (GPS_BATCH_SIZE > 1 or USE_BINARY_FRAME) and not clock_synced:
+                clock_synced = sync_clock()
+
+            # Uden synkroniseret ur sendes hver fix for sig med serverens tid; serveren afviser tidsstempler fra år 2000
+            if gps_data and clock_synced and (GPS_BATCH_SIZE > 1 or USE_BINARY_FRAME):
+                gps_buffer.append((gps_data[0], gps_data[1], unix_time()))
+                upload = "send gps frame" if USE_BINARY_FRAME else "send gps batch"
+
+                # Bufferen beholdes hvis afsendelsen fejler, men begrænses så hukommelsen ikke løber fuld
+                if len(gps_buffer) >= GPS_BATCH_SIZE and HTTPServer.send_data(type=upload, data=gps_buffer):
+                    gps_buffer = []
+                elif len(gps_buffer) > 10 * GPS_BATCH_SIZE:
+                    gps_buffer = gps_buffer[-GPS_BATCH_SIZE:]
+            elif gps_data:
                 HTTPServer.send_data(type="send gps coordinates", data=gps_data)
             time.sleep(15)
         else:
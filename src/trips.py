@@ -0,0 +1,213 @@
+"""
+    Incremental trip segmentation on ingest: every tracker's fixes are cut into trips as they arrive, so listing
+    trips reads the Trips table and never rescans Lokation_log.
+
+    A trip ends when
+        - the next fix comes more than TRIP_GAP_SECONDS after the previous one (the trip ends at the previous fix), or
+        - the tracker stays within TRIP_STATIONARY_RADIUS_M of one spot for TRIP_STATIONARY_SECONDS (the trip ends
+          where it stopped; the jitter while parked is not counted as distance).
+    The next trip starts with the first fix that leaves the parking spot, from the last parked position. Distance
+    is the running haversine sum over the trip's fixes. Trips with a single fix are dropped.
+
+    Per-tracker state is the checkpoint row in Trip_checkpoint, read and written in the same transaction as the
+    fixes, so a restart continues where it stopped. DataHandler.write_derived() locks the tracker first, so several
+    server processes (or two requests from one tracker) never segment from the same stale checkpoint.
+
+    Usage:
+        python trips.py backfill        Segment existing Lokation_log history for trackers without a checkpoint
+"""
+import logging
+import os
+
+import geo
+
+log = logging.getLogger("biltracker.trips")
+
+TRIP_GAP_SECONDS = float(os.getenv("TRIP_GAP_SECONDS", 600))
+TRIP_STATIONARY_RADIUS_M = float(os.getenv("TRIP_STATIONARY_RADIUS_M", 50))
+TRIP_STATIONARY_SECONDS = float(os.getenv("TRIP_STATIONARY_SECONDS", 300))
+
+
+class TripState:
+    """
+        Segmentation state of one tracker. Points are (latitude, longitude, datetime); trip_id is None between trips.
+    """
+    __slots__ = ("trip_id", "last", "anchor", "distance", "count", "anchor_distance", "anchor_count", "dirty")
+
+    def __init__(self):
+        self.trip_id = None
+        self.last = None
+        self.anchor = None
+        self.distance = 0.0
+        self.count = 0
+        self.anchor_distance = 0.0
+        self.anchor_count = 0
+        self.dirty = False
+
+    @classmethod
+    def from_row(cls, row):
+        state = cls()
+        state.trip_id = row['Trip_id']
+        state.last = (float(row['Sidste_lat']), float(row['Sidste_long']), row['Sidste_tid'])
+        if row['Anker_tid'] is not None:
+            state.anchor = (float(row['Anker_lat']), float(row['Anker_long']), row['Anker_tid'])
+        state.distance = float(row['Distance_m'])
+        state.count = int(row['Antal'])
+        state.anchor_distance = float(row['Anker_distance'])
+        state.anchor_count = int(row['Anker_antal'])
+        return state
+
+
+class TripSegmenter:
+    def __init__(self, db_connection, gap=TRIP_GAP_SECONDS, radius=TRIP_STATIONARY_RADIUS_M, stationary=TRIP_STATIONARY_SECONDS):
+        self.db_connection = db_connection
+        self.gap = gap
+        self.radius = radius
+        self.stationary = stationary
+
+    def state(self, tracker_id):
+        self.db_connection.execute_query("SELECT * FROM Trip_checkpoint WHERE Tracker_id = %s", (tracker_id,))
+        row = self.db_connection.fetchone()
+        return TripState.from_row(row) if row else TripState()
+
+    def evaluate(self, rows):
+        """
+            Feeds (latitude, longitude, Tracker_id, Tidspunkt) rows through the segmentation inside the caller's transaction,
+            with the trackers locked. Fixes older than the tracker's last evaluated fix are skipped. Returns the trackers
+            whose state changed. An error here never fails the ingest: the trip writes are rolled back to a savepoint and
+            the next batch starts again from the stored checkpoint.
+        """
+        try:
+            by_tracker = {}
+            for lat, long, tracker_id, timestamp in rows:
+                by_tracker.setdefault(tracker_id, []).append((float(lat), float(long), timestamp))
+
+            updated = []
+            with self.db_connection.savepoint("trips"):
+                for tracker_id, points in by_tracker.items():
+                    state = self.state(tracker_id)
+                    for point in sorted(points, key=lambda point: point[2]):
+                        self.add(tracker_id, state, point)
+
+                    if state.dirty:
+                        self.save(tracker_id, state)
+                        updated.append(tracker_id)
+            return updated
+
+        except Exception as e:
+            if self.db_connection.transient(e):
+                raise
+            log.exception("Exception in TripSegmenter.evaluate")
+            return []
+
+    def add(self, tracker_id, state, point):
+        lat, long, timestamp = point
+        last = state.last
+        if last is not None and timestamp < last[2]:
+            return
+
+        gap = last is not None and (timestamp - last[2]).total_seconds() > self.gap
+        if state.trip_id is not None and gap:
+            self.close(state, last, state.distance, state.count)
+            state.anchor = None
+
+        if state.trip_id is not None:
+            state.distance += geo.haversine(last[0], last[1], lat, long)
+            state.count += 1
+            if geo.haversine(state.anchor[0], state.anchor[1], lat, long) > self.radius:
+                state.anchor, state.anchor_distance, state.anchor_count = point, state.distance, state.count
+            elif (timestamp - state.anchor[2]).total_seconds() >= self.stationary:
+                # Holdt stille: turen slutter hvor den stoppede
+                self.close(state, state.anchor, state.anchor_distance, state.anchor_count)
+
+        elif state.anchor is None or geo.haversine(state.anchor[0], state.anchor[1], lat, long) > self.radius:
+            if last is not None and not gap:
+                self.open(tracker_id, state, last)
+                state.distance = geo.haversine(last[0], last[1], lat, long)
+                state.count = 2
+            else:
+                self.open(tracker_id, state, point)
+            state.anchor, state.anchor_distance, state.anchor_count = point, state.distance, state.count
+
+        state.last = point
+        state.dirty = True
+
+    def open(self, tracker_id, state, start):
+        query = ("INSERT INTO Trips (Tracker_id, Start_tid, Start_lat, Start_long, Slut_tid, Slut_lat, Slut_long, Distance_m, Antal, Aaben) "
+                 "VALUES (%s, %s, %s, %s, %s, %s, %s, 0, 1, 1)")
+        self.db_connection.execute_query(query, (tracker_id, start[2], start[0], start[1], start[2], start[0], start[1]))
+        state.trip_id = self.db_connection.last_insert_id()
+        state.distance, state.count = 0.0, 1
+
+    def close(self, state, end, distance, count):
+        if count < 2:
+            self.db_connection.execute_query("DELETE FROM Trips WHERE Id = %s", (state.trip_id,))
+        else:
+            query = "UPDATE Trips SET Slut_tid = %s, Slut_lat = %s, Slut_long = %s, Distance_m = %s, Antal = %s, Aaben = 0 WHERE Id = %s"
+            self.db_connection.execute_query(query, (end[2], end[0], end[1], distance, count, state.trip_id))
+        state.trip_id = None
+        state.distance, state.count = 0.0, 0
+
+    def save(self, tracker_id, state):
+        if state.trip_id is not None:
+            query = "UPDATE Trips SET Slut_tid = %s, Slut_lat = %s, Slut_long = %s, Distance_m = %s, Antal = %s WHERE Id = %s"
+            self.db_connection.execute_query(query, (state.last[2], state.last[0], state.last[1], state.distance, state.count, state.trip_id))
+
+        anchor = state.anchor or (None, None, None)
+        query = ("REPLACE INTO Trip_checkpoint (Tracker_id, Trip_id, Sidste_lat, Sidste_long, Sidste_tid, Anker_lat, Anker_long, Anker_tid, "
+                 "Anker_distance, Anker_antal, Distance_m, Antal) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)")
+        self.db_connection.execute_query(query, (tracker_id, state.trip_id, state.last[0], state.last[1], state.last[2], anchor[0], anchor[1],
+                                                 anchor[2], state.anchor_distance, state.anchor_count, state.distance, state.count))
+
+    def reset_tracker(self, tracker_id):
+        """
+            Password reset: drops the checkpoint inside the caller's transaction. The old trips themselves are deleted by the purge job.
+        """
+        self.db_connection.execute_query("DELETE FROM Trip_checkpoint WHERE Tracker_id = %s", (tracker_id,))
+
+
+def backfill(db, segmenter, chunk_size=5000):
+    """
+        Segments the stored history of every tracker that has no checkpoint yet, reading Lokation_log in (Tidspunkt, id)
+        order chunk_size rows at a time. Returns {tracker_id: fixes read}.
+    """
+    db.execute_query("SELECT t.Tracker_id FROM Tracker_enheder t LEFT JOIN Trip_checkpoint c ON c.Tracker_id = t.Tracker_id "
+                     "WHERE c.Tracker_id IS NULL")
+    tracker_ids = [row['Tracker_id'] for row in db.fetchall()]
+
+    done = {}
+    for tracker_id in tracker_ids:
+        after_time, after_id, total = None, 0, 0
+        while True:
+            if after_time is None:
+                query = "SELECT id, Latitude, Longitude, Tidspunkt FROM Lokation_log WHERE Tracker_id = %s ORDER BY Tidspunkt, id LIMIT %s"
+                db.execute_query(query, (tracker_id, chunk_size))
+            else:
+                query = ("SELECT id, Latitude, Longitude, Tidspunkt FROM Lokation_log WHERE Tracker_id = %s "
+                         "AND (Tidspunkt > %s OR (Tidspunkt = %s AND id > %s)) ORDER BY Tidspunkt, id LIMIT %s")
+                db.execute_query(query, (tracker_id, after_time, after_time, after_id, chunk_size))
+            rows = db.fetchall()
+            if not rows:
+                break
+
+            segmenter.evaluate([(row['Latitude'], row['Longitude'], tracker_id, row['Tidspunkt']) for row in rows])
+            db.commit()
+            total += len(rows)
+            after_time, after_id = rows[-1]['Tidspunkt'], rows[-1]['id']
+            if len(rows) < chunk_size:
+                break
+        done[tracker_id] = total
+    return done
+
+
+if __name__ == "__main__":
+    import sys
+    from server import data_handler
+
+    if len(sys.argv) < 2 or sys.argv[1] != "backfill":
+        print(__doc__)
+        sys.exit(2)
+
+    with data_handler.db_connection.connection():
+        result = backfill(data_handler.db_connection, data_handler.trips)
+    print("[+] Backfilled %d trackers, %d fixes" % (len(result), sum(result.values())))
@@ -0,0 +1,47 @@
+"""
+    Tests run against the SQLite backend, so they need no MySQL daemon:
+        python -m pytest -q
+
+    server.py builds its DataHandler at import time, so the backend and database path are set here before any test
+    imports it. Tests that only need storage get a fresh database per test from the db fixture.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="biltracker-test-"), "server.db")
+os.environ["RATE_LIMITING"] = "0"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from storage import SQLiteConnection
+
+
+@pytest.fixture
+def db(tmp_path):
+    connection = SQLiteConnection(path=str(tmp_path / "biltracker.db"))
+    with connection.connection():
+        yield connection
+
+
+def insert_fixes(db, tracker_id, points):
+    """
+        Writes (latitude, longitude, datetime) points to Lokation_log and commits.
+    """
+    db.execute_many("INSERT INTO Lokation_log (latitude, longitude, Tracker_id, Tidspunkt) VALUES (%s, %s, %s, %s)",
+                    [(lat, long, tracker_id, timestamp) for lat, long, timestamp in points])
+    db.commit()
+
+
+def count_rows(db, table, tracker_id):
+    db.execute_query("SELECT COUNT(*) AS Antal FROM %s WHERE Tracker_id = %%s" % table, (tracker_id,))
+    return db.fetchone()['Antal']
+
+
+# Fast tidspunkt langt fra midnat, så timer og dage i testene ikke skifter undervejs
+BASE_TIME = datetime(2026, 1, 10, 10, 0, 0)
@@ -0,0 +1,56 @@
+import pytest
+
+import binary_frame
+
+KEY = b"a3f1" * 16
+FIXES = [(55.712345, 12.056789, 1792300000), (-33.865143, 151.2099, 1792300015), (0.0, -0.000001, 1792300030)]
+
+
+def test_round_trip():
+    frame = binary_frame.encode("Tracker#123456789", FIXES, KEY)
+
+    assert len(frame) == binary_frame.HEADER_SIZE + binary_frame.FIX_SIZE * len(FIXES) + binary_frame.TAG_SIZE
+    assert binary_frame.read_header(frame) == ("Tracker#123456789", len(FIXES))
+    assert binary_frame.verify(frame, KEY)
+    assert binary_frame.decode_fixes(frame, len(FIXES)) == [(lat, long, timestamp) for lat, long, timestamp in FIXES]
+
+
+def test_single_fix_is_28_bytes():
+    assert len(binary_frame.encode("Tracker#1", FIXES[:1], KEY)) == 28
+
+
+@pytest.mark.parametrize("offset", [0, 8, 20, -1])
+def test_any_flipped_byte_fails_verification(offset):
+    frame = bytearray(binary_frame.encode("Tracker#26349", FIXES, KEY))
+    frame[offset] ^= 0x01
+
+    assert not binary_frame.verify(bytes(frame), KEY)
+
+
+def test_wrong_key_fails_verification():
+    frame = binary_frame.encode("Tracker#26349", FIXES, KEY)
+
+    assert not binary_frame.verify(frame, b"another key")
+
+
+@pytest.mark.parametrize("mangle, message", [
+    (lambda frame: frame[:10], "too short"),
+    (lambda frame: b"XX" + frame[2:], "magic"),
+    (lambda frame: frame[:2] + b"\x02" + frame[3:], "version"),
+    (lambda frame: frame[:3] + b"\x05" + frame[4:], "length"),
+    (lambda frame: frame + b"\x00", "length"),
+])
+def test_read_header_rejects_malformed_frames(mangle, message):
+    frame = binary_frame.encode("Tracker#26349", FIXES, KEY)
+
+    with pytest.raises(binary_frame.FrameError, match=message):
+        binary_frame.read_header(mangle(frame))
+
+
+def test_encode_limits():
+    with pytest.raises(binary_frame.FrameError):
+        binary_frame.encode("Tracker#1", [], KEY)
+    with pytest.raises(binary_frame.FrameError):
+        binary_frame.encode("Tracker#1", FIXES[:1] * (binary_frame.MAX_FIXES + 1), KEY)
+    with pytest.raises(binary_frame.FrameError):
+        binary_frame.encode("Bil-7", FIXES[:1], KEY)
@@ -0,0 +1,64 @@
+import math
+from datetime import timedelta
+
+import pytest
+
+import geo
+from conftest import BASE_TIME
+
+
+def zigzag(count):
+    """
+        Track heading east with a sideways spike of about 200 m every tenth point and a few metres of wobble elsewhere.
+    """
+    points = []
+    for i in range(count):
+        offset = 0.0018 if i % 10 == 5 else 0.00002 * (i % 3)
+        points.append((55.7 + offset, 12.0 + i * 0.001, BASE_TIME + timedelta(seconds=15 * i)))
+    return points
+
+
+def test_haversine_known_distance():
+    # Én breddegrad er ~111,2 km på jordkuglen med EARTH_RADIUS_M
+    assert geo.haversine(55.0, 12.0, 56.0, 12.0) == pytest.approx(math.radians(1) * geo.EARTH_RADIUS_M)
+    assert geo.haversine(55.7, 12.5, 55.7, 12.5) == 0.0
+
+
+def test_douglas_peucker_keeps_short_tracks():
+    points = zigzag(5)
+
+    assert geo.douglas_peucker(points, 10) == points
+    assert geo.douglas_peucker(points[:2], 1) == points[:2]
+
+
+def test_douglas_peucker_respects_max_points_and_endpoints():
+    points = zigzag(500)
+
+    for max_points in (2, 3, 17, 100):
+        simplified = geo.douglas_peucker(points, max_points)
+        assert len(simplified) == max_points
+        assert simplified[0] == points[0] and simplified[-1] == points[-1]
+        assert simplified == sorted(simplified, key=lambda point: point[2])
+
+
+def test_douglas_peucker_keeps_largest_deviation_first():
+    points = [(55.7, 12.0 + i * 0.001, BASE_TIME + timedelta(seconds=15 * i)) for i in range(50)]
+    points[10] = (55.701, points[10][1], points[10][2])
+    points[30] = (55.705, points[30][1], points[30][2])
+
+    assert geo.douglas_peucker(points, 3) == [points[0], points[30], points[-1]]
+
+
+def test_douglas_peucker_long_track():
+    points = [(55.0 + math.sin(i / 4000), 12.0 + math.cos(i / 4000), BASE_TIME) for i in range(4000)]
+
+    assert len(geo.douglas_peucker(points, 1500)) == 1500
+
+
+def test_bucket_by_time_is_even_in_time():
+    points = zigzag(1000)
+
+    simplified = geo.bucket_by_time(points, 50)
+
+    assert len(simplified) == 50
+    assert simplified[0] == points[0] and simplified[-1] == points[-1]
@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+import pytest
+
+import geofence
+from conftest import BASE_TIME, count_rows
+
+HOME = {"center": [55.7, 12.5], "radius_m": 500}
+
+
+@pytest.fixture
+def engine(db):
+    engine = geofence.GeofenceEngine(db)
+    fence = engine.create("Tracker#1", "Hjem", "circle", HOME)
+    db.commit()
+    engine.added(fence)
+    return engine
+
+
+def feed(engine, points):
+    transitions = engine.evaluate([(lat, long, "Tracker#1", timestamp) for lat, long, timestamp in points])
+    engine.db_connection.commit()
+    engine.publish(transitions)
+    return [kind for _, _, _, events in transitions for _, _, kind, _, _, _ in events]
+
+
+def outside(minutes):
+    return 55.6, 12.5, BASE_TIME + timedelta(minutes=minutes)
+
+
+def inside(minutes):
+    return 55.7, 12.5, BASE_TIME + timedelta(minutes=minutes)
+
+
+def test_polygon_contains():
+    fence = geofence.Fence(1, None, "Firkant", "polygon", {"vertices": [[55.0, 12.0], [55.0, 13.0], [56.0, 13.0], [56.0, 12.0]]})
+
+    assert fence.contains(55.5, 12.5)
+    assert not fence.contains(56.5, 12.5)
+
+
+def test_enter_and_exit(engine):
+    assert feed(engine, [outside(0), inside(1), inside(2)]) == ["enter"]
+    assert feed(engine, [outside(3)]) == ["exit"]
+    assert feed(engine, [outside(4)]) == []
+
+
+def test_older_fixes_are_skipped(engine):
+    feed(engine, [inside(5)])
+
+    assert feed(engine, [outside(1)]) == []
+
+
+def test_two_processes_share_the_inside_state(db, engine):
+    other = geofence.GeofenceEngine(db)
+
+    assert feed(engine, [inside(0)]) == ["enter"]
+    assert feed(other, [inside(1)]) == []
+    assert feed(other, [outside(2)]) == ["exit"]
+    assert feed(engine, [outside(3)]) == []
+    assert feed(engine, [inside(4)]) == ["enter"]
+    assert count_rows(db, "Geofence_haendelse", "Tracker#1") == 3
+
+
+def test_failed_write_leaves_no_events(db, engine):
+    # En anden proces har allerede registreret at tracker'en er inde, uden at denne har set det
+    db.execute_query("INSERT INTO Geofence_inde (Tracker_id, Geofence_id) VALUES (%s, %s)", ("Tracker#1", next(iter(engine.fences))))
+    inside_query = engine.inside
+    engine.inside = lambda tracker_id: set()
+
+    assert feed(engine, [inside(0)]) == []
+    assert count_rows(db, "Geofence_haendelse", "Tracker#1") == 0
+
+    engine.inside = inside_query
+    assert feed(engine, [inside(1)]) == []
+    assert count_rows(db, "Geofence_haendelse", "Tracker#1") == 0
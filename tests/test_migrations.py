@@ -0,0 +1,75 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+import migrations
+
+
+class SchemaStub:
+    """
+        Answers the information_schema lookups of index_lokation_log() for a MySQL table with the given columns and
+        indexes ({name: [columns]}) and records the statements that change the table.
+    """
+    def __init__(self, columns, indexes):
+        self.columns = columns
+        self.indexes = indexes
+        self.changes = []
+        self.rows = []
+
+    def execute_query(self, query, params=None):
+        if "information_schema.COLUMNS" in query:
+            self.rows = [{'n': int(params[1] in self.columns)}]
+        elif "information_schema.STATISTICS" in query and "COUNT(*)" in query:
+            self.rows = [{'n': int(params[1] in self.indexes)}]
+        elif "information_schema.STATISTICS" in query:
+            self.rows = [{'COLUMN_NAME': column} for column in self.indexes.get(params[1], [])]
+        elif "information_schema" in query:
+            self.rows = []
+        else:
+            self.changes.append(query)
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+
+@pytest.mark.parametrize("primary, expected", [
+    (["id"], "ALTER TABLE Lokation_log DROP PRIMARY KEY, ADD PRIMARY KEY (id, Tidspunkt)"),
+    ([], "ALTER TABLE Lokation_log ADD PRIMARY KEY (id, Tidspunkt)"),
+    (["id", "Tidspunkt"], None),
+])
+def test_primary_key_gets_the_partitioning_column(primary, expected):
+    indexes = {migrations.LOKATION_INDEX: ["Tracker_id", "Tidspunkt"]}
+    if primary:
+        indexes["PRIMARY"] = primary
+    db = SchemaStub(["id", "Tracker_id", "Tidspunkt"], indexes)
+
+    migrations.index_lokation_log(db)
+
+    assert db.changes == ([expected] if expected else [])
+
+
+def test_missing_id_column_is_added_with_the_key():
+    db = SchemaStub(["Tracker_id", "Tidspunkt"], {"PRIMARY": ["Tracker_id", "Tidspunkt"]})
+
+    migrations.index_lokation_log(db)
+
+    assert db.changes[0] == ("ALTER TABLE Lokation_log DROP PRIMARY KEY, ADD COLUMN id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT FIRST, "
+                             "ADD PRIMARY KEY (id, Tidspunkt)")
+
+
+def test_command_line_migrates_a_fresh_database_without_the_server(tmp_path):
+    script = os.path.join(os.path.dirname(migrations.__file__), "migrations.py")
+    env = dict(os.environ, SQLITE_PATH=str(tmp_path / "fresh.db"))
+
+    result = subprocess.run([sys.executable, "-X", "importtime", script, "migrate"], env=env, capture_output=True, text=True, timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    assert "Schema is up to date" in result.stdout
+    # server.py bygger en DataHandler med PurgeWorker ved import
+    assert not re.search(r"\| +server$", result.stderr, re.M)
@@ -0,0 +1,233 @@
+import hashlib
+import hmac
+import json
+import time
+
+import bcrypt
+import pytest
+
+import server
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Laveste bcrypt-cost, så hver test ikke bruger et sekund på at hashe passwords
+    gensalt = bcrypt.gensalt
+    monkeypatch.setattr(server.bcrypt, "gensalt", lambda: gensalt(rounds=4))
+    return server.app.test_client()
+
+
+def signed(client, tracker_id, token_key, payload):
+    body = json.dumps(dict(payload, tracker_id=tracker_id)).encode()
+    signature = hmac.new(token_key.encode(), body, hashlib.sha256).hexdigest()
+    return client.post("/", data=body, content_type="application/json",
+                       headers={server.TRACKER_ID_HEADER: tracker_id, server.SIGNATURE_HEADER: signature})
+
+
+def login(client, tracker_id, password):
+    response = client.post("/", json={"data": "login request", "tracker_id": tracker_id, "password": password})
+    assert response.status_code == 200
+    return response.get_json()["session_token"]
+
+
+@pytest.fixture
+def owner(client):
+    """
+        A tracker with a password, a session token and an hour of driving through its own fence.
+    """
+    result = client.post("/", json={"data": "tracker id request"}).get_json()
+    tracker_id, token_key = result["tracker_id"], result["token_key"]
+    assert signed(client, tracker_id, token_key, {"data": "update password request", "tracker_password": "first"}).status_code == 200
+    session_token = login(client, tracker_id, "first")
+
+    fence = {"data": "create geofence", "tracker_id": tracker_id, "session_token": session_token, "name": "Hjem",
+             "shape": "circle", "geometry": {"center": [55.7, 12.5], "radius_m": 500}}
+    assert client.post("/", json=fence).status_code == 200
+
+    now = int(time.time())
+    fixes = [{"coords_lat": 55.6 + i * 0.01, "coords_long": 12.5, "timestamp": now - 3600 + 60 * i} for i in range(20)]
+    assert signed(client, tracker_id, token_key, {"data": "received coords batch", "fixes": fixes}).status_code == 200
+
+    return tracker_id, token_key, session_token
+
+
+@pytest.fixture
+def new_owner(client, owner, monkeypatch):
+    """
+        The same tracker after a password reset whose purge job hasn't run yet: the old rows are still there.
+    """
+    tracker_id, token_key, _ = owner
+    monkeypatch.setattr(server.data_handler.purger, "wake", lambda: None)
+
+    assert signed(client, tracker_id, token_key, {"data": "reset password request"}).status_code == 200
+    assert signed(client, tracker_id, token_key, {"data": "update password request", "tracker_password": "second"}).status_code == 200
+    return tracker_id, login(client, tracker_id, "second")
+
+
+def read(client, subject, tracker_id, session_token, **fields):
+    return client.post("/", json=dict(fields, data=subject, tracker_id=tracker_id, session_token=session_token))
+
+
+def test_old_owner_sees_its_history(client, owner):
+    tracker_id, _, session_token = owner
+
+    assert read(client, "get coords", tracker_id, session_token).status_code == 200
+    assert read(client, "get history", tracker_id, session_token, simplify="none").get_json()["raw_count"] == 20
+    assert len(read(client, "get geofence events", tracker_id, session_token, since=0).get_json()["events"]) == 2
+
+
+def test_history_floor_hides_rows_on_every_read(client, new_owner):
+    tracker_id, session_token = new_owner
+
+    assert read(client, "get coords", tracker_id, session_token).status_code == 404
+    assert read(client, "get history", tracker_id, session_token, simplify="none").get_json()["points"] == []
+    assert read(client, "get trips", tracker_id, session_token, **{"from": 0}).get_json()["trips"] == []
+    assert read(client, "get geofence events", tracker_id, session_token, since=0).get_json()["events"] == []
+
+    response = read(client, "export history", tracker_id, session_token, format="csv")
+    assert response.status_code == 200
+    assert len(response.get_data(as_text=True).strip().splitlines()) == 1
+
+
+@pytest.mark.parametrize("last_id", [None, 0])
+def test_history_floor_hides_rows_from_the_stream(new_owner, monkeypatch, last_id):
+    tracker_id, session_token = new_owner
+    monkeypatch.setattr(server, "STREAM_HEARTBEAT", 0.01)
+
+    stream = server.data_handler.stream_positions(tracker_id, session_token, last_id)
+    try:
+        assert next(stream) == "retry: 2000\n\n"
+        assert next(stream) == ": heartbeat\n\n"
+    finally:
+        stream.close()
+
+
+def test_session_tokens(client, owner):
+    tracker_id, _, session_token = owner
+
+    assert read(client, "get coords", tracker_id, "garbage").status_code == 401
+    other = client.post("/", json={"data": "tracker id request"}).get_json()["tracker_id"]
+    assert read(client, "get coords", other, session_token).status_code == 401
+    response = client.post("/", json={"data": "login request", "tracker_id": tracker_id, "password": "wrong"})
+    assert response.status_code == 401
+
+
+def test_password_reset_revokes_old_sessions(client, owner, new_owner):
+    tracker_id, _, old_token = owner
+
+    assert read(client, "get coords", tracker_id, old_token).status_code == 401
+
+
+def test_history_pages_follow_the_cursor(client, owner, monkeypatch):
+    tracker_id, _, session_token = owner
+    monkeypatch.setattr(server, "HISTORY_PAGE_SIZE", 7)
+
+    pages, cursor = [], None
+    while True:
+        result = read(client, "get history", tracker_id, session_token, simplify="none", cursor=cursor, **{"from": 0}).get_json()
+        pages.append(result["raw_count"])
+        cursor = result["next_cursor"]
+        if cursor is None:
+            break
+        timestamps = [point[2] for point in result["points"]]
+        assert timestamps == sorted(timestamps)
+
+    assert pages == [7, 7, 6]
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "2026-01-10T10:00:00|x", 12345, ["2026-01-10T10:00:00", 1], {"id": 1}])
+def test_malformed_history_cursor_gets_400(client, owner, cursor):
+    tracker_id, _, session_token = owner
+
+    response = read(client, "get history", tracker_id, session_token, cursor=cursor)
+
+    assert response.status_code == 400
+    assert response.is_json
+
+
+def test_export_formats(client, owner):
+    tracker_id, _, session_token = owner
+
+    response = read(client, "export history", tracker_id, session_token, format="csv")
+    assert response.status_code == 200
+    assert len(response.get_data(as_text=True).strip().splitlines()) == 21
+
+    response = read(client, "export history", tracker_id, session_token, format="gpx")
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).count("<trkpt") == 20
+
+
+@pytest.mark.parametrize("export_format", ["kml", ["csv"], {"format": "csv"}, 1])
+def test_unknown_export_format_gets_400(client, owner, export_format):
+    tracker_id, _, session_token = owner
+
+    response = read(client, "export history", tracker_id, session_token, format=export_format)
+
+    assert response.status_code == 400
+    assert response.is_json
+
+
+def test_stream_route_checks_the_session(client, owner):
+    tracker_id, _, session_token = owner
+
+    assert client.get("/stream", query_string={"tracker_id": tracker_id, "session_token": "garbage"}).status_code == 401
+    response = client.get("/stream", query_string={"tracker_id": tracker_id, "session_token": session_token},
+                          headers={"Last-Event-ID": "seven"})
+    assert response.status_code == 400
+
+
+def test_stream_replays_after_last_event_id(owner, monkeypatch):
+    tracker_id, _, session_token = owner
+    monkeypatch.setattr(server, "STREAM_HEARTBEAT", 0.01)
+
+    stream = server.data_handler.stream_positions(tracker_id, session_token, 0)
+    try:
+        assert next(stream) == "retry: 2000\n\n"
+        events = [next(stream) for _ in range(20)]
+        assert next(stream) == ": heartbeat\n\n"
+    finally:
+        stream.close()
+
+    ids = [int(event.split("\n")[0][len("id: "):]) for event in events]
+    assert ids == sorted(ids) and len(set(ids)) == 20
+
+
+def test_fleet_coords_only_for_trackers_that_logged_in(client, owner):
+    tracker_id, _, _ = owner
+    other = client.post("/", json={"data": "tracker id request"}).get_json()["tracker_id"]
+
+    response = client.post("/", json={"data": "login request", "tracker_ids": [tracker_id, other], "password": "first"})
+    assert response.status_code == 200
+    login_result = response.get_json()
+    assert (login_result["tracker_ids"], login_result["rejected"]) == ([tracker_id], [other])
+
+    result = client.post("/", json={"data": "get fleet coords", "tracker_ids": [tracker_id, other],
+                                    "session_token": login_result["session_token"]}).get_json()
+    assert list(result["positions"]) == [tracker_id]
+    assert result["positions"][tracker_id]["latitude"] == pytest.approx(55.6 + 19 * 0.01)
+    assert result["errors"] == {other: "not authorized"}
+
+
+@pytest.mark.parametrize("signature", ["ø" * 64, "æøå", "a" * 63, "g" * 64, ""])
+def test_malformed_signature_header_gets_401(client, owner, signature):
+    tracker_id, _, _ = owner
+
+    response = client.post("/", data=b'{"data": "received coords batch", "fixes": []}', content_type="application/json",
+                           headers={server.TRACKER_ID_HEADER: tracker_id, server.SIGNATURE_HEADER: signature})
+
+    assert response.status_code == 401
+    assert response.is_json
+
+
+@pytest.mark.parametrize("received_hmac", [12345, ["a"], {"hmac": "a"}, "ø" * 64])
+def test_malformed_legacy_hmac_is_rejected(client, owner, received_hmac):
+    tracker_id, _, _ = owner
+
+    response = client.post("/", json={"data": "received coords", "tracker_id": tracker_id, "coords_lat": "10.5",
+                                      "coords_long": "12.5", "hmac": received_hmac})
+
+    assert response.is_json
+    with server.data_handler.db_connection.connection():
+        server.data_handler.db_connection.execute_query("SELECT COUNT(*) AS Antal FROM Lokation_log WHERE Tracker_id = %s AND Latitude = %s",
+                                                        (tracker_id, 10.5))
+        assert server.data_handler.db_connection.fetchone()['Antal'] == 0
@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import geo
+import rollups
+from conftest import BASE_TIME, count_rows, insert_fixes
+
+
+def rollup_rows(db, tracker_id, level):
+    db.execute_query("SELECT * FROM Lokation_rollup WHERE Tracker_id = %s AND Niveau = %s ORDER BY Periode", (tracker_id, level))
+    return db.fetchall()
+
+
+def test_summary_add_tracks_distance_box_and_count():
+    summary = rollups.Summary(55.0, 12.0, BASE_TIME)
+    summary.add(55.01, 12.0, BASE_TIME + timedelta(minutes=1))
+    summary.add(55.01, 12.02, BASE_TIME + timedelta(minutes=2))
+
+    assert summary.count == 3
+    assert summary.first == (55.0, 12.0, BASE_TIME)
+    assert summary.last == (55.01, 12.02, BASE_TIME + timedelta(minutes=2))
+    assert (summary.min_lat, summary.max_lat, summary.min_long, summary.max_long) == (55.0, 55.01, 12.0, 12.02)
+    assert summary.distance == pytest.approx(geo.haversine(55.0, 12.0, 55.01, 12.0) + geo.haversine(55.01, 12.0, 55.01, 12.02))
+
+
+def test_summary_merge_counts_gap_between_consecutive_summaries():
+    earlier = rollups.Summary(55.0, 12.0, BASE_TIME)
+    earlier.add(55.01, 12.0, BASE_TIME + timedelta(minutes=10))
+    later = rollups.Summary(55.02, 12.0, BASE_TIME + timedelta(hours=1))
+    later.add(55.03, 12.0, BASE_TIME + timedelta(hours=1, minutes=10))
+    expected = earlier.distance + later.distance + geo.haversine(55.01, 12.0, 55.02, 12.0)
+
+    # Rækkefølgen af merge må ikke betyde noget
+    later.merge(earlier)
+
+    assert later.count == 4
+    assert later.first == (55.0, 12.0, BASE_TIME)
+    assert later.last == (55.03, 12.0, BASE_TIME + timedelta(hours=1, minutes=10))
+    assert later.distance == pytest.approx(expected)
+
+
+def test_summary_merge_of_overlapping_summaries_adds_distances():
+    existing = rollups.Summary(55.0, 12.0, BASE_TIME)
+    existing.add(55.01, 12.0, BASE_TIME + timedelta(minutes=30))
+    late = rollups.Summary(55.005, 12.0, BASE_TIME + timedelta(minutes=10))
+
+    existing.merge(late)
+
+    assert existing.count == 3
+    assert existing.distance == pytest.approx(geo.haversine(55.0, 12.0, 55.01, 12.0))
+    assert existing.last[2] == BASE_TIME + timedelta(minutes=30)
+
+
+def test_fold_fixes_moves_every_fix_into_exactly_one_hour(db):
+    points = [(55.0 + i * 0.001, 12.0, BASE_TIME + timedelta(minutes=20 * i)) for i in range(6)]
+    insert_fixes(db, "Tracker#1", points)
+    insert_fixes(db, "Tracker#2", points)
+
+    assert rollups.fold_fixes(db, "Tracker#1", BASE_TIME + timedelta(hours=1, minutes=30), 100) == 5
+
+    hours = rollup_rows(db, "Tracker#1", rollups.HOUR)
+    assert [(row['Periode'], row['Antal']) for row in hours] == [(BASE_TIME, 3), (BASE_TIME + timedelta(hours=1), 2)]
+    assert hours[1]['Sidste_tid'] == BASE_TIME + timedelta(minutes=80)
+    assert count_rows(db, "Lokation_log", "Tracker#1") == 1
+    assert count_rows(db, "Lokation_log", "Tracker#2") == 6
+
+
+def test_fold_fixes_respects_limit_and_resumes(db):
+    insert_fixes(db, "Tracker#1", [(55.0, 12.0, BASE_TIME + timedelta(minutes=i)) for i in range(10)])
+
+    assert rollups.fold_fixes(db, "Tracker#1", BASE_TIME + timedelta(hours=1), 4) == 4
+    assert rollups.fold_fixes(db, "Tracker#1", BASE_TIME + timedelta(hours=1), 4) == 4
+    assert rollups.fold_fixes(db, "Tracker#1", BASE_TIME + timedelta(hours=1), 4) == 2
+    assert rollups.fold_fixes(db, "Tracker#1", BASE_TIME + timedelta(hours=1), 4) == 0
+
+    hours = rollup_rows(db, "Tracker#1", rollups.HOUR)
+    assert [(row['Periode'], row['Antal']) for row in hours] == [(BASE_TIME, 10)]
+    assert hours[0]['Foerste_tid'] == BASE_TIME and hours[0]['Sidste_tid'] == BASE_TIME + timedelta(minutes=9)
+
+
+def test_late_fix_merges_into_rolled_up_hour(db):
+    insert_fixes(db, "Tracker#1", [(55.0, 12.0, BASE_TIME), (55.01, 12.0, BASE_TIME + timedelta(minutes=30))])
+    rollups.fold_fixes(db, "Tracker#1", BASE_TIME + timedelta(hours=1), 100)
+
+    insert_fixes(db, "Tracker#1", [(55.005, 12.0, BASE_TIME + timedelta(minutes=10))])
+    rollups.fold_fixes(db, "Tracker#1", BASE_TIME + timedelta(hours=1), 100)
+
+    hours = rollup_rows(db, "Tracker#1", rollups.HOUR)
+    assert len(hours) == 1 and hours[0]['Antal'] == 3
+    assert hours[0]['Sidste_tid'] == BASE_TIME + timedelta(minutes=30)
+
+
+def test_fold_hours_into_days(db):
+    points = [(55.0, 12.0 + i * 0.01, BASE_TIME + timedelta(hours=i)) for i in range(4)]
+    points.append((55.0, 12.05, BASE_TIME + timedelta(days=1)))
+    insert_fixes(db, "Tracker#1", points)
+    rollups.fold_fixes(db, "Tracker#1", BASE_TIME + timedelta(days=2), 100)
+
+    assert rollups.fold_hours(db, "Tracker#1", rollups.day_start(BASE_TIME + timedelta(days=2)), 100) == 5
+
+    assert rollup_rows(db, "Tracker#1", rollups.HOUR) == []
+    days = rollup_rows(db, "Tracker#1", rollups.DAY)
+    assert [(row['Periode'], row['Antal']) for row in days] == [(datetime(2026, 1, 10), 4), (datetime(2026, 1, 11), 1)]
+    assert days[0]['Distance_m'] == pytest.approx(geo.track_length(points[:4]))
+
+
+def test_summary_points_returns_first_and_last_in_range(db):
+    insert_fixes(db, "Tracker#1", [(55.0, 12.0, BASE_TIME), (55.01, 12.0, BASE_TIME + timedelta(minutes=30))])
+    rollups.fold_fixes(db, "Tracker#1", BASE_TIME + timedelta(hours=1), 100)
+
+    points, summaries = rollups.summary_points(db, "Tracker#1", BASE_TIME - timedelta(days=1), BASE_TIME + timedelta(days=1))
+
+    assert summaries == 1
+    assert points == [(55.0, 12.0, BASE_TIME), (55.01, 12.0, BASE_TIME + timedelta(minutes=30))]
+
+
+def test_roll_up_refuses_without_an_age(db):
+    from server import PurgeWorker
+
+    insert_fixes(db, "Tracker#1", [(55.0, 12.0, datetime.now() - timedelta(hours=3))])
+    worker = PurgeWorker(db, rollup_days=0, start=False)
+
+    with pytest.raises(ValueError):
+        worker.roll_up()
+    assert count_rows(db, "Lokation_log", "Tracker#1") == 1
+
+
+def test_roll_up_only_folds_fixes_older_than_the_age(db):
+    from server import PurgeWorker
+
+    db.execute_query("INSERT INTO Tracker_enheder (Tracker_id, Token_key) VALUES (%s, %s)", ("Tracker#1", "key"))
+    now = datetime.now()
+    insert_fixes(db, "Tracker#1", [(55.0, 12.0, now - timedelta(days=5)), (55.0, 12.0, now - timedelta(hours=3))])
+
+    result = PurgeWorker(db, rollup_days=2, start=False).roll_up()
+
+    assert result["fixes"] == 1
+    assert count_rows(db, "Lokation_log", "Tracker#1") == 1
@@ -0,0 +1,203 @@
+import hashlib
+import hmac
+import json
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from conftest import count_rows
+
+
+class SmallAllocator(server.TrackerIdAllocator):
+    ID_SPACE = 50000
+    HALF_BITS = 8
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+@pytest.fixture
+def tracker(client):
+    result = client.post("/", json={"data": "tracker id request"}).get_json()
+    return result["tracker_id"], result["token_key"]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    return now
+
+
+def post_legacy_signed(client, token_key, payload):
+    """
+        Posts payload with the legacy "hmac" field; the body is serialized here, as Flask's json= would sort the keys.
+    """
+    body = json.dumps(payload, separators=(',', ':'))
+    signed = dict(payload, hmac=hmac.new(token_key.encode(), body.encode(), hashlib.sha256).hexdigest())
+    return client.post("/", data=json.dumps(signed), content_type="application/json")
+
+
+def test_tracker_id_permutation_is_a_bijection():
+    allocator = SmallAllocator(None)
+    key = bytes(range(16))
+
+    assert sorted(allocator.permute(value, key) for value in range(allocator.ID_SPACE)) == list(range(allocator.ID_SPACE))
+
+
+def test_tracker_id_permutation_scatters_consecutive_counters():
+    allocator = server.TrackerIdAllocator(None)
+    key = bytes(range(16))
+
+    values = [allocator.permute(value, key) for value in range(20000)]
+
+    assert len(set(values)) == len(values)
+    assert all(0 <= value < allocator.ID_SPACE for value in values)
+    assert sum(abs(a - b) == 1 for a, b in zip(values, values[1:])) < 5
+
+
+def test_allocate_hands_out_distinct_ids(db):
+    allocator = server.TrackerIdAllocator(db)
+
+    ids = allocator.allocate(500) + allocator.allocate(1)
+
+    assert len(set(ids)) == 501
+    assert all(100000000 <= int(tracker_id[len("Tracker#"):]) < 200000000 for tracker_id in ids)
+
+
+def test_rate_limiter_burst_then_refill(clock):
+    limiter = server.RateLimiter({"*": {"tracker": (1, 3), "ip": None}})
+
+    assert [limiter.check("get coords", "Tracker#1", "10.0.0.1") for _ in range(3)] == [None] * 3
+    bucket, wait = limiter.check("get coords", "Tracker#1", "10.0.0.1")
+    assert bucket == "tracker" and wait == pytest.approx(1.0)
+    assert limiter.check("get coords", "Tracker#2", "10.0.0.1") is None
+
+    clock[0] += 1.0
+    assert limiter.check("get coords", "Tracker#1", "10.0.0.1") is None
+
+
+def test_rate_limiter_separates_subjects_and_ips(clock):
+    limiter = server.RateLimiter({"login request": {"tracker": None, "ip": (1, 1)}, "*": {"tracker": None, "ip": (1, 1)}})
+
+    assert limiter.check("login request", None, "10.0.0.1") is None
+    assert limiter.check("login request", None, "10.0.0.1") is not None
+    assert limiter.check("login request", None, "10.0.0.2") is None
+    assert limiter.check("get coords", None, "10.0.0.1") is None
+
+
+def test_rate_limiter_charges_the_ip_once_per_fleet_tracker(clock):
+    limiter = server.RateLimiter({"*": {"tracker": (1, 2), "ip": (1, 10)}})
+
+    assert limiter.check("fleet login", tuple("Tracker#%d" % i for i in range(8)), "10.0.0.1") is None
+    bucket, wait = limiter.check("fleet login", ("Tracker#8", "Tracker#9", "Tracker#10"), "10.0.0.1")
+    assert bucket == "ip" and wait == pytest.approx(1.0)
+    assert limiter.check("fleet login", ("Tracker#0", "Tracker#0", "Tracker#0"), "10.0.0.2") == ("tracker", pytest.approx(1.0))
+
+
+def test_rate_limiter_bounds_its_buckets(clock):
+    limiter = server.RateLimiter({"*": {"tracker": (1, 1), "ip": None}}, max_buckets=100)
+
+    for i in range(1000):
+        limiter.check("get coords", "Tracker#%d" % i, None)
+
+    assert len(limiter.buckets) == 100
+
+
+def test_fix_time_window():
+    now = time.time()
+
+    assert abs(server.data_handler.fix_time(int(now)) - datetime.now()) < timedelta(seconds=2)
+    with pytest.raises(ValueError):
+        server.data_handler.fix_time(946684800 + 3600)
+    with pytest.raises(ValueError):
+        server.data_handler.fix_time(int(now + 2 * 86400))
+
+
+def test_location_writer_drops_only_the_bad_rows(tracker):
+    tracker_id, _ = tracker
+    handler = server.data_handler
+    writer = server.LocationWriter(handler.db_connection, handler, interval_ms=10000)
+    now = datetime.now()
+
+    # "north" kommer forbi indsættelsen i SQLite, men får write_derived til at fejle
+    writer.submit([(55.0, 12.0, tracker_id, now), ("north", 12.0, tracker_id, now), (55.1, 12.1, tracker_id, now)])
+    writer.stop()
+
+    stats = writer.stats()
+    assert (stats["flushed"], stats["failed"], stats["queue_depth"]) == (2, 1, 0)
+    with handler.db_connection.connection():
+        assert count_rows(handler.db_connection, "Lokation_log", tracker_id) == 2
+
+
+def test_location_writer_keeps_retrying_while_the_database_is_away(tracker, monkeypatch):
+    tracker_id, _ = tracker
+    handler = server.data_handler
+    writer = server.LocationWriter(handler.db_connection, handler, interval_ms=10000, retry_max_ms=20)
+    execute_many = handler.db_connection.execute_many
+    outage = [6]
+
+    def unavailable(query, params):
+        if outage[0]:
+            outage[0] -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return execute_many(query, params)
+
+    monkeypatch.setattr(handler.db_connection, "execute_many", unavailable)
+    now = datetime.now()
+    writer.submit([(55.0, 12.0, tracker_id, now), (55.1, 12.1, tracker_id, now)])
+    writer.stop()
+
+    stats = writer.stats()
+    assert (stats["flushed"], stats["failed"], stats["retries"]) == (2, 0, 6)
+    with handler.db_connection.connection():
+        assert count_rows(handler.db_connection, "Lokation_log", tracker_id) == 2
+
+
+def test_received_coords_rejects_malformed_coordinates(client, tracker):
+    tracker_id, token_key = tracker
+
+    for lat in ("north", "91", "nan"):
+        payload = {"data": "received coords", "tracker_id": tracker_id, "coords_lat": lat, "coords_long": "12.5"}
+        assert post_legacy_signed(client, token_key, payload).status_code == 400
+
+    payload = {"data": "received coords", "tracker_id": tracker_id, "coords_lat": "55.7", "coords_long": "12.5"}
+    assert post_legacy_signed(client, token_key, payload).status_code == 200
+
+
+def test_header_signature_is_checked_on_the_raw_body(client, tracker):
+    tracker_id, token_key = tracker
+    body = json.dumps({"data": "received coords batch", "tracker_id": tracker_id,
+                       "fixes": [{"coords_lat": 55.7, "coords_long": 12.5, "timestamp": int(time.time())}]}).encode()
+    signature = hmac.new(token_key.encode(), body, hashlib.sha256).hexdigest()
+
+    response = client.post("/", data=body, headers={"X-Tracker-Id": tracker_id, "X-Signature": signature}, content_type="application/json")
+    assert response.status_code == 200
+
+    response = client.post("/", data=body + b" ", headers={"X-Tracker-Id": tracker_id, "X-Signature": signature}, content_type="application/json")
+    assert response.status_code == 401
+
+    response = client.post("/", data=b"\xff{not json", headers={"X-Tracker-Id": tracker_id, "X-Signature": signature})
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize("body", [{"data": ["x"]}, {"data": {"subject": "get coords"}}, {"tracker_id": "Tracker#1"}, ["data"]])
+def test_malformed_subjects_get_400(client, body):
+    response = client.post("/", json=body)
+
+    assert response.status_code == 400
+    assert response.is_json
+
+
+def test_internal_routes_need_the_provisioning_token(client, monkeypatch):
+    monkeypatch.setattr(server, "PROVISIONING_TOKEN", "operator")
+
+    for path in ("/metrics", "/purge/stats"):
+        assert client.get(path).status_code == 403
+        assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 403
+        assert client.get(path, headers={"Authorization": "Bearer operator"}).status_code == 200
@@ -0,0 +1,80 @@
+import os
+from datetime import timedelta
+
+import pytest
+
+import storage
+from conftest import BASE_TIME, insert_fixes
+
+
+def test_translate_uses_qmark_parameters(db):
+    query = "SELECT * FROM Lokation_log WHERE Tracker_id = %s AND Tidspunkt < %s"
+
+    assert db.translate(query) == "SELECT * FROM Lokation_log WHERE Tracker_id = ? AND Tidspunkt < ?"
+    assert db.translate(query) is db.translate(query)
+
+
+def test_statements_exist_for_both_dialects():
+    for name, dialects in storage.STATEMENTS.items():
+        assert set(dialects) == {"mysql", "sqlite"}, name
+
+
+def test_rows_are_dicts_with_datetimes(db):
+    insert_fixes(db, "Tracker#1", [(55.7, 12.5, BASE_TIME)])
+
+    db.execute_query("SELECT Latitude, Longitude, Tidspunkt FROM Lokation_log WHERE Tracker_id = %s", ("Tracker#1",))
+
+    assert db.fetchall() == [{"Latitude": 55.7, "Longitude": 12.5, "Tidspunkt": BASE_TIME}]
+
+
+def test_upsert_latest_never_goes_back_in_time(db):
+    query = db.statement("upsert_latest")
+
+    db.execute_query(query, ("Tracker#1", 55.0, 12.0, BASE_TIME))
+    db.execute_query(query, ("Tracker#1", 56.0, 13.0, BASE_TIME - timedelta(minutes=5)))
+    db.execute_query("SELECT Latitude, Longitude, Tidspunkt FROM Tracker_seneste WHERE Tracker_id = %s", ("Tracker#1",))
+    assert db.fetchone() == {"Latitude": 55.0, "Longitude": 12.0, "Tidspunkt": BASE_TIME}
+
+    db.execute_query(query, ("Tracker#1", 57.0, 14.0, BASE_TIME + timedelta(minutes=5)))
+    db.execute_query("SELECT Latitude, Tidspunkt FROM Tracker_seneste WHERE Tracker_id = %s", ("Tracker#1",))
+    assert db.fetchone() == {"Latitude": 57.0, "Tidspunkt": BASE_TIME + timedelta(minutes=5)}
+
+
+def test_purge_chunk_deletes_at_most_the_limit(db):
+    insert_fixes(db, "Tracker#1", [(55.0, 12.0, BASE_TIME + timedelta(seconds=i)) for i in range(10)])
+    insert_fixes(db, "Tracker#2", [(55.0, 12.0, BASE_TIME)])
+
+    db.execute_query(db.statement("purge_tracker_chunk"), ("Tracker#1", BASE_TIME + timedelta(seconds=8), 5))
+    assert db.get_row_count() == 5
+    db.execute_query(db.statement("purge_tracker_chunk"), ("Tracker#1", BASE_TIME + timedelta(seconds=8), 5))
+    assert db.get_row_count() == 3
+    db.commit()
+
+    db.execute_query("SELECT Tracker_id, COUNT(*) AS Antal FROM Lokation_log GROUP BY Tracker_id ORDER BY Tracker_id")
+    assert db.fetchall() == [{"Tracker_id": "Tracker#1", "Antal": 2}, {"Tracker_id": "Tracker#2", "Antal": 1}]
+
+
+def test_connections_are_reused_per_thread(db):
+    assert db.checkout() is db.checkout()
+
+
+def test_stream_query_yields_chunks_and_frees_its_slot(db):
+    insert_fixes(db, "Tracker#1", [(55.0, 12.0, BASE_TIME + timedelta(seconds=i)) for i in range(25)])
+
+    stream = db.stream_query("SELECT Tidspunkt FROM Lokation_log WHERE Tracker_id = %s ORDER BY Tidspunkt", ("Tracker#1",), chunk_size=10)
+    chunks = list(stream)
+
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert chunks[2][-1]["Tidspunkt"] == BASE_TIME + timedelta(seconds=24)
+    # Alle pladser er fri igen, også for en stream der lukkes før første række
+    db.stream_query("SELECT id FROM Lokation_log").close()
+    slots = int(os.getenv("DB_STREAMS", 4))
+    for _ in range(slots):
+        assert db.streams.acquire(blocking=False)
+    for _ in range(slots):
+        db.streams.release()
+
+
+def test_stream_query_errors_surface_immediately(db):
+    with pytest.raises(Exception):
+        db.stream_query("SELECT * FROM Findes_ikke")
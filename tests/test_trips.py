@@ -0,0 +1,131 @@
+import math
+from datetime import timedelta
+
+import pytest
+
+import geo
+import trips
+from conftest import BASE_TIME, count_rows, insert_fixes
+
+# ~150 m nordpå pr. fix, 15 s imellem: 10 m/s
+STEP_LAT = 150 / (math.radians(1) * geo.EARTH_RADIUS_M)
+
+
+@pytest.fixture
+def segmenter(db):
+    return trips.TripSegmenter(db, gap=600, radius=50, stationary=300)
+
+
+def drive(start, count, seconds=0, lat=55.0):
+    return [(lat + i * STEP_LAT, 12.0, start + timedelta(seconds=seconds + 15 * i)) for i in range(count)]
+
+
+def park(point, start, count):
+    return [(point[0] + (i % 2) * 0.00005, point[1], start + timedelta(seconds=15 * (i + 1))) for i in range(count)]
+
+
+def feed(segmenter, tracker_id, points):
+    segmenter.evaluate([(lat, long, tracker_id, timestamp) for lat, long, timestamp in points])
+    segmenter.db_connection.commit()
+
+
+def stored_trips(db, tracker_id):
+    db.execute_query("SELECT * FROM Trips WHERE Tracker_id = %s ORDER BY Start_tid", (tracker_id,))
+    return db.fetchall()
+
+
+def test_gap_ends_trip_at_last_fix(db, segmenter):
+    first = drive(BASE_TIME, 10)
+    second = drive(BASE_TIME + timedelta(hours=1), 4, lat=56.0)
+    feed(segmenter, "Tracker#1", first + second)
+
+    closed, open_trip = stored_trips(db, "Tracker#1")
+    assert (closed['Antal'], closed['Aaben'], closed['Start_tid'], closed['Slut_tid']) == (10, 0, first[0][2], first[-1][2])
+    assert closed['Distance_m'] == pytest.approx(geo.track_length(first))
+    assert (open_trip['Antal'], open_trip['Aaben'], open_trip['Start_tid']) == (4, 1, second[0][2])
+
+
+def test_stop_ends_trip_where_it_stopped_without_jitter(db, segmenter):
+    driving = drive(BASE_TIME, 5)
+    parked = park(driving[-1], driving[-1][2], 30)
+    feed(segmenter, "Tracker#1", driving + parked)
+
+    trip, = stored_trips(db, "Tracker#1")
+    assert (trip['Antal'], trip['Aaben'], trip['Slut_tid']) == (5, 0, driving[-1][2])
+    assert trip['Distance_m'] == pytest.approx(geo.track_length(driving))
+
+
+def test_leaving_the_parking_spot_starts_from_the_last_parked_fix(db, segmenter):
+    driving = drive(BASE_TIME, 5)
+    parked = park(driving[-1], driving[-1][2], 30)
+    leaving = drive(parked[-1][2], 3, seconds=15, lat=driving[-1][0] + STEP_LAT)
+    feed(segmenter, "Tracker#1", driving + parked + leaving)
+
+    _, second = stored_trips(db, "Tracker#1")
+    assert (second['Start_tid'], second['Antal'], second['Aaben']) == (parked[-1][2], 4, 1)
+
+
+def test_single_fix_trips_are_dropped(db, segmenter):
+    feed(segmenter, "Tracker#1", [(55.0, 12.0, BASE_TIME), (55.1, 12.0, BASE_TIME + timedelta(hours=2))])
+
+    trips_left = stored_trips(db, "Tracker#1")
+    assert [(trip['Start_tid'], trip['Antal']) for trip in trips_left] == [(BASE_TIME + timedelta(hours=2), 1)]
+
+
+def test_older_fixes_are_skipped(db, segmenter):
+    points = drive(BASE_TIME, 5)
+    feed(segmenter, "Tracker#1", points)
+    feed(segmenter, "Tracker#1", [(58.0, 12.0, BASE_TIME - timedelta(minutes=1))])
+
+    trip, = stored_trips(db, "Tracker#1")
+    assert trip['Antal'] == 5
+
+
+def test_checkpoint_continues_after_restart(db, segmenter):
+    points = drive(BASE_TIME, 10)
+    feed(segmenter, "Tracker#1", points[:6])
+
+    restarted = trips.TripSegmenter(db, gap=600, radius=50, stationary=300)
+    feed(restarted, "Tracker#1", points[6:])
+
+    trip, = stored_trips(db, "Tracker#1")
+    assert (trip['Antal'], trip['Aaben']) == (10, 1)
+    assert trip['Distance_m'] == pytest.approx(geo.track_length(points))
+
+
+def test_split_batches_give_the_same_trips(db, segmenter):
+    points = drive(BASE_TIME, 8) + park(drive(BASE_TIME, 8)[-1], BASE_TIME + timedelta(seconds=105), 25)
+    feed(segmenter, "Tracker#1", points)
+    for point in points:
+        feed(segmenter, "Tracker#2", [point])
+
+    one_batch = [(trip['Antal'], trip['Slut_tid'], round(trip['Distance_m'], 6)) for trip in stored_trips(db, "Tracker#1")]
+    one_by_one = [(trip['Antal'], trip['Slut_tid'], round(trip['Distance_m'], 6)) for trip in stored_trips(db, "Tracker#2")]
+    assert one_batch == one_by_one
+
+
+def test_two_processes_share_the_checkpoint(db, segmenter):
+    other = trips.TripSegmenter(db, gap=600, radius=50, stationary=300)
+    points = drive(BASE_TIME, 10)
+    for i, point in enumerate(points):
+        feed(segmenter if i % 2 else other, "Tracker#1", [point])
+
+    trip, = stored_trips(db, "Tracker#1")
+    assert (trip['Antal'], trip['Aaben']) == (10, 1)
+    assert trip['Distance_m'] == pytest.approx(geo.track_length(points))
+
+
+def test_failed_segmentation_leaves_no_partial_trip(db, segmenter, monkeypatch):
+    insert_fixes(db, "Tracker#1", [(55.0, 12.0, BASE_TIME)])
+    db.execute_query("INSERT INTO Lokation_log (latitude, longitude, Tracker_id, Tidspunkt) VALUES (%s, %s, %s, %s)",
+                     (55.1, 12.0, "Tracker#1", BASE_TIME + timedelta(seconds=15)))
+
+    def fail(tracker_id, state):
+        raise ValueError("checkpoint write failed")
+
+    monkeypatch.setattr(segmenter, "save", fail)
+    assert segmenter.evaluate([(55.0, 12.0, "Tracker#1", BASE_TIME)]) == []
+    db.commit()
+
+    assert stored_trips(db, "Tracker#1") == []
+    assert count_rows(db, "Lokation_log", "Tracker#1") == 2